@@ -0,0 +1,57 @@
+"""
+Compare two benchmark result files (from load.py or micro.py).
+
+    python bench/compare.py results/base.json results/head.json --threshold 0.1
+
+Prints the change in throughput and p50/p99 for every result present in
+both files and exits 1 if any of them regressed by more than --threshold
+(throughput down, or latency up, by that fraction).
+"""
+import argparse
+import json
+import sys
+
+# metric -> +1 if higher is better, -1 if lower is better
+METRICS = {"throughput_per_s": 1, "p50_ms": -1, "p99_ms": -1}
+
+
+def compare(base: dict, head: dict, threshold: float):
+    rows = []
+    regressions = []
+    for key in sorted(set(base["results"]) & set(head["results"])):
+        b, h = base["results"][key], head["results"][key]
+        if not b.get("count") or not h.get("count"):
+            continue
+        for metric, direction in METRICS.items():
+            if not b.get(metric):
+                continue
+            change = (h[metric] - b[metric]) / b[metric]
+            worse = -change * direction > threshold
+            rows.append((key, metric, b[metric], h[metric], change, worse))
+            if worse:
+                regressions.append((key, metric))
+    return rows, regressions
+
+
+def main(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print(f"base {base.get('commit')} ({base['timestamp']})  vs  head {head.get('commit')} ({head['timestamp']})")
+    rows, regressions = compare(base, head, args.threshold)
+    width = max((len(r[0]) for r in rows), default=0)
+    for key, metric, b, h, change, worse in rows:
+        flag = "  REGRESSION" if worse else ""
+        print(f"{key:<{width}}  {metric:<16} {b:>12.3f} -> {h:>12.3f}  {change:+7.1%}{flag}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("base")
+    p.add_argument("head")
+    p.add_argument("--threshold", type=float, default=0.1)
+    main(p.parse_args())
@@ -0,0 +1,190 @@
+"""
+End-to-end load generator for the webserver API.
+
+    python bench/load.py                              # in-process stack
+    python bench/load.py --target http://localhost:8000   # docker-compose stack
+    python bench/load.py --mix read=0.9,upload=0.08,delete=0.02 --zipf 1.2 --out results/run.json
+
+Seeds --photos photos, then runs --ops operations from --concurrency
+workers: reads pick photos by a Zipf(s) distribution over upload order,
+uploads draw their size from --sizes, deletes remove a random photo, and
+every --burst-every ops a burst of --burst-size uploads is fired at once.
+Prints and writes throughput and latency percentiles per operation.
+"""
+import argparse
+import asyncio
+import base64
+import bisect
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from results import summarize, write_results   # noqa: E402
+
+SIZE_UNITS = {"b": 1, "k": 1024, "m": 1024 * 1024}
+
+
+def parse_weights(text: str):
+    """'read=0.8,upload=0.2' -> [("read", 0.8), ("upload", 0.2)]"""
+    out = []
+    for part in text.split(","):
+        key, _, weight = part.partition("=")
+        out.append((key.strip(), float(weight)))
+    return out
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    if text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+class Zipf:
+    """Rank r (0-based) is drawn with probability proportional to 1 / (r + 1) ** s."""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cdf = []
+        total = 0.0
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** s
+            self.cdf.append(total)
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cdf, self.rng.random() * self.cdf[-1])
+
+
+class Workload:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.photos = []               # live photo ids, oldest first
+        self.samples = {"upload": [], "read": [], "delete": []}
+        self.errors = {"upload": 0, "read": 0, "delete": 0}
+        self.sizes = [(parse_size(s), w) for s, w in parse_weights(args.sizes)]
+        self.mix = parse_weights(args.mix)
+        self.payloads = {}             # size -> base64 body, built once
+        self.zipf = None
+
+    def _payload(self, size: int) -> str:
+        if size not in self.payloads:
+            self.payloads[size] = base64.b64encode(os.urandom(size)).decode()
+        return self.payloads[size]
+
+    def _pick(self, weighted):
+        items, weights = zip(*weighted)
+        return self.rng.choices(items, weights)[0]
+
+    async def _timed(self, op: str, coro):
+        start = time.perf_counter()
+        try:
+            resp = await coro
+            ok = resp.status_code < 400
+        except httpx.HTTPError:
+            resp, ok = None, False
+        self.samples[op].append(time.perf_counter() - start)
+        if not ok:
+            self.errors[op] += 1
+        return resp if ok else None
+
+    async def upload(self):
+        size = self._pick(self.sizes)
+        resp = await self._timed("upload", self.client.post(
+            "/upload", json={"data": self._payload(size), "photo_size": size}
+        ))
+        if resp is not None:
+            self.photos.append(resp.json()["photo_id"])
+
+    async def read(self):
+        if not self.photos:
+            return await self.upload()
+        if self.zipf is None:
+            self.zipf = Zipf(max(self.args.photos, 1), self.args.zipf, self.rng)
+        photo_id = self.photos[min(self.zipf.sample(), len(self.photos) - 1)]
+        await self._timed("read", self.client.get(f"/photo/{photo_id}"))
+
+    async def delete(self):
+        if len(self.photos) <= 1:
+            return await self.upload()
+        photo_id = self.photos.pop(self.rng.randrange(len(self.photos)))
+        await self._timed("delete", self.client.delete(f"/photo/{photo_id}"))
+
+    async def seed(self):
+        sem = asyncio.Semaphore(self.args.concurrency)
+
+        async def one():
+            async with sem:
+                await self.upload()
+        await asyncio.gather(*(one() for _ in range(self.args.photos)))
+        # seeding is not part of the measurement
+        self.samples = {op: [] for op in self.samples}
+        self.errors = {op: 0 for op in self.errors}
+
+    async def run(self):
+        queue = asyncio.Queue()
+        for i in range(self.args.ops):
+            if self.args.burst_every and i and i % self.args.burst_every == 0:
+                await queue.put("burst")
+            await queue.put(self._pick(self.mix))
+
+        async def worker():
+            while not queue.empty():
+                op = queue.get_nowait()
+                if op == "burst":
+                    await asyncio.gather(*(self.upload() for _ in range(self.args.burst_size)))
+                else:
+                    await getattr(self, op)()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return time.perf_counter() - start
+
+
+async def main(args):
+    if args.target:
+        client = httpx.AsyncClient(base_url=args.target, timeout=60)
+        stack = None
+    else:
+        from stack import InProcessStack
+        stack = InProcessStack(data_dir=args.data_dir)
+        await stack.__aenter__()
+        client = stack.client()
+    try:
+        workload = Workload(client, args)
+        await workload.seed()
+        elapsed = await workload.run()
+    finally:
+        await client.aclose()
+        if stack is not None:
+            await stack.__aexit__(None, None, None)
+
+    results = {
+        op: summarize(samples, elapsed, workload.errors[op])
+        for op, samples in workload.samples.items()
+    }
+    config = {k: v for k, v in vars(args).items() if k != "out"}
+    config["mode"] = "remote" if args.target else "in-process"
+    write_results("load", config, results, args.out)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--target", help="webserver base url; default runs the stack in-process")
+    p.add_argument("--data-dir", help="in-process data dir (default: a temp dir)")
+    p.add_argument("--photos", type=int, default=500, help="photos uploaded before measuring")
+    p.add_argument("--ops", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--mix", default="read=0.85,upload=0.1,delete=0.05")
+    p.add_argument("--sizes", default="4k=0.5,64k=0.4,1m=0.1", help="upload size distribution")
+    p.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of read popularity")
+    p.add_argument("--burst-every", type=int, default=0, help="fire an upload burst every N ops (0: never)")
+    p.add_argument("--burst-size", type=int, default=50)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="write JSON results here (default: bench/results/<name>-<time>.json)")
+    asyncio.run(main(p.parse_args()))
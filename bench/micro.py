@@ -0,0 +1,155 @@
+"""
+Micro-benchmarks for the storage layers, without HTTP.
+
+    python bench/micro.py --photos 10000 100000
+    python bench/micro.py --only store --photos 1000000 --size 1024
+
+store:     StoreEngine.write (concurrent, so group commit batches them),
+           StoreEngine.read (cold: page cache only, then hot: engine cache),
+           StoreEngine.mark_deleted, then one forced compaction.
+directory: DirectoryMeta alloc_replicas, confirm_upload, get,
+           mark_delete + confirm_delete.
+Each stage reports ops/s and latency percentiles per catalog size.
+"""
+import argparse
+import base64
+import importlib
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from results import summarize, write_results   # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_module(service: str, alias: str, module: str, data_dir: str):
+    """Import app/<module>.py of a service with DATA_DIR pointing at `data_dir`."""
+    os.environ["DATA_DIR"] = data_dir
+    for name in [m for m in sys.modules if m == alias or m.startswith(alias + ".")]:
+        del sys.modules[name]
+    package = types.ModuleType(alias)
+    package.__path__ = [str(ROOT / service / "app")]
+    sys.modules[alias] = package
+    try:
+        import prometheus_client
+        for collector in list(prometheus_client.REGISTRY._collector_to_names):
+            prometheus_client.REGISTRY.unregister(collector)
+    except ImportError:
+        pass
+    return importlib.import_module(f"{alias}.{module}")
+
+
+def timed(fn, items, threads: int = 1):
+    """Run fn(item) for every item; returns (latencies, elapsed)."""
+    def one(item):
+        start = time.perf_counter()
+        fn(item)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            latencies = list(pool.map(one, items))
+    else:
+        latencies = [one(item) for item in items]
+    return latencies, time.perf_counter() - start
+
+
+def bench_store(n: int, args, rng: random.Random):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-store-") as data_dir:
+        os.environ["NUM_VOLUMES"] = str(args.volumes)
+        engine_mod = load_module("store-service", f"bench_store_{n}", "engine", data_dir)
+        engine = engine_mod.StoreEngine()
+        payload = base64.b64encode(os.urandom(args.size)).decode()
+        ids = [f"P{i:012x}" for i in range(n)]
+        volumes = list(engine.volumes)
+
+        def write(i):
+            engine.write({"photo_id": ids[i], "volume_id": volumes[i % len(volumes)], "photo_data": payload})
+        lat, elapsed = timed(write, range(n), args.threads)
+        results["store.write"] = summarize(lat, elapsed)
+
+        reads = [ids[rng.randrange(n)] for _ in range(min(n, args.reads))]
+        engine.cache.clear()
+        lat, elapsed = timed(engine.read, reads)
+        results["store.read"] = summarize(lat, elapsed)
+        lat, elapsed = timed(engine.read, reads)
+        results["store.read_cached"] = summarize(lat, elapsed)
+
+        doomed = rng.sample(ids, int(n * args.delete_ratio))
+        lat, elapsed = timed(engine.mark_deleted, doomed, args.threads)
+        results["store.delete"] = summarize(lat, elapsed)
+
+        volume = engine.volumes[volumes[0]]
+        job = types.SimpleNamespace(total_bytes=0, copied_bytes=0, reclaimed_bytes=0)
+        start = time.perf_counter()
+        volume.compact(job, 0)
+        elapsed = time.perf_counter() - start
+        results["store.compact"] = dict(
+            summarize([elapsed], elapsed),
+            copied_mb=round(job.copied_bytes / 2 ** 20, 2),
+            reclaimed_mb=round(job.reclaimed_bytes / 2 ** 20, 2),
+        )
+    return results
+
+
+def bench_directory(n: int, args, rng: random.Random):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-dir-") as data_dir:
+        meta_mod = load_module("directory-service", f"bench_dir_{n}", "metadata", data_dir)
+        meta = meta_mod.DirectoryMeta()
+        allocated = []
+
+        def alloc(_):
+            allocated.append(meta.alloc_replicas(args.size))
+        lat, elapsed = timed(alloc, range(n))
+        results["directory.alloc"] = summarize(lat, elapsed)
+
+        lat, elapsed = timed(lambda a: meta.confirm_upload(a["photo_id"], a["replica_locations"]), allocated)
+        results["directory.confirm"] = summarize(lat, elapsed)
+
+        ids = [a["photo_id"] for a in allocated]
+        lat, elapsed = timed(meta.get, [ids[rng.randrange(n)] for _ in range(min(n, args.reads))])
+        results["directory.get"] = summarize(lat, elapsed)
+
+        def delete(photo_id):
+            meta.mark_delete(photo_id)
+            meta.confirm_delete(photo_id)
+        lat, elapsed = timed(delete, rng.sample(ids, int(n * args.delete_ratio)))
+        results["directory.delete"] = summarize(lat, elapsed)
+    return results
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    results = {}
+    for n in args.photos:
+        if args.only in (None, "store"):
+            for key, value in bench_store(n, args, rng).items():
+                results[f"{key}@{n}"] = value
+        if args.only in (None, "directory"):
+            for key, value in bench_directory(n, args, rng).items():
+                results[f"{key}@{n}"] = value
+    write_results("micro", {k: v for k, v in vars(args).items() if k != "out"}, results, args.out)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--photos", type=int, nargs="+", default=[10_000], help="catalog sizes to run at")
+    p.add_argument("--only", choices=["store", "directory"])
+    p.add_argument("--size", type=int, default=4096, help="photo size in bytes")
+    p.add_argument("--volumes", type=int, default=2)
+    p.add_argument("--threads", type=int, default=32, help="concurrent writers/deleters")
+    p.add_argument("--reads", type=int, default=100_000, help="reads per stage (at most --photos)")
+    p.add_argument("--delete-ratio", type=float, default=0.2)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out")
+    main(p.parse_args())
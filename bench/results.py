@@ -0,0 +1,69 @@
+"""Shared result format: one JSON document per run, comparable with compare.py."""
+import json
+import os
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def percentile(sorted_samples, q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(int(len(sorted_samples) * q), len(sorted_samples) - 1)]
+
+
+def summarize(samples, elapsed: float, errors: int = 0) -> dict:
+    """Latency samples (seconds) over `elapsed` seconds -> throughput and percentiles in ms."""
+    s = sorted(samples)
+    return {
+        "count": len(s),
+        "errors": errors,
+        "throughput_per_s": round(len(s) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(s) / len(s) * 1000, 3) if s else 0.0,
+        "p50_ms": round(percentile(s, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(s, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(s, 0.99) * 1000, 3),
+        "max_ms": round(s[-1] * 1000, 3) if s else 0.0,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parent, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name: str, config: dict, results: dict, out: str = None) -> Path:
+    doc = {
+        "benchmark": name,
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    if out:
+        path = Path(out)
+    else:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(doc, indent=2, sort_keys=True))
+
+    width = max(len(k) for k in results) if results else 0
+    for key, r in results.items():
+        print(
+            f"{key:<{width}}  n={r['count']:<8} err={r['errors']:<5} {r['throughput_per_s']:>10.1f}/s"
+            f"  p50={r['p50_ms']:.3f}ms  p99={r['p99_ms']:.3f}ms  max={r['max_ms']:.3f}ms"
+        )
+    print(f"-> {path}")
+    return path
@@ -0,0 +1,142 @@
+"""
+The four services wired together in one process, for benchmarks.
+
+Every service is imported from its source tree under its own package
+name, outbound httpx.AsyncClient calls are routed to the matching ASGI
+app by host:port (as in docker-compose), and Redis is replaced by
+fakeredis. Each app's lifespan runs, so background work (access flush,
+heat scheduler, directory sync, store heartbeats) is part of the run.
+"""
+import importlib
+import os
+import sys
+import tempfile
+import types
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SERVICES = {
+    # host:port used by the other services -> (source dir, package alias)
+    "directory-service:8001": ("directory-service", "bench_directory"),
+    "store-service:8002": ("store-service", "bench_store"),
+    "replication-manager:8003": ("replication-manager", "bench_rm"),
+    "webserver:8000": ("webserver", "bench_webserver"),
+}
+
+
+def _fresh_metrics_registry():
+    # every service registers the same metric names on the process-wide
+    # registry; in one process only the last service keeps its /metrics
+    try:
+        import prometheus_client
+    except ImportError:
+        return
+    for collector in list(prometheus_client.REGISTRY._collector_to_names):
+        prometheus_client.REGISTRY.unregister(collector)
+
+
+def _load(service: str, alias: str, data_dir: str):
+    os.environ["DATA_DIR"] = data_dir
+    package = types.ModuleType(alias)
+    package.__path__ = [str(ROOT / service / "app")]
+    sys.modules[alias] = package
+    _fresh_metrics_registry()
+    return importlib.import_module(alias + ".main")
+
+
+class _Router(httpx.AsyncBaseTransport):
+    """Routes by host:port to the apps in `apps`, which may still be filling up."""
+
+    def __init__(self, apps: dict):
+        self.apps = apps
+        self.transports = {}
+
+    async def handle_async_request(self, request):
+        host = f"{request.url.host}:{request.url.port}"
+        transport = self.transports.get(host)
+        if transport is None:
+            if host not in self.apps:
+                raise httpx.ConnectError(f"no in-process service at {host}")
+            transport = self.transports[host] = httpx.ASGITransport(app=self.apps[host])
+        return await transport.handle_async_request(request)
+
+
+class InProcessStack:
+    """
+    async with InProcessStack() as stack:
+        client = stack.client()   # talks to the webserver
+    """
+
+    def __init__(self, data_dir: str = None, env: dict = None):
+        self.data_dir = data_dir
+        self.env = env or {}
+        self._tmp = None
+        self._stack = AsyncExitStack()
+        self.apps = {}
+        self.modules = {}
+
+    async def __aenter__(self):
+        import fakeredis
+
+        if self.data_dir is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix="haystack-bench-")
+            self.data_dir = self._tmp.name
+        os.environ.update(self.env)
+        os.environ.setdefault("REGISTER_INTERVAL_SECONDS", "1")
+
+        # before the services are imported: some create their clients at
+        # import time (e.g. the replication manager's webhook client)
+        router = _Router(self.apps)
+        original_init = httpx.AsyncClient.__init__
+
+        def init(client, *args, **kwargs):
+            kwargs.pop("http2", None)
+            kwargs.setdefault("transport", router)
+            original_init(client, *args, **kwargs)
+
+        httpx.AsyncClient.__init__ = init
+        self._stack.callback(setattr, httpx.AsyncClient, "__init__", original_init)
+
+        for host, (service, alias) in SERVICES.items():
+            data_dir = os.path.join(self.data_dir, service)
+            os.makedirs(data_dir, exist_ok=True)
+            if service == "webserver":
+                # StaticFiles is mounted relative to the working directory
+                cwd = os.getcwd()
+                os.chdir(ROOT / service)
+                try:
+                    main = _load(service, alias, data_dir)
+                finally:
+                    os.chdir(cwd)
+            else:
+                main = _load(service, alias, data_dir)
+            self.apps[host] = main.app
+            self.modules[service] = sys.modules[alias + ".router"]
+
+        # one shared in-memory Redis for webserver and replication manager;
+        # the webserver reads photos as raw bytes, so it gets its own client
+        server = fakeredis.FakeServer()
+        redis = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        web = self.modules["webserver"]
+        rm = self.modules["replication-manager"]
+        web.r = web.photo_cache.r = fakeredis.FakeAsyncRedis(server=server, decode_responses=False)
+        # the heat tracker registers its Lua script on the client it is
+        # built with, so it is rebuilt rather than just handed a new client
+        rm.r = redis
+        rm.heat = rm.scheduler.heat = rm.HeatTracker(redis)
+        rm.scheduler.r = redis
+        for host, app in self.apps.items():
+            await self._stack.enter_async_context(app.router.lifespan_context(app))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._stack.aclose()
+        if self._tmp is not None:
+            self._tmp.cleanup()
+
+    def client(self, timeout: float = 60) -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url="http://webserver:8000", timeout=timeout)
@@ -0,0 +1,203 @@
+"""
+Time-to-first-request after a restart, at several catalog sizes.
+
+    python bench/startup.py --photos 10000 100000 1000000
+    python bench/startup.py --only store --photos 100000 --runs 5
+
+Each catalog is written once (in a separate process, which then exits
+like a stopped service). Every run then starts the service with uvicorn
+and times from process start until the readiness probe answers and a
+first lookup succeeds:
+
+store:          GET /store/ready, then GET /store/blob/{random photo};
+                the shared indexes are adopted from their checkpoints.
+store_rebuild:  the same after deleting the .hix files, i.e. the index
+                is rebuilt from the .idx files (as after a hard reboot).
+directory:      GET /directory/ready, then GET /directory/fetch/{random photo};
+                the volume registry comes from its checkpoint.
+
+`store` and `directory` should stay flat as --photos grows; `store_rebuild`
+shows what the checkpoint saves.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from micro import load_module               # noqa: E402
+from results import summarize, write_results   # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+BATCH = 10_000
+
+
+def photo_ids(n: int):
+    return [f"P{i:012x}" for i in range(n)]
+
+
+def populate_store(data_dir: str, n: int, size: int, volumes: int):
+    os.environ["NUM_VOLUMES"] = str(volumes)
+    engine = load_module("store-service", "startup_store", "engine", data_dir).StoreEngine()
+    data = os.urandom(size)
+    vids = list(engine.volumes)
+    ids = photo_ids(n)
+    for start in range(0, n, BATCH):
+        futs = []
+        for v, vid in enumerate(vids):
+            chunk = ids[start + v:start + BATCH:len(vids)]
+            futs += engine.volumes[vid].submit_many([(pid, 0, data) for pid in chunk])
+        for fut in futs:
+            fut.result()
+    engine.checkpoint()
+
+
+def populate_directory(data_dir: str, n: int, volumes: int):
+    meta = load_module("directory-service", "startup_dir", "metadata", data_dir).DirectoryMeta()
+    ids = photo_ids(n)
+    for start in range(0, n, BATCH):
+        meta._store.put_many({
+            pid: {"photo_id": pid, "deleted": False, "version": 1,
+                  "replicas": [{"store_id": "store-service", "volume": f"V{v + 1}"} for v in range(min(volumes, 2))]}
+            for pid in ids[start:start + BATCH]
+        })
+    meta.volumes.register({
+        "store_id": "store-service", "address": "http://store-service:8002",
+        "volumes": [{"volume_id": f"V{v + 1}", "capacity": 100 * 1024 ** 3, "used": 0} for v in range(volumes)],
+    })
+    meta.checkpoint_registry()
+
+
+def in_child(fn, *args):
+    """Run fn in a fresh process, so it releases its files and locks like a stopped service."""
+    proc = multiprocessing.get_context("spawn").Process(target=fn, args=args)
+    proc.start()
+    proc.join()
+    if proc.exitcode:
+        raise RuntimeError(f"{fn.__name__} failed with exit code {proc.exitcode}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_request(service: str, env: dict, ready: str, first: str, timeout: float):
+    """Seconds from spawning uvicorn until `ready` and `first` both answered 200."""
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT / service, env=dict(os.environ, **env),
+    )
+    try:
+        with httpx.Client(base_url=base, timeout=5) as client:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"{service} exited with {proc.returncode}")
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"{service} not ready after {timeout}s")
+                try:
+                    if client.get(ready).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+            resp = client.get(first)
+            elapsed = time.perf_counter() - start
+            resp.raise_for_status()
+            return elapsed
+    finally:
+        # SIGTERM: a clean shutdown, so the lifespan checkpoints again
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def runs(args, fn):
+    samples = []
+    errors = 0
+    for _ in range(args.runs):
+        try:
+            samples.append(fn())
+        except (RuntimeError, TimeoutError, httpx.HTTPError) as exc:
+            print(f"  run failed: {exc}", file=sys.stderr)
+            errors += 1
+    return summarize(samples, sum(samples), errors)
+
+
+def bench_store(n: int, args, rng: random.Random):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-startup-store-") as data_dir:
+        in_child(populate_store, data_dir, n, args.size, args.volumes)
+        env = {
+            "DATA_DIR": data_dir, "NUM_VOLUMES": str(args.volumes),
+            # no directory to heartbeat to
+            "DIR_SVC": "http://127.0.0.1:9", "REGISTER_INTERVAL_SECONDS": "3600",
+        }
+        ids = photo_ids(n)
+
+        def start():
+            first = f"/store/blob/{ids[rng.randrange(n)]}"
+            return time_to_first_request("store-service", env, "/store/ready", first, args.timeout)
+        results["startup.store"] = runs(args, start)
+
+        def start_rebuild():
+            for path in Path(data_dir).glob("*.hix"):
+                path.unlink()
+            return start()
+        results["startup.store_rebuild"] = runs(args, start_rebuild)
+    return results
+
+
+def bench_directory(n: int, args, rng: random.Random):
+    with tempfile.TemporaryDirectory(prefix="bench-startup-dir-") as data_dir:
+        in_child(populate_directory, data_dir, n, args.volumes)
+        env = {"DATA_DIR": data_dir, "REBALANCE_INTERVAL_SECONDS": "3600"}
+        ids = photo_ids(n)
+
+        def start():
+            first = f"/directory/fetch/{ids[rng.randrange(n)]}"
+            return time_to_first_request("directory-service", env, "/directory/ready", first, args.timeout)
+        return {"startup.directory": runs(args, start)}
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    results = {}
+    for n in args.photos:
+        if args.only in (None, "store"):
+            for key, value in bench_store(n, args, rng).items():
+                results[f"{key}@{n}"] = value
+        if args.only in (None, "directory"):
+            for key, value in bench_directory(n, args, rng).items():
+                results[f"{key}@{n}"] = value
+    write_results("startup", {k: v for k, v in vars(args).items() if k != "out"}, results, args.out)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--photos", type=int, nargs="+", default=[10_000, 100_000], help="catalog sizes to run at")
+    p.add_argument("--only", choices=["store", "directory"])
+    p.add_argument("--size", type=int, default=1024, help="photo size in bytes")
+    p.add_argument("--volumes", type=int, default=2)
+    p.add_argument("--runs", type=int, default=3, help="restarts per service and catalog size")
+    p.add_argument("--timeout", type=float, default=600, help="seconds to wait for one start")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out")
+    main(p.parse_args())
@@ -1,5 +1,21 @@
-from fastapi import FastAPI, HTTPException
-from .router import router
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from .router import router, meta, rebalancer
+from . import metrics
 
-app = FastAPI(title="Directory Service")
-app.include_router(router)
\ No newline at end of file
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    rebalancer.start()
+    checkpoint = asyncio.create_task(meta.checkpoint_loop())
+    yield
+    checkpoint.cancel()
+    await rebalancer.stop()
+    meta.checkpoint_registry()
+
+app = FastAPI(title="Directory Service", lifespan=lifespan)
+app.include_router(router)
+# /metrics + X-Trace-Id propagation
+metrics.install(app)
+metrics.register_meta(meta)
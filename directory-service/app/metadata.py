@@ -1,11 +1,32 @@
+import os
+import time
 import uuid
 import json
+import asyncio
+import threading
+from collections import deque
 from pathlib import Path
 from typing import Dict, Any
 from os import getenv
 
-DATA_FILE = Path('/app/data/directory.json')
-DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+from .shards import ShardedKV
+from .volumes import VolumeRegistry, REPLICA_COUNT
+
+DATA_DIR = Path(getenv('DATA_DIR', '/app/data'))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+# Pre-SQLite catalog; only read once to migrate
+DATA_FILE = DATA_DIR / 'directory.json'
+
+DIRECTORY_SHARDS = int(getenv('DIRECTORY_SHARDS', '8'))
+# NORMAL: WAL frames are fsynced at checkpoints; FULL: at every commit
+DIRECTORY_SYNC = getenv('DIRECTORY_SYNC', 'NORMAL')
+# recent mutations kept for clients that cache entries (see changes_since)
+CHANGELOG_SIZE = int(getenv('DIRECTORY_CHANGELOG_SIZE', '100000'))
+# the directory_entries gauge may lag the catalog by this long
+COUNT_TTL = float(getenv('DIRECTORY_COUNT_TTL_SECONDS', '60'))
+# store/volume registry checkpoint, so placement works right after a restart
+REGISTRY_FILE = DATA_DIR / 'volumes.json'
+REGISTRY_CHECKPOINT_INTERVAL = float(getenv('REGISTRY_CHECKPOINT_SECONDS', '10'))
 
 class DirectoryMeta:
     # def __init__(self):
@@ -17,83 +38,234 @@ class DirectoryMeta:
     #         except Exception:
     #             self._store = {}
     def __init__(self):
-        # existing metadata
-        self._store = {}
-        
-        # replication helpers
-        self.photos = {}  # photo_id -> list of replicas
-        self.volumes = [{"volume": f"V{i+1}", "free": True} for i in range(10)]
-
-        # load existing store from file
+        started = time.monotonic()
+        # photo_id -> metadata, sharded SQLite (WAL) instead of one JSON file;
+        # opening it reads nothing, pages come in as entries are looked up
+        self._store = ShardedKV(DATA_DIR, DIRECTORY_SHARDS, DIRECTORY_SYNC, COUNT_TTL)
+
+        # volumes reported by store nodes (capacity, used bytes, read-only)
+        self.volumes = VolumeRegistry()
+        self.registry_source = "empty"
+        self._restore_registry()
+
+        # change feed: (seq, photo_id, version) of every mutation since
+        # `epoch` started; a new epoch tells clients to drop their caches
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.changes = deque(maxlen=CHANGELOG_SIZE)
+        self.changes_lock = threading.Lock()
+
         if DATA_FILE.exists():
+            self._migrate_json()
+        self.startup_seconds = time.monotonic() - started
+
+    def _migrate_json(self):
+        try:
+            legacy = json.loads(DATA_FILE.read_text())
+        except Exception:
+            legacy = {}
+        if legacy and self._store.is_empty():
+            self._store.put_many(legacy)
+        DATA_FILE.rename(DATA_FILE.with_suffix('.json.migrated'))
+
+    # -----------------------------
+    # REGISTRY CHECKPOINT
+    # -----------------------------
+    def _restore_registry(self):
+        try:
+            stores = json.loads(REGISTRY_FILE.read_text())
+        except (OSError, ValueError):
+            return
+        self.volumes.restore(stores)
+        if stores:
+            self.registry_source = "checkpoint"
+
+    def checkpoint_registry(self):
+        """Write the registry to REGISTRY_FILE (tmp + rename, never half written)."""
+        tmp = REGISTRY_FILE.with_suffix('.json.tmp')
+        tmp.write_text(json.dumps(self.volumes.snapshot()))
+        os.replace(tmp, REGISTRY_FILE)
+
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(REGISTRY_CHECKPOINT_INTERVAL)
             try:
-                self._store = json.loads(DATA_FILE.read_text())
-                # populate photos from store if any
-                for pid, entry in self._store.items():
-                    self.photos[pid] = entry.get("replicas", [])
-            except Exception:
-                self._store = {}
+                self.checkpoint_registry()
+            except OSError:
+                # disk trouble: keep the previous checkpoint, retry next tick
+                pass
+
+    def readiness(self):
+        """
+        Ready unless the catalog has photos but no store is known yet (no
+        checkpoint and no heartbeat): uploads would get the single-node
+        fallback placement. Lookups are served either way.
+        """
+        ready = self.volumes.has_volumes() or self._store.is_empty()
+        return {
+            "status": "ready" if ready else "waiting_for_stores",
+            "startup_seconds": round(self.startup_seconds, 4),
+            # where the registry came from at startup: "checkpoint" or "empty"
+            "registry": self.registry_source,
+            "stores": len(self.volumes.stores),
+        }
 
-    def _persist(self):
-        DATA_FILE.write_text(json.dumps(self._store))
+    def _changed(self, photo_id: str, version):
+        with self.changes_lock:
+            self.seq += 1
+            self.changes.append((self.seq, photo_id, version))
+
+    def _save(self, photo_id: str, entry: dict):
+        """Persist an updated entry under a new version and publish the change."""
+        entry['version'] = entry.get('version', 0) + 1
+        self._store.put(photo_id, entry)
+        self._changed(photo_id, entry['version'])
+
+    def changes_since(self, epoch: str, since: int):
+        """
+        Mutations after `since` in this epoch. `reset` means the caller
+        missed changes (other epoch, or fell out of the changelog) and
+        must drop everything it cached.
+        """
+        with self.changes_lock:
+            oldest = self.changes[0][0] if self.changes else self.seq + 1
+            reset = epoch != self.epoch or since > self.seq or since + 1 < oldest
+            changes = [] if reset else [
+                {"photo_id": pid, "version": version}
+                for seq, pid, version in self.changes if seq > since
+            ]
+            return {"epoch": self.epoch, "seq": self.seq, "reset": reset, "changes": changes}
 
     def alloc_replicas(self, photo_size: int):
-        # simple allocation: choose two store ids (store-service is single node here)
         photo_id = f"P{uuid.uuid4().hex[:12]}"
-        # For demo, create two replica entries pointing to the same store node.
-        replicas = [
-            {"store_id":"store-service","volume":"V1"},
-            {"store_id":"store-service","volume":"V2"}
-        ]
-        self._store[photo_id] = {"photo_id":photo_id,"replicas":replicas,"deleted":False}
-        self._persist()
+        if self.volumes.has_volumes():
+            # capacity/load/failure-domain aware placement
+            replicas = self.volumes.allocate(photo_size, REPLICA_COUNT, key=photo_id)
+            if replicas is None:
+                return None
+        else:
+            # no store has registered yet: single-node defaults
+            replicas = [
+                {"store_id":"store-service","volume":"V1"},
+                {"store_id":"store-service","volume":"V2"}
+            ]
+        self._store.put(photo_id, {"photo_id":photo_id,"replicas":replicas,"deleted":False,"version":1,"size":photo_size})
         return {"photo_id":photo_id,"replica_locations":replicas}
 
+    def alloc_replicas_batch(self, photo_sizes: list):
+        """alloc_replicas for many photos, stored with one transaction per shard."""
+        allocations = []
+        entries = {}
+        for size in photo_sizes:
+            photo_id = f"P{uuid.uuid4().hex[:12]}"
+            if self.volumes.has_volumes():
+                replicas = self.volumes.allocate(size, REPLICA_COUNT, key=photo_id)
+                if replicas is None:
+                    return None
+            else:
+                replicas = [
+                    {"store_id":"store-service","volume":"V1"},
+                    {"store_id":"store-service","volume":"V2"}
+                ]
+            entries[photo_id] = {"photo_id":photo_id,"replicas":replicas,"deleted":False,"version":1,"size":size}
+            allocations.append({"photo_id":photo_id,"replica_locations":replicas})
+        self._store.put_many(entries)
+        return allocations
+
+    def confirm_upload_batch(self, photos: list):
+        """[{"photo_id", "replicas"}] -> number of entries updated."""
+        replicas = {p['photo_id']: p['replicas'] for p in photos}
+        entries = self._store.get_many(list(replicas))
+        for photo_id, entry in entries.items():
+            entry['replicas'] = replicas[photo_id]
+            entry['version'] = entry.get('version', 0) + 1
+        self._store.put_many(entries)
+        for photo_id, entry in entries.items():
+            self._changed(photo_id, entry['version'])
+        return len(entries)
+
     def confirm_upload(self, photo_id: str, replicas: list):
-        if photo_id in self._store:
-            self._store[photo_id]['replicas'] = replicas
-            self._persist()
+        entry = self._store.get(photo_id)
+        if entry:
+            entry['replicas'] = replicas
+            self._save(photo_id, entry)
 
     def get(self, photo_id: str):
         return self._store.get(photo_id)
 
+    def get_many(self, photo_ids):
+        return self._store.get_many(photo_ids)
+
+    def approx_count(self):
+        """Catalog size, refreshed in the background at most every COUNT_TTL (None until known)."""
+        return self._store.approx_count()
+
+    def iter_entries(self, batch: int = 500):
+        """Every entry, shard by shard in key order."""
+        return self._store.scan(batch)
+
     def mark_delete(self, photo_id: str):
         entry = self._store.get(photo_id)
         if not entry:
             return None
         entry['deleted'] = True
-        self._persist()
+        self._save(photo_id, entry)
         return entry
 
     def confirm_delete(self, photo_id: str):
-        if photo_id in self._store:
-            del self._store[photo_id]
-            self._persist()
+        self._store.delete(photo_id)
+        self._changed(photo_id, None)
 
      # -----------------------------
     # REPLICATION HELPERS
     # -----------------------------
 
-    def get_free_locations(self, count):
-        free_vols = [v for v in self.volumes if v["free"]][:count]
-        for v in free_vols:
-            v["free"] = False
-        return {"locations": free_vols}
+    def get_free_locations(self, count, photo_id=None, photo_size=0):
+        """
+        Volumes for `count` extra replicas of a photo, never one that
+        already holds it. Space is reserved the same way as for uploads.
+        """
+        entry = self._store.get(photo_id) if photo_id else None
+        exclude = [(r.get("store_id"), r["volume"]) for r in (entry or {}).get("replicas", [])]
+        locations = self.volumes.allocate(photo_size, count, exclude, key=photo_id)
+        return {"locations": locations or []}
 
     def add_replicas(self, photo_id, replicas):
-        if photo_id not in self.photos:
-            self.photos[photo_id] = []
-        self.photos[photo_id].extend(replicas)
+        entry = self._store.get(photo_id)
+        if not entry:
+            return
+        entry['replicas'].extend(replicas)
+        self._save(photo_id, entry)
 
     def remove_half_replicas(self, photo_id):
         """
         Directory decides which replicas to remove.
         Returns list of replicas to remove.
         """
-        curr_replicas = self.photos.get(photo_id, [])
+        entry = self._store.get(photo_id)
+        if not entry:
+            return []
+        curr_replicas = entry['replicas']
         half_count = len(curr_replicas) // 2
         to_remove = curr_replicas[:half_count]
-        self.photos[photo_id] = curr_replicas[half_count:]
-        for r in to_remove:
-            r["free"] = True
-        return to_remove
\ No newline at end of file
+        entry['replicas'] = curr_replicas[half_count:]
+        self._save(photo_id, entry)
+        # the store frees the bytes on compaction and reports them on its next heartbeat
+        return to_remove
+
+    def move_replica(self, photo_id, version, old, new):
+        """
+        Swap replica `old` for `new` if the entry is still at `version`
+        and not deleted (rebalancing). Returns the new version, or None
+        when the caller lost a race and should drop the copy it made.
+        """
+        entry = self._store.get(photo_id)
+        if not entry or entry.get('deleted') or entry.get('version') != version:
+            return None
+        replicas = entry['replicas']
+        for i, r in enumerate(replicas):
+            if r.get('store_id') == old.get('store_id') and r['volume'] == old['volume']:
+                replicas[i] = new
+                self._save(photo_id, entry)
+                return entry['version']
+        return None
@@ -0,0 +1,233 @@
+import os
+import time
+import asyncio
+import httpx
+
+from .metrics import httpx_hooks, REBALANCE_MOVES
+
+REBALANCE_INTERVAL = float(os.getenv('REBALANCE_INTERVAL_SECONDS', '10'))
+# the ring must be unchanged this long before a pass starts, so stores
+# registering one by one (e.g. after a restart) cause one pass, not many
+REBALANCE_SETTLE = float(os.getenv('REBALANCE_SETTLE_SECONDS', '30'))
+# a pass with failed moves is retried after this long
+REBALANCE_RETRY = float(os.getenv('REBALANCE_RETRY_SECONDS', '300'))
+# moves in flight / started per second, so rebalancing never crowds out uploads and reads
+REBALANCE_CONCURRENCY = int(os.getenv('REBALANCE_CONCURRENCY', '4'))
+REBALANCE_MAX_MOVES_PER_SEC = float(os.getenv('REBALANCE_MAX_MOVES_PER_SEC', '50'))
+REBALANCE_TIMEOUT = float(os.getenv('REBALANCE_TIMEOUT', '60'))
+
+
+class Rebalancer:
+    """
+    Moves replicas to the stores the hash ring wants, in the background.
+
+    Once the ring has changed (a store joined, was drained or went away)
+    and stayed stable for REBALANCE_SETTLE, a pass walks the catalog. For
+    each replica on the wrong store, a store holding the photo copies the
+    needle to a volume on the right store (/store/replicate, store to
+    store), the entry gets the new replica and the old copy is deleted.
+    Consistent hashing keeps the moved share near replicas/N per store
+    added or removed. A pass restarts if the ring changes under it.
+    """
+
+    def __init__(self, meta):
+        self.meta = meta
+        self.registry = meta.volumes
+        self.done_version = 0       # ring version the last clean pass ran for
+        self.next_pass_at = 0.0
+        self.running = False
+        self.scanned = 0
+        self.moved = 0
+        self.failed = 0
+        self.last_pass = None
+        self._client = None
+        self._task = None
+
+    # -------------------------
+    # PASS
+    # -------------------------
+    async def run_pass(self):
+        version = self.registry.ring.version
+        self.running = True
+        self.scanned = 0
+        failed_before = self.failed
+        started = time.time()
+        slots = asyncio.Semaphore(REBALANCE_CONCURRENCY)
+        pace = 1 / REBALANCE_MAX_MOVES_PER_SEC if REBALANCE_MAX_MOVES_PER_SEC > 0 else 0
+        tasks = set()
+        aborted = False
+        try:
+            for _, entry in self.meta.iter_entries():
+                if self.registry.ring.version != version:
+                    aborted = True
+                    break
+                self.scanned += 1
+                if self.scanned % 1000 == 0:
+                    await asyncio.sleep(0)      # let requests in between catalog pages
+                if entry.get('deleted'):
+                    continue
+                moves = self.registry.misplaced(entry)
+                if not moves:
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(self._move(entry, moves))
+                task.add_done_callback(lambda t: (slots.release(), tasks.discard(t)))
+                tasks.add(task)
+                if pace:
+                    await asyncio.sleep(pace * len(moves))
+            if tasks:
+                await asyncio.gather(*list(tasks), return_exceptions=True)
+        finally:
+            self.running = False
+        clean = not aborted and self.failed == failed_before
+        if clean:
+            self.done_version = version
+        else:
+            self.next_pass_at = time.time() + (0 if aborted else REBALANCE_RETRY)
+        self.last_pass = {
+            "ring_version": version,
+            "started_at": started,
+            "finished_at": time.time(),
+            "scanned": self.scanned,
+            "status": "aborted" if aborted else "done" if clean else "failed_moves",
+        }
+
+    async def _move(self, entry: dict, moves: list):
+        photo_id = entry['photo_id']
+        version = entry.get('version')
+        replicas = entry['replicas']
+        size = entry.get('size')
+        if size is None:
+            # entries from before sizes were recorded: ask a replica
+            size = await self._size(photo_id, replicas)
+            if size is None:
+                REBALANCE_MOVES.labels("copy_failed").inc()
+                self.failed += 1
+                return
+        for replica, target in moves:
+            loc = await self._copy(photo_id, size, replicas, replica, target)
+            if loc is None:
+                self.failed += 1
+                return
+            version = self.meta.move_replica(photo_id, version, replica, loc)
+            if version is None:
+                # deleted or changed meanwhile: our copy is garbage
+                REBALANCE_MOVES.labels("raced").inc()
+                await self._delete(photo_id, loc)
+                return
+            if self.registry.alive(replica.get('store_id')):
+                await self._delete(photo_id, replica)
+            replicas[replicas.index(replica)] = loc
+            self.moved += 1
+            REBALANCE_MOVES.labels("moved").inc()
+
+    async def _size(self, photo_id: str, replicas: list):
+        """Photo size from the first replica that answers a one-byte Range read, or None."""
+        for r in replicas:
+            address = self.registry.address(r.get('store_id'))
+            if not address or not self.registry.alive(r.get('store_id')):
+                continue
+            try:
+                resp = await self._client.get(
+                    f"{address}/store/blob/{photo_id}", params={"volume_id": r['volume']},
+                    headers={"Range": "bytes=0-0"},
+                )
+            except httpx.HTTPError:
+                continue
+            if resp.status_code in (206, 416):
+                # "bytes 0-0/<size>", or "bytes */0" for an empty photo
+                try:
+                    return int(resp.headers.get('content-range', '').rpartition('/')[2])
+                except ValueError:
+                    continue
+            if resp.status_code == 200:
+                return len(resp.content)
+        return None
+
+    async def _copy(self, photo_id: str, size: int, replicas: list, replica: dict, target: str):
+        """Copy the photo onto a volume of `target`; the new replica dict, or None."""
+        exclude = [(r.get('store_id'), r['volume']) for r in replicas]
+        # reserve the photo's size, so full and read-only volumes are skipped
+        loc = self.registry.allocate_on(target, size, exclude)
+        if loc is None:
+            REBALANCE_MOVES.labels("no_room").inc()
+            return None
+        # the replica that is leaving is the preferred source: it is not
+        # serving for long anyway
+        sources = [replica] + [r for r in replicas if r is not replica]
+        for source in sources:
+            if not self.registry.alive(source.get('store_id')):
+                continue
+            copy = {
+                "photo_id": photo_id, "source_volume": source['volume'],
+                "target_store_id": loc['store_id'], "target_address": self.registry.address(loc['store_id']),
+                "target_volume": loc['volume'],
+            }
+            try:
+                resp = await self._client.post(
+                    f"{self.registry.address(source['store_id'])}/store/replicate",
+                    json={"copies": [copy], "wait": True},
+                )
+                results = resp.json()['job']['results']
+            except (httpx.HTTPError, ValueError, KeyError):
+                continue
+            if results and results[0]['status'] == 'success':
+                return loc
+        REBALANCE_MOVES.labels("copy_failed").inc()
+        return None
+
+    async def _delete(self, photo_id: str, replica: dict):
+        address = self.registry.address(replica.get('store_id'))
+        if not address:
+            return
+        try:
+            await self._client.post(f"{address}/store/delete/{photo_id}", json={"volume_id": replica['volume']})
+        except httpx.HTTPError:
+            # left behind as garbage; the needle is never read again
+            pass
+
+    # -------------------------
+    # LOOP
+    # -------------------------
+    async def _run(self):
+        while True:
+            try:
+                self.registry.refresh()
+                ring = self.registry.ring
+                now = time.time()
+                if (ring.version != self.done_version and now >= self.next_pass_at
+                        and now - ring.changed_at >= REBALANCE_SETTLE):
+                    await self.run_pass()
+            except Exception:
+                # store or catalog trouble: try again next tick
+                pass
+            await asyncio.sleep(REBALANCE_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._client = httpx.AsyncClient(timeout=REBALANCE_TIMEOUT, event_hooks=httpx_hooks())
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self._client.aclose()
+
+    def status(self):
+        ring = self.registry.ring
+        return {
+            "ring_version": ring.version,
+            "ring_stores": ring.members,
+            "ring_changed_at": ring.changed_at,
+            "balanced_version": self.done_version,
+            "running": self.running,
+            "scanned": self.scanned,
+            "moved": self.moved,
+            "failed": self.failed,
+            "last_pass": self.last_pass,
+        }
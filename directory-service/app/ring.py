@@ -0,0 +1,60 @@
+import bisect
+import hashlib
+import time
+from os import getenv
+
+# points per unit of store weight; more points = smoother spread
+RING_VNODES = int(getenv('RING_VNODES', '128'))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring of store nodes with virtual nodes.
+
+    Each store owns RING_VNODES x weight points on a 64-bit ring; a photo
+    belongs to the stores met walking clockwise from hash(photo_id).
+    Adding or removing a store only changes the owners of the arcs next
+    to its points, so about 1/N of the photos move when the Nth store
+    joins, and they move from every other store evenly.
+    """
+
+    def __init__(self):
+        self.points = []      # sorted vnode hashes
+        self.owners = []      # store_id of points[i]
+        self.members = {}     # store_id -> weight
+        self.version = 0
+        self.changed_at = time.time()
+
+    def build(self, members: dict):
+        """Rebuild from {store_id: weight}; a no-op when nothing changed."""
+        if members == self.members:
+            return False
+        ring = sorted(
+            (_hash(f"{store_id}#{i}"), store_id)
+            for store_id, weight in members.items()
+            for i in range(max(int(RING_VNODES * weight), 1))
+        )
+        self.points = [h for h, _ in ring]
+        self.owners = [store_id for _, store_id in ring]
+        self.members = dict(members)
+        self.version += 1
+        self.changed_at = time.time()
+        return True
+
+    def preference(self, key: str):
+        """Distinct store_ids in ring order starting at hash(key)."""
+        if not self.points:
+            return []
+        start = bisect.bisect(self.points, _hash(key))
+        seen = []
+        for i in range(len(self.points)):
+            store_id = self.owners[(start + i) % len(self.points)]
+            if store_id not in seen:
+                seen.append(store_id)
+                if len(seen) == len(self.members):
+                    break
+        return seen
@@ -1,14 +1,30 @@
 from fastapi import APIRouter, Body
 from .metadata import DirectoryMeta
+from .rebalance import Rebalancer
 from fastapi import HTTPException
+from fastapi.responses import JSONResponse
 
 router = APIRouter()
 meta = DirectoryMeta()
+# moves replicas after the store ring changes
+rebalancer = Rebalancer(meta)
+
+@router.get('/directory/ready')
+async def directory_ready():
+    """
+    Readiness probe. 503 while the catalog has photos but no store is
+    known (no registry checkpoint, no heartbeat yet); lookups work anyway.
+    """
+    result = meta.readiness()
+    return JSONResponse(result, status_code=200 if result["status"] == "ready" else 503)
 
 @router.post('/directory/upload')
 async def directory_upload(payload: dict = Body(...)):
     size = payload.get('photo_size')
-    return meta.alloc_replicas(size)
+    result = meta.alloc_replicas(size)
+    if result is None:
+        raise HTTPException(status_code=507, detail='no writable volume with enough free space')
+    return result
 
 @router.post('/directory/upload/confirm')
 async def upload_confirm(payload: dict = Body(...)):
@@ -17,6 +33,19 @@ async def upload_confirm(payload: dict = Body(...)):
     meta.confirm_upload(photo_id, replicas)
     return {"status":"metadata_saved"}
 
+@router.post('/directory/upload/batch')
+async def directory_upload_batch(payload: dict = Body(...)):
+    """{"photo_sizes": [...]} -> {"allocations": [{"photo_id", "replica_locations"}]} in the same order"""
+    allocations = meta.alloc_replicas_batch(payload.get('photo_sizes', []))
+    if allocations is None:
+        raise HTTPException(status_code=507, detail='no writable volume with enough free space')
+    return {"allocations": allocations}
+
+@router.post('/directory/upload/confirm_batch')
+async def upload_confirm_batch(payload: dict = Body(...)):
+    saved = meta.confirm_upload_batch(payload.get('photos', []))
+    return {"status":"metadata_saved","count":saved}
+
 @router.get('/directory/fetch/{photo_id}')
 async def directory_fetch(photo_id: str):
     entry = meta.get(photo_id)
@@ -24,6 +53,18 @@ async def directory_fetch(photo_id: str):
         raise HTTPException(status_code=404, detail='not found')
     return entry
 
+@router.post('/directory/fetch_batch')
+async def directory_fetch_batch(payload: dict = Body(...)):
+    """{"photo_ids": [...]} -> {"entries": {photo_id: entry}, "missing": [...]}"""
+    photo_ids = list(dict.fromkeys(payload.get('photo_ids', [])))
+    entries = meta.get_many(photo_ids)
+    return {"entries": entries, "missing": [pid for pid in photo_ids if pid not in entries]}
+
+@router.get('/directory/changes')
+async def directory_changes(since: int = 0, epoch: str = ""):
+    """Change feed for client-side caches of directory entries."""
+    return meta.changes_since(epoch, since)
+
 @router.delete('/directory/delete/{photo_id}')
 async def directory_delete(photo_id: str):
     entry = meta.mark_delete(photo_id)
@@ -43,7 +84,34 @@ async def get_free_locations(payload: dict = Body(...)):
     Return free volumes for replication.
     """
     count = payload.get("count", 1)
-    return meta.get_free_locations(count)
+    return meta.get_free_locations(count, payload.get("photo_id"), payload.get("photo_size", 0))
+
+@router.post("/directory/volumes/register")
+async def register_volumes(payload: dict = Body(...)):
+    """
+    Heartbeat from a store node:
+    {"store_id", "address", "failure_domain", "volumes": [{"volume_id", "capacity", "used", "read_only"}]}
+    """
+    return meta.volumes.register(payload)
+
+@router.get("/directory/volumes")
+async def list_volumes():
+    return {"stores": meta.volumes.list()}
+
+@router.post("/directory/stores/{store_id}/drain")
+async def drain_store(store_id: str, payload: dict = Body(None)):
+    """
+    Take a store off the placement ring ({"draining": false} puts it back);
+    the rebalancer then moves its photos to the other stores.
+    """
+    result = meta.volumes.drain(store_id, (payload or {}).get("draining", True))
+    if result is None:
+        raise HTTPException(status_code=404, detail='unknown store')
+    return result
+
+@router.get("/directory/rebalance")
+async def rebalance_status():
+    return rebalancer.status()
 
 @router.post("/directory/add_replicas")
 async def add_replicas(payload: dict = Body(...)):
@@ -0,0 +1,138 @@
+import json
+import time
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+
+from .metrics import PERSIST_LATENCY
+
+
+class ShardedKV:
+    """
+    photo_id -> JSON document, spread over N SQLite files by crc32(key).
+
+    Each shard runs in WAL mode, so a mutation is one appended WAL frame
+    (O(1), independent of catalog size) and SQLite checkpoints the log into
+    the main file in the background; startup just opens the files.
+    """
+
+    def __init__(self, data_dir: Path, shards: int, synchronous: str = "NORMAL", count_ttl: float = 60):
+        self.conns = []
+        self.locks = []
+        # approx_count: last full count, when it was taken, recount in flight
+        self.count_ttl = count_ttl
+        self._count = None
+        self._counted_at = 0.0
+        self._counting = threading.Lock()
+        for i in range(shards):
+            conn = sqlite3.connect(
+                str(data_dir / f"directory-{i:02d}.db"),
+                check_same_thread=False,
+                isolation_level=None,   # autocommit: one statement, one transaction
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={synchronous}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+            )
+            self.conns.append(conn)
+            self.locks.append(threading.Lock())
+
+    def _shard(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % len(self.conns)
+
+    def get(self, key: str):
+        i = self._shard(key)
+        with self.locks[i]:
+            row = self.conns[i].execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, keys):
+        """{key: document} for the keys that exist, one query per shard."""
+        by_shard = {}
+        for key in keys:
+            by_shard.setdefault(self._shard(key), []).append(key)
+        found = {}
+        for i, shard_keys in by_shard.items():
+            marks = ",".join("?" * len(shard_keys))
+            with self.locks[i]:
+                rows = self.conns[i].execute(
+                    f"SELECT key, value FROM kv WHERE key IN ({marks})", shard_keys
+                ).fetchall()
+            for key, value in rows:
+                found[key] = json.loads(value)
+        return found
+
+    def put(self, key: str, value: dict):
+        i = self._shard(key)
+        with self.locks[i], PERSIST_LATENCY.labels("put").time():
+            self.conns[i].execute(
+                "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def put_many(self, items: dict):
+        by_shard = {}
+        for key, value in items.items():
+            by_shard.setdefault(self._shard(key), []).append((key, json.dumps(value)))
+        for i, rows in by_shard.items():
+            with self.locks[i], PERSIST_LATENCY.labels("put_many").time():
+                conn = self.conns[i]
+                conn.execute("BEGIN")
+                try:
+                    conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", rows)
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+
+    def delete(self, key: str):
+        i = self._shard(key)
+        with self.locks[i], PERSIST_LATENCY.labels("delete").time():
+            self.conns[i].execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def scan(self, batch: int = 500):
+        """Yield (key, document) for every key, shard by shard in key order, `batch` rows per query."""
+        for conn, lock in zip(self.conns, self.locks):
+            after = ""
+            while True:
+                with lock:
+                    rows = conn.execute(
+                        "SELECT key, value FROM kv WHERE key > ? ORDER BY key LIMIT ?", (after, batch)
+                    ).fetchall()
+                for key, value in rows:
+                    yield key, json.loads(value)
+                if len(rows) < batch:
+                    break
+                after = rows[-1][0]
+
+    def count(self) -> int:
+        total = 0
+        for conn, lock in zip(self.conns, self.locks):
+            with lock:
+                total += conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        return total
+
+    def approx_count(self):
+        """
+        Entry count as of at most `count_ttl` ago (None until the first
+        count). A stale value starts a recount in a background thread, so
+        callers such as metrics scrapes never wait on COUNT(*) over every shard.
+        """
+        if time.monotonic() - self._counted_at > self.count_ttl and self._counting.acquire(blocking=False):
+            threading.Thread(target=self._recount, daemon=True).start()
+        return self._count
+
+    def _recount(self):
+        try:
+            self._count = self.count()
+            self._counted_at = time.monotonic()
+        finally:
+            self._counting.release()
+
+    def is_empty(self) -> bool:
+        for conn, lock in zip(self.conns, self.locks):
+            with lock:
+                if conn.execute("SELECT 1 FROM kv LIMIT 1").fetchone():
+                    return False
+        return True
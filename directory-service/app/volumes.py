@@ -0,0 +1,382 @@
+import heapq
+import threading
+import time
+from collections import Counter
+from os import getenv
+
+from .ring import HashRing
+
+REPLICA_COUNT = int(getenv('REPLICA_COUNT', '2'))
+# a volume stops taking new photos once less than this is left
+VOLUME_READONLY_MARGIN = int(getenv('VOLUME_READONLY_MARGIN_BYTES', str(64 * 1024 * 1024)))
+# stores that have not heartbeated for this long get no new writes
+STORE_STALE_AFTER = float(getenv('STORE_STALE_AFTER_SECONDS', '60'))
+# stores that have not heartbeated for this long leave the hash ring, and
+# their photos are re-replicated elsewhere
+STORE_REMOVE_AFTER = float(getenv('STORE_REMOVE_AFTER_SECONDS', '600'))
+
+
+class VolumeInfo:
+    __slots__ = ("store_id", "volume_id", "capacity", "used", "pending", "read_only", "version")
+
+    def __init__(self, store_id, volume_id):
+        self.store_id = store_id
+        self.volume_id = volume_id
+        self.capacity = 0
+        self.used = 0
+        self.pending = 0      # bytes allocated since the store last reported `used`
+        self.read_only = False
+        self.version = 0
+
+    @property
+    def free(self):
+        return self.capacity - self.used - self.pending
+
+    def writable(self, size=0):
+        return not self.read_only and self.free - size >= VOLUME_READONLY_MARGIN
+
+    def to_dict(self):
+        return {
+            "store_id": self.store_id,
+            "volume": self.volume_id,
+            "capacity": self.capacity,
+            "used": self.used,
+            "pending": self.pending,
+            "free": self.free,
+            "read_only": self.read_only or not self.writable(),
+        }
+
+
+class StoreInfo:
+    def __init__(self, store_id):
+        self.store_id = store_id
+        self.address = None
+        self.failure_domain = store_id
+        self.weight = 1.0
+        self.draining = False
+        self.last_seen = 0.0
+        self.volumes = {}     # volume_id -> VolumeInfo
+        # (pending bytes, -free bytes, volume_id, version): least loaded first,
+        # most free space breaks ties; entries with an old version are stale
+        self.heap = []
+
+    def push(self, vol: VolumeInfo):
+        vol.version += 1
+        if vol.writable():
+            heapq.heappush(self.heap, (vol.pending, -vol.free, vol.volume_id, vol.version))
+
+    def alive(self, now):
+        return now - self.last_seen <= STORE_STALE_AFTER
+
+    def in_ring(self, now):
+        return not self.draining and now - self.last_seen <= STORE_REMOVE_AFTER
+
+
+class VolumeRegistry:
+    """
+    Volumes reported by store nodes, with capacity and used bytes.
+
+    Photos are placed by a consistent-hash ring of the stores (see
+    ring.py): replicas go to the first stores met from hash(photo_id),
+    skipping stores that are down or full. Each store keeps a heap of
+    its writable volumes ordered by the bytes handed out since the last
+    heartbeat, so consecutive uploads rotate over volumes instead of
+    hammering the same append file. Replicas of one photo go to distinct
+    failure domains first, then distinct stores, then any distinct
+    volume.
+    """
+
+    def __init__(self):
+        self.stores = {}      # store_id -> StoreInfo
+        self.ring = HashRing()
+        self.lock = threading.Lock()
+
+    def register(self, payload: dict):
+        store_id = payload["store_id"]
+        with self.lock:
+            store = self.stores.get(store_id)
+            if store is None:
+                store = self.stores[store_id] = StoreInfo(store_id)
+            store.address = payload.get("address", store.address)
+            store.failure_domain = payload.get("failure_domain") or store_id
+            store.weight = float(payload.get("weight", store.weight))
+            store.last_seen = time.time()
+            for v in payload.get("volumes", []):
+                vol = store.volumes.get(v["volume_id"])
+                if vol is None:
+                    vol = store.volumes[v["volume_id"]] = VolumeInfo(store_id, v["volume_id"])
+                vol.capacity = int(v["capacity"])
+                vol.used = int(v["used"])
+                vol.pending = 0
+                vol.read_only = bool(v.get("read_only", False))
+                store.push(vol)
+            # rebuild from scratch now and then so stale entries do not pile up
+            if len(store.heap) > 4 * max(len(store.volumes), 1):
+                store.heap = []
+                for vol in store.volumes.values():
+                    store.push(vol)
+            self._build_ring(store.last_seen)
+        return {"store_id": store_id, "volumes": len(store.volumes)}
+
+    def _build_ring(self, now):
+        self.ring.build({
+            store.store_id: store.weight
+            for store in self.stores.values() if store.in_ring(now)
+        })
+
+    def refresh(self):
+        """Drop stores silent for STORE_REMOVE_AFTER from the ring."""
+        with self.lock:
+            self._build_ring(time.time())
+
+    def drain(self, store_id, draining=True):
+        """
+        Take a store out of the ring (or put it back). A draining store gets
+        no new photos but keeps serving reads while its photos move away.
+        """
+        with self.lock:
+            store = self.stores.get(store_id)
+            if store is None:
+                return None
+            store.draining = draining
+            self._build_ring(time.time())
+        return {"store_id": store_id, "draining": draining, "ring_version": self.ring.version}
+
+    def has_volumes(self):
+        return any(store.volumes for store in self.stores.values())
+
+    def address(self, store_id):
+        store = self.stores.get(store_id)
+        return store.address if store else None
+
+    def alive(self, store_id):
+        store = self.stores.get(store_id)
+        return store is not None and store.alive(time.time())
+
+    def placement(self, key: str, count: int):
+        """
+        Store ids the ring wants `count` replicas of `key` on, regardless
+        of liveness and free space: distinct failure domains first, then
+        distinct stores, then stores again in ring order.
+        """
+        with self.lock:
+            order = [self.stores[s] for s in self.ring.preference(key)]
+        chosen = []
+        domains = set()
+        for store in order:
+            if len(chosen) < count and store.failure_domain not in domains:
+                chosen.append(store.store_id)
+                domains.add(store.failure_domain)
+        for store in order:
+            if len(chosen) < count and store.store_id not in chosen:
+                chosen.append(store.store_id)
+        i = 0
+        while order and len(chosen) < count:
+            chosen.append(order[i % len(order)].store_id)
+            i += 1
+        return chosen
+
+    def misplaced(self, entry: dict):
+        """[(replica, target store_id)]: replicas of `entry` the ring wants elsewhere."""
+        replicas = entry.get("replicas", [])
+        desired = Counter(self.placement(entry["photo_id"], len(replicas)))
+        surplus = Counter(r["store_id"] for r in replicas) - desired
+        missing = list((desired - Counter(r["store_id"] for r in replicas)).elements())
+        moves = []
+        for replica in replicas:
+            if missing and surplus[replica["store_id"]] > 0:
+                surplus[replica["store_id"]] -= 1
+                moves.append((replica, missing.pop(0)))
+        return moves
+
+    def _best(self, store: StoreInfo, size: int, exclude: set):
+        """Pop the least loaded writable volume of `store` that fits `size`."""
+        skipped = []
+        found = None
+        while store.heap:
+            entry = heapq.heappop(store.heap)
+            vol = store.volumes.get(entry[2])
+            if vol is None or entry[3] != vol.version or not vol.writable():
+                continue    # stale entry
+            if (store.store_id, vol.volume_id) in exclude or not vol.writable(size):
+                skipped.append(entry)
+                continue
+            found = (entry, vol)
+            break
+        for entry in skipped:
+            heapq.heappush(store.heap, entry)
+        return found
+
+    def _take(self, store: StoreInfo, vol: VolumeInfo, size: int):
+        vol.pending += size
+        store.push(vol)
+        return {"store_id": store.store_id, "volume": vol.volume_id}
+
+    def _allocate_ring(self, key: str, size: int, count: int, exclude: set, now):
+        """allocate() along the ring order of `key`; caller holds the lock."""
+        order = [self.stores[s] for s in self.ring.preference(key)]
+        taken_stores = {store_id for store_id, _ in exclude}
+        taken_domains = {self.stores[s].failure_domain for s in taken_stores if s in self.stores}
+        chosen = []
+        # 0: new failure domain, 1: new store, 2: any volume
+        for spread in (0, 1, 2):
+            progress = True
+            while progress and len(chosen) < count:
+                progress = False
+                for store in order:
+                    if len(chosen) == count:
+                        break
+                    if not store.alive(now):
+                        continue
+                    if spread == 0 and store.failure_domain in taken_domains:
+                        continue
+                    if spread == 1 and store.store_id in taken_stores:
+                        continue
+                    found = self._best(store, size, exclude)
+                    if found is None:
+                        continue
+                    chosen.append(self._take(store, found[1], size))
+                    exclude.add((store.store_id, found[1].volume_id))
+                    taken_domains.add(store.failure_domain)
+                    taken_stores.add(store.store_id)
+                    progress = spread == 2
+        return chosen
+
+    def allocate_on(self, store_id: str, size: int, exclude=()):
+        """One volume on `store_id` for `size` bytes (rebalancing), or None."""
+        with self.lock:
+            store = self.stores.get(store_id)
+            if store is None or not store.alive(time.time()):
+                return None
+            found = self._best(store, int(size or 0), set(exclude))
+            if found is None:
+                return None
+            return self._take(store, found[1], int(size or 0))
+
+    def allocate(self, size: int, count: int = REPLICA_COUNT, exclude=(), key: str = None):
+        """
+        Pick `count` volumes for a photo of `size` bytes, skipping the
+        (store_id, volume) pairs in `exclude`. With `key` (the photo id)
+        stores are tried in ring order, otherwise least loaded first.
+        Returns replica dicts, or None when fewer than `count` writable
+        volumes are left.
+        """
+        size = int(size or 0)
+        exclude = set(exclude)
+        now = time.time()
+        with self.lock:
+            if key is not None and self.ring.points:
+                chosen = self._allocate_ring(key, size, count, exclude, now)
+                if len(chosen) < count:
+                    self._release(chosen, size)
+                    return None
+                return chosen
+            taken_domains = set()
+            taken_stores = set()
+            chosen = []
+            # 0: new failure domain, 1: new store, 2: any volume
+            for spread in (0, 1, 2):
+                while len(chosen) < count:
+                    best = None
+                    for store in self.stores.values():
+                        if not store.alive(now):
+                            continue
+                        if spread == 0 and store.failure_domain in taken_domains:
+                            continue
+                        if spread == 1 and store.store_id in taken_stores:
+                            continue
+                        found = self._best(store, size, exclude)
+                        if found is None:
+                            continue
+                        if best is None or found[0] < best[1][0]:
+                            if best is not None:
+                                heapq.heappush(best[0].heap, best[1][0])
+                            best = (store, found)
+                        else:
+                            heapq.heappush(store.heap, found[0])
+                    if best is None:
+                        break
+                    store, (_, vol) = best
+                    vol.pending += size
+                    store.push(vol)
+                    exclude.add((store.store_id, vol.volume_id))
+                    taken_domains.add(store.failure_domain)
+                    taken_stores.add(store.store_id)
+                    chosen.append({"store_id": store.store_id, "volume": vol.volume_id})
+                if len(chosen) == count:
+                    break
+
+            if len(chosen) < count:
+                self._release(chosen, size)
+                return None
+        return chosen
+
+    def _release(self, chosen, size):
+        # hand the reservations back
+        for replica in chosen:
+            store = self.stores[replica["store_id"]]
+            vol = store.volumes[replica["volume"]]
+            vol.pending -= size
+            store.push(vol)
+
+    # -------------------------
+    # CHECKPOINT
+    # -------------------------
+    def snapshot(self):
+        """Stores and volumes as plain data, for the registry checkpoint."""
+        with self.lock:
+            return [
+                {
+                    "store_id": store.store_id,
+                    "address": store.address,
+                    "failure_domain": store.failure_domain,
+                    "weight": store.weight,
+                    "draining": store.draining,
+                    "last_seen": store.last_seen,
+                    "volumes": [
+                        {"volume_id": vol.volume_id, "capacity": vol.capacity,
+                         "used": vol.used, "read_only": vol.read_only}
+                        for vol in store.volumes.values()
+                    ],
+                }
+                for store in self.stores.values()
+            ]
+
+    def restore(self, stores: list):
+        """
+        Re-create the stores of a checkpoint, keeping their last heartbeat
+        time, so placement works before the first heartbeat after a
+        restart; heartbeats then take over.
+        """
+        with self.lock:
+            for s in stores:
+                store = self.stores[s["store_id"]] = StoreInfo(s["store_id"])
+                store.address = s.get("address")
+                store.failure_domain = s.get("failure_domain") or store.store_id
+                store.weight = float(s.get("weight", 1.0))
+                store.draining = bool(s.get("draining", False))
+                store.last_seen = float(s.get("last_seen", 0.0))
+                for v in s.get("volumes", []):
+                    vol = store.volumes[v["volume_id"]] = VolumeInfo(store.store_id, v["volume_id"])
+                    vol.capacity = int(v["capacity"])
+                    vol.used = int(v["used"])
+                    vol.read_only = bool(v.get("read_only", False))
+                    store.push(vol)
+            self._build_ring(time.time())
+
+    def list(self):
+        now = time.time()
+        with self.lock:
+            return [
+                {
+                    "store_id": store.store_id,
+                    "address": store.address,
+                    "failure_domain": store.failure_domain,
+                    "weight": store.weight,
+                    "alive": store.alive(now),
+                    "draining": store.draining,
+                    "in_ring": store.store_id in self.ring.members,
+                    "volumes": [vol.to_dict() for vol in store.volumes.values()],
+                }
+                for store in self.stores.values()
+            ]
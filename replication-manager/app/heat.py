@@ -0,0 +1,87 @@
+import os
+import math
+import time
+
+# Heat is an exponentially decayed access count: every access adds 1 and
+# the total halves every HEAT_HALF_LIFE seconds.
+HEAT_HALF_LIFE = float(os.getenv('HEAT_HALF_LIFE_SECONDS', '600'))
+HEAT_DECAY = math.log(2) / HEAT_HALF_LIFE
+# photos colder than this are dropped from the heat set
+HEAT_PRUNE_BELOW = float(os.getenv('HEAT_PRUNE_BELOW', '0.05'))
+# keeps `now * HEAT_DECAY` small so sorted-set scores stay precise
+HEAT_EPOCH = 1_700_000_000
+
+HEAT_KEY = "heat"
+
+# The sorted set stores z = ln(heat) + HEAT_DECAY * t instead of heat:
+# z does not change while a photo is idle, yet heat(now) = exp(z - HEAT_DECAY * now),
+# so "heat >= H" is just "z >= ln(H) + HEAT_DECAY * now" (one ZRANGEBYSCORE).
+_ADD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local decay = tonumber(ARGV[2])
+local out = {}
+for i = 3, #ARGV, 2 do
+  local pid = ARGV[i]
+  local heat = tonumber(ARGV[i + 1])
+  local z = redis.call('ZSCORE', KEYS[1], pid)
+  if z then
+    heat = heat + math.exp(tonumber(z) - decay * now)
+  end
+  redis.call('ZADD', KEYS[1], math.log(heat) + decay * now, pid)
+  out[#out + 1] = tostring(heat)
+end
+return out
+"""
+
+
+def _now() -> float:
+    return time.time() - HEAT_EPOCH
+
+
+def z_for(heat: float, now: float) -> float:
+    return math.log(heat) + HEAT_DECAY * now
+
+
+def heat_from(z: float, now: float) -> float:
+    return math.exp(z - HEAT_DECAY * now)
+
+
+class HeatTracker:
+    """Decayed per-photo access counters kept in one Redis sorted set."""
+
+    def __init__(self, redis_client):
+        self.r = redis_client
+        self._add = redis_client.register_script(_ADD_SCRIPT)
+
+    async def add(self, counts: dict) -> dict:
+        """Add {photo_id: n} accesses in one round trip; returns the new heat per photo."""
+        if not counts:
+            return {}
+        args = [_now(), HEAT_DECAY]
+        for photo_id, n in counts.items():
+            args += [photo_id, int(n)]
+        result = await self._add(keys=[HEAT_KEY], args=args)
+        return {pid: float(h) for pid, h in zip(counts, result)}
+
+    async def hot(self, threshold: float, limit: int = None):
+        """[(photo_id, heat)] for photos at or above `threshold` (all of them without `limit`), hottest first."""
+        now = _now()
+        page = {} if limit is None else {"start": 0, "num": limit}
+        rows = await self.r.zrevrangebyscore(
+            HEAT_KEY, "+inf", z_for(threshold, now), withscores=True, **page
+        )
+        return [(pid, heat_from(z, now)) for pid, z in rows]
+
+    async def get_many(self, photo_ids):
+        """{photo_id: heat}; photos never seen (or pruned) have heat 0."""
+        if not photo_ids:
+            return {}
+        now = _now()
+        scores = await self.r.zmscore(HEAT_KEY, photo_ids)
+        return {
+            pid: heat_from(z, now) if z is not None else 0.0
+            for pid, z in zip(photo_ids, scores)
+        }
+
+    async def prune(self):
+        return await self.r.zremrangebyscore(HEAT_KEY, "-inf", z_for(HEAT_PRUNE_BELOW, _now()))
@@ -1,4 +1,18 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .router import router
-app = FastAPI(title='Replication Manager')
-app.include_router(router)
\ No newline at end of file
+from .router import router, r, scheduler, webhook
+from . import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler.start()
+    yield
+    await scheduler.stop()
+    await webhook.aclose()
+    await r.aclose()
+
+app = FastAPI(title='Replication Manager', lifespan=lifespan)
+app.include_router(router)
+# /metrics + X-Trace-Id propagation
+metrics.install(app)
\ No newline at end of file
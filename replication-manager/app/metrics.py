@@ -0,0 +1,95 @@
+import time
+import uuid
+import contextvars
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from starlette.responses import Response
+
+# -------------------------
+# TRACING
+# -------------------------
+# The trace id of the request being handled; sent on every upstream call
+# and echoed in the response, so one slow request can be followed hop by hop.
+TRACE_HEADER = "X-Trace-Id"
+trace_id = contextvars.ContextVar("trace_id", default=None)
+
+# -------------------------
+# METRICS
+# -------------------------
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent serving a request, by route",
+    ["method", "route", "status"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Time until an upstream call returned its headers",
+    ["upstream", "route", "status"],
+)
+TRIGGERS_FIRED = Counter("rm_triggers_fired_total", "replicate_up/replicate_down sent to the webserver", ["action"])
+TRIGGERS_FAILED = Counter("rm_triggers_failed_total", "replicate_up/replicate_down the webserver did not complete", ["action"])
+ACCESS_EVENTS = Counter("rm_access_events_total", "Photo accesses added to the heat tracker")
+EVALUATION_SECONDS = Histogram("rm_evaluation_duration_seconds", "Time of one scheduler round")
+
+
+def _route_of(path: str) -> str:
+    # first two segments only: ids in paths would explode the label space
+    return "/" + "/".join(path.strip("/").split("/")[:2])
+
+
+async def _on_request(request):
+    tid = trace_id.get()
+    if tid:
+        request.headers[TRACE_HEADER] = tid
+    request.extensions["started"] = time.perf_counter()
+
+
+async def _on_response(response):
+    request = response.request
+    UPSTREAM_LATENCY.labels(
+        request.url.host, _route_of(request.url.path), str(response.status_code)
+    ).observe(time.perf_counter() - request.extensions["started"])
+
+
+def httpx_hooks():
+    """event_hooks for httpx.AsyncClient: trace propagation + upstream latency."""
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: adopts the caller's X-Trace-Id (or starts a trace),
+    echoes it in the response and records the request latency under the
+    matched route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tid = dict(scope["headers"]).get(TRACE_HEADER.lower().encode(), b"").decode() or uuid.uuid4().hex[:16]
+        token = trace_id.set(tid)
+        status = [500]
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(TRACE_HEADER.encode(), tid.encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, str(status[0])).observe(time.perf_counter() - start)
+            trace_id.reset(token)
+
+
+async def metrics_endpoint(request):
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def install(app):
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
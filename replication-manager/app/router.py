@@ -1,53 +1,90 @@
 from fastapi import APIRouter, Body
 import os
 import httpx
-import redis
+import redis.asyncio as aioredis
+from .heat import HeatTracker
+from .scheduler import ReplicationScheduler, PhotoMissing, HIGH, target_replicas
+from .metrics import httpx_hooks, ACCESS_EVENTS
 
 router = APIRouter()
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'cache')
 REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
 
-HIGH = int(os.getenv('REPLICATION_THRESHOLD_HIGH', '10'))
-LOW = int(os.getenv('REPLICATION_THRESHOLD_LOW', '2'))
-
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+r = aioredis.Redis(connection_pool=aioredis.ConnectionPool(
+    host=REDIS_HOST, port=REDIS_PORT, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS
+))
 WEBHOOK = os.getenv('WEBHOOK_URL', 'http://webserver:8000')
 
+# one keep-alive client for all webhook calls
+webhook = httpx.AsyncClient(base_url=WEBHOOK, timeout=30, event_hooks=httpx_hooks())
+
+
+class TriggerFailed(Exception):
+    """The webserver did not complete a replicate_up/replicate_down."""
+
+
+async def _send_trigger(photo_id: str, action: str):
+    resp = await webhook.post(
+        "/internal/replication/trigger",
+        json={
+            "photo_id": photo_id,
+            "action": action
+        }
+    )
+    # the webserver reports failures as 200 {"status": "error", "reason": ...}
+    body = resp.json() if resp.status_code == 200 else {}
+    if body.get("reason") == "photo not found":
+        raise PhotoMissing(f"{action} {photo_id}: photo not found")
+    if body.get("status") != f"{action}_done":
+        raise TriggerFailed(f"{action} {photo_id}: HTTP {resp.status_code} {body.get('reason', '')}".strip())
+
+heat = HeatTracker(r)
+scheduler = ReplicationScheduler(r, heat, _send_trigger)
+
 
 @router.post("/access/update")
 async def access_update(payload: dict = Body(...)):
     """
-    Called by webserver whenever a photo is viewed.
-    Tracks access count in Redis.
-    Triggers replicate_up or replicate_down to webserver.
+    Called whenever a photo is viewed.
+    Adds the access to the photo's decayed heat in Redis; replication
+    decisions are taken by the background scheduler, not inline.
     """
     photo_id = payload["photo_id"]
-    key = f"access:{photo_id}"
+    heats = await heat.add({photo_id: 1})
+    ACCESS_EVENTS.inc()
+    return {"status": "ok", "heat": heats[photo_id]}
+
+
+@router.post("/access/bulk_update")
+async def access_bulk_update(payload: dict = Body(...)):
+    """
+    Called by webserver with access counts aggregated over a short window:
+    {"counts": {photo_id: n}}. All heats are updated with one Lua call
+    (one Redis round trip).
+    """
+    counts = payload.get("counts", {})
+    ACCESS_EVENTS.inc(sum(counts.values()))
+    return {"status": "ok", "heat": await heat.add(counts)}
 
-    count = r.incr(key)
-    r.expire(key, 3600)  # 1 hour access window
 
-    async with httpx.AsyncClient() as client:
-        if count >= HIGH:
-            await client.post(
-                f"{WEBHOOK}/internal/replication/trigger",
-                json={
-                    "photo_id": photo_id,
-                    "action": "replicate_up"
-                }
-            )
+@router.get("/access/hot")
+async def access_hot(limit: int = 100):
+    """Hottest photos with their current heat and target replica count."""
+    rows = await heat.hot(HIGH, limit)
+    return {"photos": [
+        {"photo_id": pid, "heat": h, "target_replicas": target_replicas(h)} for pid, h in rows
+    ]}
 
-        elif count <= LOW:
-            await client.post(
-                f"{WEBHOOK}/internal/replication/trigger",
-                json={
-                    "photo_id": photo_id,
-                    "action": "replicate_down"
-                }
-            )
 
-    return {"status": "ok", "count": count}
+@router.post("/replication/evaluate")
+async def replication_evaluate():
+    """Run one scheduler round now instead of waiting for the next tick."""
+    actions = await scheduler.evaluate()
+    return {"status": "ok", "actions": [
+        {"photo_id": pid, "action": action, "replicas": level} for pid, action, level in actions
+    ]}
 
 
 @router.post("/replication/trigger")
@@ -55,7 +92,6 @@ async def manual_trigger(payload: dict = Body(...)):
     """
     Manually trigger replication operation.
     """
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{WEBHOOK}/internal/replication/trigger", json=payload)
+    await webhook.post("/internal/replication/trigger", json=payload)
 
     return {"status": "triggered"}
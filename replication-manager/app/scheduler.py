@@ -0,0 +1,157 @@
+import os
+import math
+import asyncio
+import time
+
+from .heat import HEAT_KEY
+from .metrics import TRIGGERS_FIRED, TRIGGERS_FAILED, EVALUATION_SECONDS
+
+HIGH = int(os.getenv('REPLICATION_THRESHOLD_HIGH', '10'))
+LOW = int(os.getenv('REPLICATION_THRESHOLD_LOW', '2'))
+
+MIN_REPLICAS = int(os.getenv('MIN_REPLICAS', '2'))
+MAX_REPLICAS = int(os.getenv('MAX_REPLICAS', '6'))
+EVAL_INTERVAL = float(os.getenv('REPLICATION_EVAL_INTERVAL_SECONDS', '5'))
+COOLDOWN = float(os.getenv('REPLICATION_COOLDOWN_SECONDS', '300'))
+MAX_ACTIONS_PER_ROUND = int(os.getenv('REPLICATION_MAX_ACTIONS_PER_ROUND', '100'))
+# a failed replicate_up/down is retried after this long instead of
+# COOLDOWN, doubling with every further failure up to RETRY_BACKOFF_MAX
+RETRY_BACKOFF = float(os.getenv('REPLICATION_RETRY_SECONDS', '30'))
+RETRY_BACKOFF_MAX = float(os.getenv('REPLICATION_RETRY_MAX_SECONDS', '3600'))
+
+# photo_id -> replica count the manager has scaled the photo to (only
+# photos above MIN_REPLICAS are listed)
+LEVEL_KEY = "rm:level"
+# set (with TTL = cooldown) whenever a replicate_up/down is sent for a photo
+COOLDOWN_PREFIX = "rm:cooldown:"
+# photo_id -> failed actions in a row (only photos whose last action failed)
+FAILURES_KEY = "rm:failures"
+# only one replication manager instance evaluates per round
+LEADER_KEY = "rm:scheduler"
+
+
+class PhotoMissing(Exception):
+    """Raised by the trigger when the webserver does not know the photo (anymore)."""
+
+
+def target_replicas(heat: float) -> int:
+    """Replica count for a given heat: one extra replica per doubling above HIGH."""
+    if heat < HIGH:
+        return MIN_REPLICAS
+    return min(MAX_REPLICAS, MIN_REPLICAS + 1 + int(math.log2(heat / HIGH)))
+
+
+class ReplicationScheduler:
+    """
+    Periodically compares heat with the replica level of each photo and
+    sends at most one replicate_up/replicate_down per photo per cooldown.
+
+    Hysteresis: a photo scales up when its heat asks for more replicas
+    than it has (heat >= HIGH), but only scales down once heat falls to
+    LOW or below, and never below MIN_REPLICAS. Work per round is bounded
+    by the number of hot and scaled-up photos, not by request volume.
+    """
+
+    def __init__(self, redis_client, heat, trigger):
+        self.r = redis_client
+        self.heat = heat
+        self.trigger = trigger      # async callable(photo_id, action)
+        self.triggers_fired = {"replicate_up": 0, "replicate_down": 0}
+        self.triggers_failed = {"replicate_up": 0, "replicate_down": 0}
+        self._task = None
+
+    async def evaluate(self):
+        # every hot photo: most of the hottest may already be at their target
+        hot = dict(await self.heat.hot(HIGH))
+        levels = {pid: int(v) for pid, v in (await self.r.hgetall(LEVEL_KEY)).items()}
+
+        # scaled-up photos that are not hot anymore may need to scale down
+        cooling = [pid for pid in levels if pid not in hot]
+        heats = dict(hot)
+        heats.update(await self.heat.get_many(cooling))
+
+        candidates = []
+        for pid, heat in heats.items():
+            level = levels.get(pid, MIN_REPLICAS)
+            if target_replicas(heat) > level:
+                candidates.append((pid, "replicate_up", level + 1))
+            elif heat <= LOW and level > MIN_REPLICAS:
+                # the directory drops half of the replicas on replicate_down
+                candidates.append((pid, "replicate_down", max(MIN_REPLICAS, level - level // 2)))
+        if not candidates:
+            return []
+
+        cooling_down = await self.r.mget([COOLDOWN_PREFIX + pid for pid, _, _ in candidates])
+        actions = [
+            c for c, blocked in zip(candidates, cooling_down) if blocked is None
+        ][:MAX_ACTIONS_PER_ROUND]
+        if not actions:
+            return []
+
+        # cooldown first, so another instance taking over the next round
+        # does not send the same action while this one is in flight
+        async with self.r.pipeline(transaction=False) as pipe:
+            for pid, _, _ in actions:
+                pipe.set(COOLDOWN_PREFIX + pid, 1, ex=max(int(COOLDOWN), 1))
+            await pipe.execute()
+
+        outcomes = await asyncio.gather(
+            *(self.trigger(pid, action) for pid, action, _ in actions), return_exceptions=True
+        )
+        failures = await self.r.hmget(FAILURES_KEY, [pid for pid, _, _ in actions])
+        done = []
+        async with self.r.pipeline(transaction=False) as pipe:
+            for (pid, action, new_level), outcome, failed in zip(actions, outcomes, failures):
+                if isinstance(outcome, Exception):
+                    self.triggers_failed[action] += 1
+                    TRIGGERS_FAILED.labels(action).inc()
+                    if isinstance(outcome, PhotoMissing):
+                        # deleted or never existed: stop tracking it at all
+                        pipe.zrem(HEAT_KEY, pid)
+                        pipe.hdel(LEVEL_KEY, pid)
+                        pipe.hdel(FAILURES_KEY, pid)
+                        pipe.delete(COOLDOWN_PREFIX + pid)
+                        continue
+                    # level unchanged; try again after an increasing backoff
+                    backoff = min(RETRY_BACKOFF * 2 ** int(failed or 0), RETRY_BACKOFF_MAX)
+                    pipe.set(COOLDOWN_PREFIX + pid, 1, ex=max(int(backoff), 1))
+                    pipe.hincrby(FAILURES_KEY, pid, 1)
+                    continue
+                if new_level > MIN_REPLICAS:
+                    pipe.hset(LEVEL_KEY, pid, new_level)
+                else:
+                    pipe.hdel(LEVEL_KEY, pid)
+                if failed is not None:
+                    pipe.hdel(FAILURES_KEY, pid)
+                self.triggers_fired[action] += 1
+                TRIGGERS_FIRED.labels(action).inc()
+                done.append((pid, action, new_level))
+            await pipe.execute()
+        return done
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(EVAL_INTERVAL)
+            try:
+                leader = await self.r.set(LEADER_KEY, "1", nx=True, px=int(EVAL_INTERVAL * 900))
+                if not leader:
+                    continue
+                start = time.perf_counter()
+                await self.evaluate()
+                EVALUATION_SECONDS.observe(time.perf_counter() - start)
+                await self.heat.prune()
+            except Exception:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,182 @@
+import os
+import threading
+from collections import OrderedDict
+
+CACHE_POLICY = os.getenv("STORE_CACHE_POLICY", "slru")            # slru | lru | none
+# budget for the whole node: every worker process keeps its own cache
+# of CACHE_BYTES / STORE_WORKERS
+CACHE_BYTES = int(os.getenv("STORE_CACHE_BYTES", str(256 * 1024 * 1024)))
+STORE_WORKERS = max(int(os.getenv("STORE_WORKERS", "1")), 1)
+CACHE_SHARDS = int(os.getenv("STORE_CACHE_SHARDS", "16"))
+# share of each shard reserved for entries that were hit at least twice
+CACHE_PROTECTED_RATIO = float(os.getenv("STORE_CACHE_PROTECTED_RATIO", "0.8"))
+
+
+class SegmentedLRU:
+    """
+    Byte-bounded segmented LRU (one shard, not thread-safe on its own).
+
+    New entries land in the probation segment; a second hit promotes them
+    to the protected segment. Eviction always starts at the cold end of
+    probation, so a one-off scan can only churn probation and never pushes
+    out entries that proved to be popular. protected_ratio=0 degrades to
+    a plain byte-bounded LRU.
+    """
+
+    def __init__(self, capacity: int, protected_ratio: float):
+        self.capacity = capacity
+        self.protected_capacity = int(capacity * protected_ratio)
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    @property
+    def bytes(self):
+        return self.probation_bytes + self.protected_bytes
+
+    def get(self, key):
+        value = self.protected.get(key)
+        if value is not None:
+            self.protected.move_to_end(key)
+            self.hits += 1
+            return value
+        value = self.probation.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.probation_bytes -= len(value)
+        if self.protected_capacity:
+            self._promote(key, value)
+        else:
+            self.probation[key] = value
+            self.probation_bytes += len(value)
+        return value
+
+    def _promote(self, key, value):
+        self.protected[key] = value
+        self.protected_bytes += len(value)
+        while self.protected_bytes > self.protected_capacity and len(self.protected) > 1:
+            # demote the coldest protected entry back to probation
+            old_key, old_value = self.protected.popitem(last=False)
+            self.protected_bytes -= len(old_value)
+            self.probation[old_key] = old_value
+            self.probation_bytes += len(old_value)
+        self._evict()
+
+    def set(self, key, value):
+        size = len(value)
+        self.delete(key)
+        if size > self.capacity // 2:
+            # one huge photo must not flush the whole shard
+            self.rejected += 1
+            return
+        self.probation[key] = value
+        self.probation_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self.bytes > self.capacity:
+            if self.probation:
+                _, value = self.probation.popitem(last=False)
+                self.probation_bytes -= len(value)
+            else:
+                _, value = self.protected.popitem(last=False)
+                self.protected_bytes -= len(value)
+            self.evictions += 1
+
+    def delete(self, key):
+        value = self.probation.pop(key, None)
+        if value is not None:
+            self.probation_bytes -= len(value)
+        value = self.protected.pop(key, None)
+        if value is not None:
+            self.protected_bytes -= len(value)
+
+    def __len__(self):
+        return len(self.probation) + len(self.protected)
+
+
+class ShardedCache:
+    """Lock-striped cache: keys are spread over shards, each with its own lock."""
+
+    def __init__(self, capacity: int, shards: int, protected_ratio: float):
+        self.shards = [SegmentedLRU(capacity // shards, protected_ratio) for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+
+    def _slot(self, key):
+        return hash(key) % len(self.shards)
+
+    def get(self, key):
+        i = self._slot(key)
+        with self.locks[i]:
+            return self.shards[i].get(key)
+
+    def set(self, key, value):
+        i = self._slot(key)
+        with self.locks[i]:
+            self.shards[i].set(key, value)
+
+    def delete(self, key):
+        i = self._slot(key)
+        with self.locks[i]:
+            self.shards[i].delete(key)
+
+    def clear(self):
+        for i, shard in enumerate(self.shards):
+            with self.locks[i]:
+                shard.probation.clear()
+                shard.protected.clear()
+                shard.probation_bytes = shard.protected_bytes = 0
+
+    def stats(self):
+        hits = sum(s.hits for s in self.shards)
+        misses = sum(s.misses for s in self.shards)
+        return {
+            "policy": CACHE_POLICY,
+            "capacity_bytes": sum(s.capacity for s in self.shards),
+            "bytes": sum(s.bytes for s in self.shards),
+            "entries": sum(len(s) for s in self.shards),
+            "hits": hits,
+            "misses": misses,
+            "evictions": sum(s.evictions for s in self.shards),
+            "rejected": sum(s.rejected for s in self.shards),
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        }
+
+
+class NullCache:
+    """Cache disabled: every lookup misses (reads come from the volume mmap)."""
+
+    def __init__(self):
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"policy": "none", "capacity_bytes": 0, "bytes": 0, "entries": 0,
+                "hits": 0, "misses": self.misses, "evictions": 0, "rejected": 0,
+                "hit_ratio": 0.0}
+
+
+def make_cache():
+    if CACHE_POLICY == "none" or CACHE_BYTES <= 0:
+        return NullCache()
+    protected = 0.0 if CACHE_POLICY == "lru" else CACHE_PROTECTED_RATIO
+    return ShardedCache(CACHE_BYTES // STORE_WORKERS, max(CACHE_SHARDS, 1), protected)
@@ -0,0 +1,161 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .jobs import JobFiles
+from .metrics import COMPACTION_SECONDS
+
+# A volume is compacted only once its garbage crosses both thresholds
+COMPACTION_MIN_DELETED_BYTES = int(os.getenv("COMPACTION_MIN_DELETED_BYTES", str(8 * 1024 * 1024)))
+COMPACTION_MIN_GARBAGE_RATIO = float(os.getenv("COMPACTION_MIN_GARBAGE_RATIO", "0.1"))
+COMPACTION_INTERVAL = int(os.getenv("COMPACTION_INTERVAL_SECONDS", "60"))
+# I/O budget for copying live needles; 0 disables throttling
+COMPACTION_MAX_BYTES_PER_SEC = int(os.getenv("COMPACTION_MAX_BYTES_PER_SEC", str(32 * 1024 * 1024)))
+# how many finished jobs stay queryable
+COMPACTION_JOB_HISTORY = 100
+# how often a running job's progress is written for the other workers
+COMPACTION_PROGRESS_INTERVAL = 1.0
+
+
+class CompactionJob:
+    def __init__(self, volume_id: str, garbage_bytes: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.volume_id = volume_id
+        self.status = "queued"
+        self.garbage_bytes = garbage_bytes
+        self.total_bytes = 0
+        self.copied_bytes = 0
+        self.reclaimed_bytes = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+
+    def to_dict(self):
+        progress = 1.0 if self.status == "done" else (
+            self.copied_bytes / self.total_bytes if self.total_bytes else 0.0
+        )
+        return {
+            "job_id": self.id,
+            "volume_id": self.volume_id,
+            "status": self.status,
+            "progress": round(progress, 4),
+            "garbage_bytes": self.garbage_bytes,
+            "total_bytes": self.total_bytes,
+            "copied_bytes": self.copied_bytes,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class Compactor:
+    """
+    Runs volume compactions one at a time on a background thread.
+
+    The scheduler only queues a volume once its garbage crosses the
+    configured thresholds; `submit(force=True)` bypasses them. It only
+    runs while `scheduling` is set, i.e. in one worker process per node.
+    Job status is also written to `jobs_dir`, so any worker can report it.
+    """
+
+    def __init__(self, volumes: dict, jobs_dir):
+        self.volumes = volumes
+        self.jobs = OrderedDict()   # job_id -> CompactionJob
+        self.active = {}            # volume_id -> queued/running job
+        self.files = JobFiles(jobs_dir, COMPACTION_JOB_HISTORY)
+        self.scheduling = False
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+
+        threading.Thread(target=self._worker, daemon=True).start()
+        threading.Thread(target=self._scheduler, daemon=True).start()
+        threading.Thread(target=self._progress, daemon=True).start()
+
+    def needs_compaction(self, volume) -> bool:
+        garbage = volume.garbage_bytes()
+        return (
+            garbage >= COMPACTION_MIN_DELETED_BYTES
+            and garbage >= COMPACTION_MIN_GARBAGE_RATIO * volume.size
+        )
+
+    def submit(self, volume_id: str = None, force: bool = False):
+        """Queue compaction for one or all volumes; returns the jobs."""
+        targets = [volume_id] if volume_id else list(self.volumes)
+        jobs = []
+        for vid in targets:
+            volume = self.volumes.get(vid)
+            if not volume:
+                continue
+            with self.lock:
+                if vid in self.active:
+                    jobs.append(self.active[vid])
+                    continue
+            if not force and not self.needs_compaction(volume):
+                continue
+            job = CompactionJob(vid, volume.garbage_bytes())
+            with self.lock:
+                self.active[vid] = job
+                self.jobs[job.id] = job
+                while len(self.jobs) > COMPACTION_JOB_HISTORY:
+                    self.jobs.popitem(last=False)
+            self._save(job)
+            self.files.trim()
+            self._queue.put(job)
+            jobs.append(job)
+        return jobs
+
+    def get(self, job_id: str):
+        """Status dict of a job started by any worker, or None."""
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else self.files.load(job_id)
+
+    def _save(self, job):
+        try:
+            self.files.save(job.to_dict())
+        except OSError:
+            # only polls through other workers miss the update
+            pass
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            self._save(job)
+            try:
+                if self.volumes[job.volume_id].compact(job, COMPACTION_MAX_BYTES_PER_SEC):
+                    job.status = "done"
+                    COMPACTION_SECONDS.observe(time.time() - job.started_at)
+                else:
+                    job.status = "skipped"
+                    job.error = "another worker is compacting this volume"
+            except Exception as exc:
+                job.status = "failed"
+                job.error = str(exc)
+            finally:
+                job.finished_at = time.time()
+                with self.lock:
+                    self.active.pop(job.volume_id, None)
+                self._save(job)
+
+    def _scheduler(self):
+        while True:
+            time.sleep(COMPACTION_INTERVAL)
+            if not self.scheduling:
+                continue
+            try:
+                self.submit()
+            except Exception:
+                pass
+
+    def _progress(self):
+        while True:
+            time.sleep(COMPACTION_PROGRESS_INTERVAL)
+            with self.lock:
+                running = [job for job in self.active.values() if job.status == "running"]
+            for job in running:
+                self._save(job)
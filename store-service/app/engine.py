@@ -1,174 +1,370 @@
 import os
-import threading
-import time
 import json
+import time
+import asyncio
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from base64 import b64encode, b64decode
 
-DATA_DIR = Path('/app/data')
+from .needle import cookie_to_int, needle_length, NeedleSpool
+from .volume import Volume, migrate_legacy_volume
+from .compaction import Compactor
+from .replicator import Replicator
+from .cache import make_cache
+from .locks import FileLock
+from .metrics import STORE_BYTES
+
+DATA_DIR = Path(os.getenv('DATA_DIR', '/app/data'))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
+# Pre-needle index; only read once to migrate old volumes
 INDEX_FILE = DATA_DIR / 'index.json'
+# streamed uploads are spooled in memory up to this size, then to a temp file
+SPOOL_MEMORY_BYTES = int(os.getenv('STORE_SPOOL_MEMORY_BYTES', str(1024 * 1024)))
+# threads per worker process for disk reads and spooled writes, so a page
+# fault or a slow disk never stalls the event loop
+STORE_IO_THREADS = int(os.getenv('STORE_IO_THREADS', '16'))
 
 class StoreEngine:
     def __init__(self):
-        # V1, V2, ... volumes as append-only files
-        self.volumes = {
+        started = time.monotonic()
+        paths = {
             f"V{idx+1}": DATA_DIR / f"volume_{idx+1}.dat"
             for idx in range(int(os.getenv("NUM_VOLUMES", "2")))
         }
-
-        # Internal byte index
-        self.index = {}
         if INDEX_FILE.exists():
-            try:
-                self.index = json.loads(INDEX_FILE.read_text())
-            except:
-                self.index = {}
+            self._migrate_legacy(paths)
 
-        # Ensure volume files exist
-        for vpath in self.volumes.values():
-            vpath.touch(exist_ok=True)
+        # V1, V2, ... volumes as append-only needle files, each with its
+        # own append-only index file and an index shared by every worker
+        self.volumes = {vid: Volume(vid, vpath) for vid, vpath in paths.items()}
 
         # -------------------------
-        # ADD: IN-MEMORY CACHE
+        # IN-MEMORY CACHE
         # -------------------------
-        self.cache = {}              # photo_id -> bytes
-        self.cache_lock = threading.Lock()
-        self.CACHE_LIMIT = 2000      # can adjust later
+        # needle location -> bytes; byte-bounded, sharded, scan-resistant
+        # (see cache.py). Keys are (volume, index generation, offset) and
+        # are only reached through the shared index, so a delete or an
+        # overwrite in another worker process can never be served from here.
+        self.cache = make_cache()
         # -------------------------
 
-        # Background compaction
-        threading.Thread(target=self._compaction_scheduler, daemon=True).start()
+        self.io = ThreadPoolExecutor(STORE_IO_THREADS, thread_name_prefix="store-io")
+
+        # Background compaction, only for volumes over the garbage threshold
+        self.compactor = Compactor(self.volumes, DATA_DIR / "jobs" / "compact")
+
+        # store-to-store replica copies (replicate_up)
+        self.replicator = Replicator(self.volumes, DATA_DIR / "jobs" / "replicate")
+
+        # held by the one worker that heartbeats and schedules compaction
+        self.leader_lock = FileLock(DATA_DIR / "leader.lock")
+        self.leader = False
+
+        self.startup_seconds = time.monotonic() - started
 
     # -------------------------
     # CACHE HELPERS
     # -------------------------
     def _cache_get(self, photo_id):
-        with self.cache_lock:
-            return self.cache.get(photo_id)
+        return self.cache.get(photo_id)
 
     def _cache_set(self, photo_id, data_bytes):
-        with self.cache_lock:
-            if len(self.cache) >= self.CACHE_LIMIT:
-                # Simple FIFO eviction
-                oldest = next(iter(self.cache))
-                self.cache.pop(oldest, None)
+        self.cache.set(photo_id, data_bytes)
+
+    @staticmethod
+    def _cache_key(volume_id, state, entry):
+        # overwrites append elsewhere and compaction starts a new
+        # generation, so a key never goes stale; old ones just age out
+        return (volume_id, state.index.generation, entry["offset"])
 
-            self.cache[photo_id] = data_bytes
+    def _cache_written(self, volume, volume_id, photo_id, offset, data):
+        state, entry = volume.lookup(photo_id)
+        if entry is not None and entry["offset"] == offset:
+            self._cache_set(self._cache_key(volume_id, state, entry), data)
 
-    def _cache_delete(self, photo_id):
-        with self.cache_lock:
-            self.cache.pop(photo_id, None)
+    def cache_stats(self):
+        return self.cache.stats()
     # -------------------------
 
-    def _persist_index(self):
-        INDEX_FILE.write_text(json.dumps(self.index))
+    def _locate(self, photo_id: str, volume_id: str = None, prefer: str = None):
+        """
+        (volume_id, state, entry) of the live needle, or None. With
+        `volume_id` only that volume is looked at; `prefer` is tried first.
+        """
+        if volume_id is not None:
+            vids = [volume_id] if volume_id in self.volumes else []
+        else:
+            vids = sorted(self.volumes, key=lambda vid: vid != prefer)
+        for vid in vids:
+            state, entry = self.volumes[vid].lookup(photo_id)
+            if entry is not None:
+                return vid, state, entry
+        return None
+
+    def _migrate_legacy(self, paths):
+        try:
+            legacy = json.loads(INDEX_FILE.read_text())
+        except Exception:
+            legacy = {}
+        for vid, vpath in paths.items():
+            entries = {pid: m for pid, m in legacy.items() if m.get("volume") == vid}
+            migrate_legacy_volume(vpath, entries)
+        INDEX_FILE.rename(INDEX_FILE.with_suffix(".json.migrated"))
 
     def write(self, payload: dict):
         photo_id = payload["photo_id"]
         volume_id = payload["volume_id"]
         data = b64decode(payload["photo_data"])
 
-        vpath = self.volumes.get(volume_id)
-        if not vpath:
+        volume = self.volumes.get(volume_id)
+        if not volume:
             return {"status": "error", "reason": "volume not found"}
+        if not volume.has_room(len(data)):
+            return {"status": "error", "reason": "volume read-only (full)"}
 
-        # Append to the selected volume
-        with vpath.open("ab") as f:
-            offset = f.tell()
-            f.write(len(data).to_bytes(8, "big"))
-            f.write(data)
-
-        # Internal index only
-        self.index[photo_id] = {
-            "volume": volume_id,
-            "offset": offset,
-            "size": len(data),
-            "deleted": False
-        }
-        self._persist_index()
+        # Append needle + index record; O(1) regardless of volume size.
+        # Blocks until the group commit holding this needle is fsynced.
+        offset = volume.append(photo_id, cookie_to_int(payload.get("cookie")), data)
 
         # UPDATE CACHE
-        self._cache_set(photo_id, data)
+        self._cache_written(volume, volume_id, photo_id, offset, data)
+        STORE_BYTES.labels("written").inc(len(data))
 
         return {"status": "success", "offset": offset, "size": len(data)}
 
-    def read(self, photo_id: str):
-        # 1️⃣ CACHE LOOKUP FIRST
-        cached = self._cache_get(photo_id)
-        if cached:
+    async def write_stream(self, photo_id: str, volume_id: str, cookie, size, chunks):
+        """
+        Binary counterpart of `write`: `chunks` is the raw request body
+        (async iterable), `size` its Content-Length if known. The needle is
+        spooled chunk by chunk with a running crc and copied into the
+        volume by the group commit writer; nothing is base64-decoded and
+        memory stays bounded by SPOOL_MEMORY_BYTES. Once the spool is on
+        disk its writes run on the I/O threads.
+        """
+        volume = self.volumes.get(volume_id)
+        if not volume:
+            return {"status": "error", "reason": "volume not found"}
+        if size is not None and not volume.has_room(size):
+            return {"status": "error", "reason": "volume read-only (full)"}
+
+        loop = asyncio.get_running_loop()
+        spool = NeedleSpool(photo_id, cookie_to_int(cookie), SPOOL_MEMORY_BYTES)
+        try:
+            async for chunk in chunks:
+                if spool.on_disk:
+                    await loop.run_in_executor(self.io, spool.write, chunk)
+                else:
+                    spool.write(chunk)
+            if size is not None and spool.size != size:
+                return {"status": "error", "reason": "body shorter than Content-Length"}
+            if not volume.has_room(spool.size):
+                return {"status": "error", "reason": "volume read-only (full)"}
+            await loop.run_in_executor(self.io, spool.finish)
+            offset = await asyncio.wrap_future(volume.submit_spool(photo_id, spool))
+        finally:
+            spool.close()
+
+        STORE_BYTES.labels("written").inc(spool.size)
+        return {"status": "success", "offset": offset, "size": spool.size}
+
+    def write_batch(self, payload: dict):
+        """
+        {"needles": [{"photo_id", "volume_id", "photo_data", "cookie"}]}.
+        Needles are queued per volume in one go, so a batch costs one
+        group commit per volume instead of one per photo. Results come
+        back in request order, with an error per needle that failed.
+        """
+        needles = payload.get("needles", [])
+        results = [None] * len(needles)
+        by_volume = {}
+        for i, n in enumerate(needles):
+            volume = self.volumes.get(n["volume_id"])
+            data = b64decode(n["photo_data"])
+            if not volume:
+                results[i] = {"photo_id": n["photo_id"], "status": "error", "reason": "volume not found"}
+                continue
+            by_volume.setdefault(n["volume_id"], []).append((i, n["photo_id"], cookie_to_int(n.get("cookie")), data))
+
+        pending = []
+        for volume_id, items in by_volume.items():
+            volume = self.volumes[volume_id]
+            room = volume.capacity - volume.size
+            accepted = []
+            for i, photo_id, cookie, data in items:
+                need = needle_length(len(photo_id.encode()), len(data))
+                if need > room:
+                    results[i] = {"photo_id": photo_id, "status": "error", "reason": "volume read-only (full)"}
+                    continue
+                room -= need
+                accepted.append((i, photo_id, cookie, data))
+            futs = volume.submit_many([(photo_id, cookie, data) for _, photo_id, cookie, data in accepted])
+            pending.extend(zip(accepted, futs))
+
+        for (i, photo_id, _, data), fut in pending:
+            try:
+                offset = fut.result()
+            except Exception as exc:
+                # the writer failed this needle (or its whole group commit):
+                # report it for this needle and go on with the others
+                results[i] = {"photo_id": photo_id, "status": "error", "reason": str(exc) or type(exc).__name__}
+                continue
+            volume_id = needles[i]["volume_id"]
+            self._cache_written(self.volumes[volume_id], volume_id, photo_id, offset, data)
+            STORE_BYTES.labels("written").inc(len(data))
+            results[i] = {"photo_id": photo_id, "status": "success", "offset": offset, "size": len(data)}
+        return {"results": results}
+
+    def read(self, photo_id: str, volume_id: str = None):
+        """Photo as base64; with `volume_id` only that volume is looked at."""
+        # 1️⃣ LOOKUP SHARED INDEX
+        found = self._locate(photo_id, volume_id)
+        if found is None:
+            return None
+        volume_id, state, entry = found
+
+        # 2️⃣ CACHE LOOKUP
+        key = self._cache_key(volume_id, state, entry)
+        cached = self._cache_get(key)
+        if cached is not None:
+            STORE_BYTES.labels("read").inc(len(cached))
             return {
                 "photo_id": photo_id,
                 "volume_id": "cache",
                 "data": b64encode(cached).decode()
             }
 
-        # 2️⃣ LOOKUP INTERNAL INDEX
-        entry = self.index.get(photo_id)
-        if not entry or entry.get("deleted"):
-            return None
-
-        vpath = self.volumes.get(entry["volume"])
-        if not vpath:
-            return None
-
-        # 3️⃣ READ FROM DISK
-        with vpath.open("rb") as f:
-            f.seek(entry["offset"])
-            size = int.from_bytes(f.read(8), "big")
-            data = f.read(size)
-
-        # 4️⃣ UPDATE CACHE
-        self._cache_set(photo_id, data)
+        # 3️⃣ READ FROM DISK + 4️⃣ UPDATE CACHE
+        data = bytes(state.payload(photo_id, entry))
+        self._cache_set(key, data)
+        STORE_BYTES.labels("read").inc(len(data))
 
         return {
             "photo_id": photo_id,
-            "volume_id": entry["volume"],
+            "volume_id": volume_id,
             "data": b64encode(data).decode()
         }
 
-    def mark_deleted(self, photo_id: str):
-        if photo_id in self.index:
-            self.index[photo_id]["deleted"] = True
-            self._persist_index()
+    def read_view(self, photo_id: str, volume_id: str = None):
+        """
+        Zero-copy variant of `read` for the binary endpoint: returns
+        (volume_id, memoryview) straight from the shared volume mmap.
+        With `volume_id` only that volume is looked at. The caller counts
+        STORE_BYTES, since it may send only a Range of the view.
+        """
+        found = self._locate(photo_id, volume_id)
+        if found is None:
+            return None
+        volume_id, state, entry = found
 
-        # REMOVE FROM CACHE
-        self._cache_delete(photo_id)
+        cached = self._cache_get(self._cache_key(volume_id, state, entry))
+        if cached is not None:
+            return "cache", memoryview(cached)
+        return volume_id, state.payload(photo_id, entry)
 
-    def compact(self):
+    def read_views(self, photos: list):
+        """
+        Zero-copy lookup for a batch: [{"photo_id", "volume_id"?}] ->
+        [(photo_id, memoryview or None)], cache hits first, then disk
+        reads ordered by (volume, offset) so each volume is read front to back.
         """
-        Remove deleted bytes & rebuild offsets.
-        Only internal cleanup.
+        hits = []
+        misses = []
+        disk = []
+        for p in photos:
+            photo_id = p["photo_id"]
+            found = self._locate(photo_id, prefer=p.get("volume_id"))
+            if found is None:
+                misses.append((photo_id, None))
+                continue
+            vid, state, entry = found
+            cached = self._cache_get(self._cache_key(vid, state, entry))
+            if cached is not None:
+                hits.append((photo_id, memoryview(cached)))
+                continue
+            disk.append((vid, entry["offset"], photo_id, state, entry))
+        disk.sort(key=lambda d: d[:2])
+        for _, _, photo_id, state, entry in disk:
+            # the state keeps its file mapped even if compacted meanwhile
+            hits.append((photo_id, state.payload(photo_id, entry)))
+        STORE_BYTES.labels("read").inc(sum(len(view) for _, view in hits))
+        return hits + misses
+
+    def mark_deleted(self, photo_id: str, volume_id: str = None):
         """
-        for vol, path in self.volumes.items():
-            tmp = path.with_suffix(".tmp")
+        Tombstone the photo in one volume (one replica) or, without
+        `volume_id`, in every volume holding it. Each delete is a single
+        index record appended to that volume's index file.
+        """
+        if volume_id is not None:
+            volumes = [self.volumes[volume_id]] if volume_id in self.volumes else []
+        else:
+            volumes = list(self.volumes.values())
+        pending = [
+            volume.submit_delete(photo_id)
+            for volume in volumes
+            if volume.lookup(photo_id)[1] is not None
+        ]
+        # cached bytes are only reached through the index, which now says deleted
+        return sum(1 for fut in pending if fut.result())
+
+    def volume_report(self):
+        """Capacity and usage of every volume, as sent to the directory."""
+        return [
+            {
+                "volume_id": vid,
+                "capacity": volume.capacity,
+                "used": volume.size,
+                "live_bytes": volume.current().live_bytes,
+                "garbage_bytes": volume.garbage_bytes(),
+                "read_only": not volume.has_room(0),
+            }
+            for vid, volume in self.volumes.items()
+        ]
+
+    def readiness(self):
+        """How long startup took and where each volume's index came from."""
+        return {
+            "status": "ready",
+            "startup_seconds": round(self.startup_seconds, 4),
+            "index": {vid: volume.index_source for vid, volume in self.volumes.items()},
+        }
 
-            with tmp.open("wb") as out:
-                for pid, meta in self.index.items():
-                    if meta["deleted"]:
-                        continue
-                    if meta["volume"] != vol:
-                        continue
+    def checkpoint(self):
+        """Checkpoint every shared index (on shutdown) so a restart skips the rebuild."""
+        for volume in self.volumes.values():
+            volume.checkpoint()
 
-                    with path.open("rb") as fin:
-                        fin.seek(meta["offset"])
-                        size = int.from_bytes(fin.read(8), "big")
-                        data = fin.read(size)
+    def volume_stats(self):
+        """Per-volume size, live and garbage bytes (O(1) per volume)."""
+        return [volume.stats() for volume in self.volumes.values()]
 
-                        new_offset = out.tell()
-                        out.write(len(data).to_bytes(8, "big"))
-                        out.write(data)
+    def compact(self, volume_id: str = None, force: bool = False):
+        """
+        Queue online compaction (one volume or all) and return the jobs.
+        Without `force` only volumes over the garbage threshold are picked.
+        """
+        return [job.to_dict() for job in self.compactor.submit(volume_id, force)]
 
-                        self.index[pid]["offset"] = new_offset
+    def compaction_status(self, job_id: str):
+        return self.compactor.get(job_id)
 
-            tmp.replace(path)
+    def replicate(self, copies: list, wait: bool = False):
+        """Start copying needles to other volumes/nodes; with `wait`, block until done."""
+        job = self.replicator.submit(copies)
+        if wait:
+            job.done.wait()
+        return job.to_dict()
 
-        self._persist_index()
+    def replication_status(self, job_id: str):
+        return self.replicator.get(job_id)
 
-    def _compaction_scheduler(self):
-        while True:
-            time.sleep(60)
-            try:
-                self.compact()
-            except:
-                pass
+    def try_lead(self) -> bool:
+        """
+        Become the node's leader worker if no other worker is: it alone
+        heartbeats to the directory and schedules compaction. The lock
+        goes with the process, so another worker takes over if it dies.
+        """
+        if not self.leader and self.leader_lock.try_exclusive():
+            self.leader = True
+            self.compactor.scheduling = True
+        return self.leader
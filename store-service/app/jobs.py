@@ -0,0 +1,44 @@
+import os
+import json
+from pathlib import Path
+
+
+class JobFiles:
+    """
+    Job status as one small JSON file per job under `path`, so a job
+    started by one worker process can be polled through any other.
+
+    Writes go to a temp file and are renamed into place: a reader sees
+    either the previous status or the new one. Only the newest `history`
+    jobs are kept.
+    """
+
+    def __init__(self, path, history: int):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.history = history
+
+    def save(self, job: dict):
+        tmp = self.path / f".{job['job_id']}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(job))
+        os.replace(tmp, self.path / f"{job['job_id']}.json")
+
+    def load(self, job_id: str):
+        if not job_id.isalnum():
+            return None
+        try:
+            return json.loads((self.path / f"{job_id}.json").read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def trim(self):
+        """Drop the oldest job files beyond `history`."""
+        files = []
+        for path in self.path.glob("*.json"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                pass
+        files.sort()
+        for _, path in files[:max(len(files) - self.history, 0)]:
+            path.unlink(missing_ok=True)
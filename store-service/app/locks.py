@@ -0,0 +1,46 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+
+class FileLock:
+    """
+    Reader-writer lock shared by every process that opens `path` (flock).
+
+    Each FileLock is its own open file, so two of them on the same path
+    exclude each other even inside one process; within one FileLock it is
+    up to the caller not to nest.
+    """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def exclusive(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def shared(self):
+        fcntl.flock(self.fd, fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def try_exclusive(self) -> bool:
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def share(self):
+        """Hold (or downgrade to) a shared lock until `release`."""
+        fcntl.flock(self.fd, fcntl.LOCK_SH)
+
+    def release(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
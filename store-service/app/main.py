@@ -1,5 +1,22 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from .router import router
+from .router import router, engine
+from .registration import leader_loop
+from . import metrics
 
-app = FastAPI(title='Store Service')
-app.include_router(router)
\ No newline at end of file
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    heartbeat = asyncio.create_task(leader_loop(engine))
+    yield
+    heartbeat.cancel()
+    # a clean shutdown leaves indexes the next start adopts as is
+    engine.checkpoint()
+    metrics.worker_exit()
+
+app = FastAPI(title='Store Service', lifespan=lifespan)
+app.include_router(router)
+# /metrics + X-Trace-Id propagation
+metrics.install(app)
+metrics.register_engine(engine)
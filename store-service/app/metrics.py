@@ -0,0 +1,204 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from starlette.responses import Response
+
+# -------------------------
+# TRACING
+# -------------------------
+# The trace id of the request being handled; sent on every upstream call
+# and echoed in the response, so one slow request can be followed hop by hop.
+TRACE_HEADER = "X-Trace-Id"
+trace_id = contextvars.ContextVar("trace_id", default=None)
+
+# -------------------------
+# METRICS
+# -------------------------
+# Set (see Dockerfile) when several workers serve one node: counters and
+# histograms then live in files there and /metrics adds up every worker.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# how often each worker copies its cache counters there
+CACHE_PUBLISH_INTERVAL = 5.0
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time spent serving a request, by route",
+    ["method", "route", "status"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Time until an upstream call returned its headers",
+    ["upstream", "route", "status"],
+)
+STORE_BYTES = Counter("store_bytes_total", "Photo bytes read from or written to volumes", ["direction"])
+COMPACTION_SECONDS = Histogram(
+    "store_compaction_duration_seconds", "Wall time of finished compaction jobs",
+    buckets=(1, 5, 15, 60, 300, 900, 3600, 4 * 3600),
+)
+
+
+class StoreCollector:
+    """
+    Cache and volume numbers, read from the engine at scrape time. With
+    `cache=False` only the volumes, which every worker sees alike.
+    """
+
+    def __init__(self, engine, cache: bool = True):
+        self.engine = engine
+        self.cache = cache
+
+    def collect(self):
+        if self.cache:
+            stats = self.engine.cache_stats()
+            for name in ("hits", "misses", "evictions"):
+                c = CounterMetricFamily(f"store_cache_{name}", f"Store cache {name}")
+                c.add_metric([], stats[name])
+                yield c
+            for name in ("bytes", "entries"):
+                g = GaugeMetricFamily(f"store_cache_{name}", f"Store cache {name}")
+                g.add_metric([], stats[name])
+                yield g
+
+        families = {
+            "size": GaugeMetricFamily("store_volume_size_bytes", "Volume file size", labels=["volume"]),
+            "live_bytes": GaugeMetricFamily("store_volume_live_bytes", "Bytes of live needles", labels=["volume"]),
+            "garbage_bytes": GaugeMetricFamily("store_volume_garbage_bytes", "Bytes of deleted or overwritten needles", labels=["volume"]),
+            "index_entries": GaugeMetricFamily("store_volume_index_entries", "Shared index entries", labels=["volume"]),
+        }
+        for vid, volume in self.engine.volumes.items():
+            families["size"].add_metric([vid], volume.size)
+            families["live_bytes"].add_metric([vid], volume.current().live_bytes)
+            families["garbage_bytes"].add_metric([vid], volume.garbage_bytes())
+            families["index_entries"].add_metric([vid], len(volume.index))
+        yield from families.values()
+
+
+_registry = REGISTRY
+
+
+def register_engine(engine):
+    global _registry
+    if not MULTIPROC_DIR:
+        REGISTRY.register(StoreCollector(engine))
+        return
+    # each worker has its own cache: publish its numbers to the shared
+    # files, summed over live workers, instead of answering for one worker
+    _registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(_registry)
+    _registry.register(StoreCollector(engine, cache=False))
+    counters = {
+        name: Counter(f"store_cache_{name}", f"Store cache {name}", registry=None)
+        for name in ("hits", "misses", "evictions")
+    }
+    gauges = {
+        name: Gauge(f"store_cache_{name}", f"Store cache {name}", registry=None, multiprocess_mode="livesum")
+        for name in ("bytes", "entries")
+    }
+    threading.Thread(target=_publish_cache, args=(engine, counters, gauges), daemon=True).start()
+
+
+def _publish_cache(engine, counters, gauges):
+    seen = dict.fromkeys(counters, 0)
+    while True:
+        stats = engine.cache_stats()
+        for name, counter in counters.items():
+            counter.inc(max(stats[name] - seen[name], 0))
+            seen[name] = stats[name]
+        for name, gauge in gauges.items():
+            gauge.set(stats[name])
+        time.sleep(CACHE_PUBLISH_INTERVAL)
+
+
+def worker_exit():
+    """Drop this worker's live gauges from the shared files (on shutdown)."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def _route_of(path: str) -> str:
+    # first two segments only: ids in paths would explode the label space
+    return "/" + "/".join(path.strip("/").split("/")[:2])
+
+
+async def _on_request(request):
+    tid = trace_id.get()
+    if tid:
+        request.headers[TRACE_HEADER] = tid
+    request.extensions["started"] = time.perf_counter()
+
+
+async def _on_response(response):
+    request = response.request
+    UPSTREAM_LATENCY.labels(
+        request.url.host, _route_of(request.url.path), str(response.status_code)
+    ).observe(time.perf_counter() - request.extensions["started"])
+
+
+def httpx_hooks():
+    """event_hooks for httpx.AsyncClient: trace propagation + upstream latency."""
+    return {"request": [_on_request], "response": [_on_response]}
+
+
+def _on_request_sync(request):
+    tid = trace_id.get()
+    if tid:
+        request.headers[TRACE_HEADER] = tid
+    request.extensions["started"] = time.perf_counter()
+
+
+def _on_response_sync(response):
+    request = response.request
+    UPSTREAM_LATENCY.labels(
+        request.url.host, _route_of(request.url.path), str(response.status_code)
+    ).observe(time.perf_counter() - request.extensions["started"])
+
+
+def httpx_sync_hooks():
+    """event_hooks for a plain httpx.Client (replicator threads)."""
+    return {"request": [_on_request_sync], "response": [_on_response_sync]}
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: adopts the caller's X-Trace-Id (or starts a trace),
+    echoes it in the response and records the request latency under the
+    matched route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tid = dict(scope["headers"]).get(TRACE_HEADER.lower().encode(), b"").decode() or uuid.uuid4().hex[:16]
+        token = trace_id.set(tid)
+        status = [500]
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(TRACE_HEADER.encode(), tid.encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, str(status[0])).observe(time.perf_counter() - start)
+            trace_id.reset(token)
+
+
+async def metrics_endpoint(request):
+    return Response(generate_latest(_registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def install(app):
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
@@ -0,0 +1,158 @@
+"""
+On-disk formats for store volumes.
+
+A volume is an append-only sequence of needles:
+
+    header | photo_id | data | footer | padding (to 8 bytes)
+
+Next to every volume lives an append-only index file of fixed-size
+records (plus the photo_id bytes) so the in-memory index can be rebuilt
+without scanning the whole volume.
+"""
+import struct
+import tempfile
+import zlib
+
+NEEDLE_MAGIC = 0x4E45444C   # "NEDL"
+FOOTER_MAGIC = 0x464F4F54   # "FOOT"
+ALIGNMENT = 8
+
+FLAG_DELETED = 0x01
+
+# magic, cookie, flags, photo_id length, data size, crc32(data)
+HEADER = struct.Struct(">IQBHQI")
+# magic, crc32(data)
+FOOTER = struct.Struct(">II")
+# photo_id length, flags, needle offset, data size, cookie
+IDX_RECORD = struct.Struct(">HBQQQ")
+
+
+def cookie_to_int(cookie) -> int:
+    """Cookies arrive as ints or short strings; store them as u64."""
+    if cookie is None:
+        return 0
+    if isinstance(cookie, int):
+        return cookie & 0xFFFFFFFFFFFFFFFF
+    text = str(cookie)
+    if text.isdigit():
+        return int(text) & 0xFFFFFFFFFFFFFFFF
+    return zlib.crc32(text.encode())
+
+
+def needle_length(id_len: int, size: int) -> int:
+    raw = HEADER.size + id_len + size + FOOTER.size
+    return raw + (-raw % ALIGNMENT)
+
+
+def data_offset(offset: int, id_len: int) -> int:
+    """Absolute offset of the payload inside a needle starting at `offset`."""
+    return offset + HEADER.size + id_len
+
+
+def pack_needle(photo_id: str, cookie: int, data, flags: int = 0) -> bytes:
+    pid = photo_id.encode()
+    checksum = zlib.crc32(data)
+    head = HEADER.pack(NEEDLE_MAGIC, cookie, flags, len(pid), len(data), checksum)
+    foot = FOOTER.pack(FOOTER_MAGIC, checksum)
+    pad = b"\0" * (-(len(head) + len(pid) + len(data) + len(foot)) % ALIGNMENT)
+    return b"".join((head, pid, data, foot, pad))
+
+
+class NeedleSpool:
+    """
+    A needle assembled from a stream of chunks, for uploads whose size is
+    only known chunk by chunk. Bytes go to a SpooledTemporaryFile (memory
+    up to `max_memory`, then disk) with the crc computed on the way; the
+    header is patched in by `finish`. The volume writer then copies the
+    needle out with `chunks`, so memory use does not grow with the photo.
+    """
+
+    def __init__(self, photo_id: str, cookie: int, max_memory: int):
+        self.pid = photo_id.encode()
+        self.cookie = cookie
+        self.size = 0
+        self.crc = 0
+        self.length = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self.file.write(b"\0" * (HEADER.size + len(self.pid)))
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.crc = zlib.crc32(chunk, self.crc)
+        self.size += len(chunk)
+
+    def finish(self):
+        self.file.write(FOOTER.pack(FOOTER_MAGIC, self.crc))
+        self.length = needle_length(len(self.pid), self.size)
+        self.file.write(b"\0" * (self.length - self.file.tell()))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(NEEDLE_MAGIC, self.cookie, 0, len(self.pid), self.size, self.crc))
+        self.file.write(self.pid)
+
+    @property
+    def on_disk(self) -> bool:
+        """Spilled past `max_memory`: writes are now file I/O."""
+        return self.file._rolled
+
+    def __len__(self):
+        return self.length
+
+    def chunks(self, chunk_size: int = 1024 * 1024):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+def scan_needles(buf, start: int = 0):
+    """
+    Walk needles in `buf` from `start`, verifying magic and checksum.
+    Yields (offset, photo_id, cookie, flags, size, length) and stops at
+    the first truncated or corrupt needle; the caller can compare the
+    last yielded end with len(buf) to detect a torn tail.
+    """
+    pos = start
+    end = len(buf)
+    while pos + HEADER.size <= end:
+        magic, cookie, flags, id_len, size, checksum = HEADER.unpack_from(buf, pos)
+        if magic != NEEDLE_MAGIC:
+            return
+        length = needle_length(id_len, size)
+        if pos + length > end:
+            return
+        doff = data_offset(pos, id_len)
+        fmagic, fsum = FOOTER.unpack_from(buf, doff + size)
+        if fmagic != FOOTER_MAGIC or fsum != checksum:
+            return
+        if zlib.crc32(buf[doff:doff + size]) != checksum:
+            return
+        photo_id = bytes(buf[pos + HEADER.size:doff]).decode()
+        yield pos, photo_id, cookie, flags, size, length
+        pos += length
+
+
+def pack_index_record(photo_id: str, flags: int, offset: int, size: int, cookie: int) -> bytes:
+    pid = photo_id.encode()
+    return IDX_RECORD.pack(len(pid), flags, offset, size, cookie) + pid
+
+
+def iter_index_records(buf):
+    """
+    Yields (photo_id, flags, offset, size, cookie, end) for every complete
+    record; `end` is the position right after the record.
+    """
+    pos = 0
+    end = len(buf)
+    while pos + IDX_RECORD.size <= end:
+        id_len, flags, offset, size, cookie = IDX_RECORD.unpack_from(buf, pos)
+        stop = pos + IDX_RECORD.size + id_len
+        if stop > end:
+            return
+        photo_id = bytes(buf[pos + IDX_RECORD.size:stop]).decode()
+        yield photo_id, flags, offset, size, cookie, stop
+        pos = stop
@@ -0,0 +1,44 @@
+import os
+import asyncio
+import httpx
+from .metrics import httpx_hooks
+
+DIR_SVC = os.getenv('DIR_SVC', 'http://directory-service:8001')
+STORE_ID = os.getenv('STORE_ID', 'store-service')
+STORE_ADDRESS = os.getenv('STORE_ADDRESS', 'http://store-service:8002')
+FAILURE_DOMAIN = os.getenv('FAILURE_DOMAIN', STORE_ID)
+# share of the directory's placement ring (1 = one store's worth)
+STORE_WEIGHT = float(os.getenv('STORE_WEIGHT', '1'))
+REGISTER_INTERVAL = float(os.getenv('REGISTER_INTERVAL_SECONDS', '10'))
+
+
+async def heartbeat_loop(engine):
+    """
+    Report this node's volumes (capacity, used bytes, read-only) to the
+    directory at startup and every REGISTER_INTERVAL; the directory
+    allocates new photos from these numbers.
+    """
+    async with httpx.AsyncClient(base_url=DIR_SVC, timeout=5, event_hooks=httpx_hooks()) as client:
+        while True:
+            try:
+                await client.post("/directory/volumes/register", json={
+                    "store_id": STORE_ID,
+                    "address": STORE_ADDRESS,
+                    "failure_domain": FAILURE_DOMAIN,
+                    "weight": STORE_WEIGHT,
+                    "volumes": engine.volume_report(),
+                })
+            except httpx.HTTPError:
+                # directory not up yet / unreachable: try again next tick
+                pass
+            await asyncio.sleep(REGISTER_INTERVAL)
+
+
+async def leader_loop(engine):
+    """
+    Heartbeat from one worker per node only: wait until this worker holds
+    the leader lock (another worker may have it), then heartbeat.
+    """
+    while not engine.try_lead():
+        await asyncio.sleep(REGISTER_INTERVAL)
+    await heartbeat_loop(engine)
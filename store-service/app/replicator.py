@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from .jobs import JobFiles
+from .registration import STORE_ID
+from .metrics import httpx_sync_hooks, STORE_BYTES
+
+# copies running at once on this node, across all jobs
+REPLICATION_WORKERS = int(os.getenv("REPLICATION_WORKERS", "4"))
+# body chunk size when streaming a needle to another node
+REPLICATION_CHUNK = 256 * 1024
+REPLICATION_TIMEOUT = float(os.getenv("REPLICATION_TIMEOUT", "60"))
+# how many finished jobs stay queryable
+REPLICATION_JOB_HISTORY = 100
+
+
+class ReplicationJob:
+    def __init__(self, copies: list):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"
+        self.copies = copies
+        self.results = [None] * len(copies)
+        self.copied_bytes = 0
+        self.pending = len(copies)
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def finish_copy(self, i: int, result: dict):
+        with self.lock:
+            self.results[i] = result
+            self.copied_bytes += result.get("size", 0)
+            self.pending -= 1
+            if self.pending:
+                self.status = "running"
+                return
+            self.status = "done" if all(r["status"] == "success" for r in self.results) else "failed"
+            self.finished_at = time.time()
+        self.done.set()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "copies": len(self.copies),
+            "remaining": self.pending,
+            "copied_bytes": self.copied_bytes,
+            "results": [r for r in self.results if r is not None],
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class Replicator:
+    """
+    Copies needles from this node's volumes to other volumes, here or on
+    another store node, so replica bandwidth never flows through the
+    webserver.
+
+    A job is a list of copies {"photo_id", "source_volume",
+    "target_store_id", "target_address", "target_volume"}; copies from
+    all jobs share a pool of REPLICATION_WORKERS threads. Local copies
+    append the on-disk needle straight out of the source mmap; remote
+    copies stream the payload in chunks to PUT /store/blob on the target.
+    Job status is also written to `jobs_dir`, so any worker can report it.
+    """
+
+    def __init__(self, volumes: dict, jobs_dir):
+        self.volumes = volumes
+        self.jobs = OrderedDict()   # job_id -> ReplicationJob
+        self.files = JobFiles(jobs_dir, REPLICATION_JOB_HISTORY)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=REPLICATION_WORKERS, thread_name_prefix="replicate")
+        self.client = httpx.Client(timeout=REPLICATION_TIMEOUT, event_hooks=httpx_sync_hooks())
+
+    def submit(self, copies: list) -> ReplicationJob:
+        job = ReplicationJob(copies)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > REPLICATION_JOB_HISTORY:
+                self.jobs.popitem(last=False)
+        if not copies:
+            job.status = "done"
+            job.finished_at = time.time()
+            job.done.set()
+        self._save(job)
+        self.files.trim()
+        for i, copy in enumerate(copies):
+            self.pool.submit(self._run, job, i, copy)
+        return job
+
+    def get(self, job_id: str):
+        """Status dict of a job started by any worker, or None."""
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else self.files.load(job_id)
+
+    def _save(self, job: ReplicationJob):
+        try:
+            with job.lock:
+                self.files.save(job.to_dict())
+        except OSError:
+            # only polls through other workers miss the update
+            pass
+
+    def _run(self, job: ReplicationJob, i: int, copy: dict):
+        result = {
+            "photo_id": copy["photo_id"],
+            "target_store_id": copy.get("target_store_id", STORE_ID),
+            "target_volume": copy["target_volume"],
+        }
+        try:
+            result.update(self._copy(copy))
+        except Exception as exc:
+            result.update({"status": "error", "reason": str(exc)})
+        job.finish_copy(i, result)
+        self._save(job)
+
+    def _copy(self, copy: dict):
+        photo_id = copy["photo_id"]
+        source = self.volumes.get(copy["source_volume"])
+        found = source.needle_view(photo_id) if source else None
+        if found is None:
+            return {"status": "error", "reason": "not found in source volume"}
+        entry, needle = found
+
+        if copy.get("target_store_id", STORE_ID) == STORE_ID:
+            target = self.volumes.get(copy["target_volume"])
+            if not target:
+                return {"status": "error", "reason": "volume not found"}
+            if not target.has_room(entry["size"]):
+                return {"status": "error", "reason": "volume read-only (full)"}
+            # the needle format is the same everywhere: append it as is
+            target.submit_raw(photo_id, entry["cookie"], entry["size"], needle).result()
+            STORE_BYTES.labels("written").inc(entry["size"])
+            return {"status": "success", "size": entry["size"]}
+
+        data = source.view(photo_id)
+        if data is None:
+            return {"status": "error", "reason": "not found in source volume"}
+        resp = self.client.put(
+            f"{copy['target_address']}/store/blob/{photo_id}",
+            params={"volume_id": copy["target_volume"], "cookie": str(entry["cookie"])},
+            headers={"Content-Length": str(len(data)), "Content-Type": "application/octet-stream"},
+            content=(bytes(data[pos:pos + REPLICATION_CHUNK]) for pos in range(0, len(data), REPLICATION_CHUNK)),
+        )
+        resp.raise_for_status()
+        body = resp.json()
+        if body.get("status") != "success":
+            return {"status": "error", "reason": body.get("reason", "write failed")}
+        return {"status": "success", "size": len(data)}
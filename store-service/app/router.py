@@ -1,26 +1,198 @@
-from fastapi import APIRouter, Body, HTTPException
+import re
+import struct
+import asyncio
+from fastapi import APIRouter, Body, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from .engine import StoreEngine
+from .metrics import STORE_BYTES
 
 router = APIRouter()
 engine = StoreEngine()
 
+BLOB_CHUNK = 256 * 1024
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# /store/read_batch response: one frame per photo, FRAME header
+# (id length, status, data length) followed by the id and the data
+FRAME = struct.Struct(">HBQ")
+FRAME_OK = 0
+FRAME_MISSING = 1
+
+
+def _parse_range(header: str, size: int):
+    """Single `bytes=` range -> (start, end) inclusive; None if unsatisfiable."""
+    m = RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        # suffix range: last N bytes
+        length = int(m.group(2))
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+async def _io(fn, *args):
+    """Run a disk-touching engine call on the engine's I/O threads."""
+    return await asyncio.get_running_loop().run_in_executor(engine.io, fn, *args)
+
+
+def _iter_view(view, chunk: int = BLOB_CHUNK):
+    for pos in range(0, len(view), chunk):
+        yield view[pos:pos + chunk]
+
+
+def _iter_frames(found):
+    for photo_id, view in found:
+        pid = photo_id.encode()
+        if view is None:
+            yield FRAME.pack(len(pid), FRAME_MISSING, 0) + pid
+            continue
+        yield FRAME.pack(len(pid), FRAME_OK, len(view)) + pid
+        yield from _iter_view(view)
+
+# write/delete block until their group commit is fsynced, so they are
+# plain `def` routes: FastAPI runs them in its threadpool and concurrent
+# requests land in the same batch instead of stalling the event loop.
 @router.post('/store/write')
-async def store_write(payload: dict = Body(...)):
+def store_write(payload: dict = Body(...)):
     return engine.write(payload)
 
+@router.post('/store/write_batch')
+def store_write_batch(payload: dict = Body(...)):
+    return engine.write_batch(payload)
+
 @router.get('/store/read/{photo_id}')
 async def store_read(photo_id: str):
-    data = engine.read(photo_id)
+    data = await _io(engine.read, photo_id)
     if not data:
         raise HTTPException(status_code=404, detail='not found')
     return data
 
+@router.get('/store/read/{volume_id}/{photo_id}')
+async def store_read_volume(volume_id: str, photo_id: str):
+    """Like /store/read/{photo_id} but only from one volume (one replica)."""
+    data = await _io(engine.read, photo_id, volume_id)
+    if not data:
+        raise HTTPException(status_code=404, detail='not found')
+    return data
+
+@router.get('/store/blob/{photo_id}')
+async def store_blob(photo_id: str, range: str = Header(None), volume_id: str = None):
+    """
+    Raw needle bytes as application/octet-stream, sliced straight out of
+    the volume mmap (no base64, no full-size copies). Supports one HTTP
+    Range per request; `?volume_id=` restricts the read to one replica.
+    """
+    found = await _io(engine.read_view, photo_id, volume_id)
+    if not found:
+        raise HTTPException(status_code=404, detail='not found')
+    volume_id, view = found
+    size = len(view)
+    headers = {"Accept-Ranges": "bytes", "X-Volume-Id": volume_id}
+    status = 200
+
+    if range and RANGE_RE.match(range.strip()):
+        # malformed Range headers are ignored, as RFC 9110 allows
+        bounds = _parse_range(range, size)
+        if bounds is None:
+            raise HTTPException(
+                status_code=416, detail='range not satisfiable',
+                headers={"Content-Range": f"bytes */{size}"},
+            )
+        start, end = bounds
+        view = view[start:end + 1]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        status = 206
+
+    headers["Content-Length"] = str(len(view))
+    STORE_BYTES.labels("read").inc(len(view))
+    return StreamingResponse(
+        _iter_view(view), status_code=status,
+        media_type="application/octet-stream", headers=headers,
+    )
+
+@router.put('/store/blob/{photo_id}')
+async def store_blob_put(photo_id: str, request: Request, volume_id: str, cookie: str = None):
+    """
+    Streaming write: the raw request body is the photo (no JSON, no
+    base64). Content-Length, when sent, is checked against the body.
+    """
+    length = request.headers.get("content-length")
+    return await engine.write_stream(
+        photo_id, volume_id, cookie, int(length) if length else None, request.stream()
+    )
+
+@router.post('/store/read_batch')
+async def store_read_batch(payload: dict = Body(...)):
+    """
+    Body: {"photos": [{"photo_id", "volume_id"}]} (volume_id optional).
+    Streams length-prefixed frames (see FRAME), in volume/offset order
+    rather than request order; missing photos get a FRAME_MISSING frame.
+    """
+    found = await _io(engine.read_views, payload.get("photos", []))
+    return StreamingResponse(_iter_frames(found), media_type="application/octet-stream")
+
 @router.post('/store/delete/{photo_id}')
-async def store_delete(photo_id: str):
-    engine.mark_deleted(photo_id)
-    return {"status":"marked_deleted"}
+def store_delete(photo_id: str, payload: dict = Body(None)):
+    """Body (optional): {"volume_id": "V1"} to delete only that replica."""
+    volume_id = (payload or {}).get("volume_id")
+    deleted = engine.mark_deleted(photo_id, volume_id)
+    return {"status":"marked_deleted","deleted":deleted}
+
+@router.get('/store/ready')
+async def store_ready():
+    """
+    Readiness probe: answers as soon as the app serves, with the startup
+    time and whether each volume index was adopted from its checkpoint,
+    rebuilt from the index file, or shared with another worker.
+    """
+    return engine.readiness()
+
+@router.get('/store/volumes')
+async def store_volumes():
+    return {"volumes": engine.volume_stats()}
+
+@router.get('/store/cache/stats')
+async def store_cache_stats():
+    return engine.cache_stats()
 
 @router.post('/store/compact')
-async def store_compact():
-    engine.compact()
-    return {"status":"compaction_started"}
\ No newline at end of file
+async def store_compact(payload: dict = Body(None)):
+    """
+    Start compaction jobs. Body (optional): {"volume_id": "V1", "force": true}.
+    Manual calls force compaction unless `force` is explicitly false.
+    """
+    payload = payload or {}
+    jobs = engine.compact(payload.get("volume_id"), payload.get("force", True))
+    return {"status": "compaction_started", "jobs": jobs}
+
+@router.get('/store/compact/{job_id}')
+async def store_compact_status(job_id: str):
+    job = engine.compaction_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='job not found')
+    return job
+
+@router.post('/store/replicate')
+def store_replicate(payload: dict = Body(...)):
+    """
+    Copy needles from this node to other volumes or store nodes.
+    Body: {"copies": [{"photo_id", "source_volume", "target_store_id",
+    "target_address", "target_volume"}], "wait": false}. With `wait` the
+    call returns once every copy finished (per-copy results included).
+    """
+    job = engine.replicate(payload.get("copies", []), payload.get("wait", False))
+    return {"status": "replication_started", "job": job}
+
+@router.get('/store/replicate/{job_id}')
+async def store_replicate_status(job_id: str):
+    job = engine.replication_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='job not found')
+    return job
@@ -0,0 +1,274 @@
+"""
+Volume index shared by every worker process.
+
+An open-addressing hash table (linear probing, crc32 of the photo_id)
+in a file mapped MAP_SHARED by every process serving the volume, so a
+needle appended by one worker is visible to the others at once and the
+index costs one copy of memory per machine instead of one per worker.
+
+    header (4 KiB): magic, slot count, used slots, seq, live bytes,
+                    live needles, volume inode, volume size, index file
+                    size, generation, stale flag, boot id, clean flag
+    slots:          state, photo_id length, offset, size, cookie, photo_id
+
+photo_ids longer than KEY_BYTES are stored as their blake2b digest; their
+real id is read back from the needle header when needed (`items`).
+
+Only the holder of the volume's exclusive lock writes. Writers make the
+header `seq` odd for the duration of an update; readers retry until they
+see the same even `seq` before and after a lookup (a seqlock), so reads
+take no lock at all. A table is never resized in place: a bigger or
+compacted one is written to a new file, renamed over the old one, and
+the old one is flagged `stale` so every process remaps.
+
+The table doubles as the index checkpoint across restarts: a process
+starting with nobody else mapping the table adopts it as is (pages fault
+in on first use) when it `survived` - no writer died mid-update, and
+either it was checkpointed (msync + `clean` flag, cleared again by the
+next update) or the machine has not rebooted since, so the page cache
+holds every update. Only otherwise is it rebuilt from the index file.
+"""
+import os
+import time
+import mmap
+import zlib
+import uuid
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from .needle import needle_length
+
+MAGIC = b"HSIDX001"
+HEADER_BYTES = 4096
+KEY_BYTES = 32
+# state, photo_id length, offset, size, cookie, photo_id (or its digest)
+SLOT = struct.Struct("<BxH4xQQQ32s")
+KEY_LEN = struct.Struct("<H")
+EMPTY, LIVE, DELETED = 0, 1, 2
+
+MIN_SLOTS = 1 << 14
+# tables are rebuilt twice as large past this load
+MAX_LOAD = 0.7
+# a seq that stays odd this long means its writer died mid-update
+TORN_AFTER = 1.0
+
+
+def _boot_id() -> int:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return uuid.UUID(f.read().strip()).int >> 64
+    except (OSError, ValueError):
+        return 0    # unknown: only checkpointed tables survive a restart
+
+
+BOOT_ID = _boot_id()
+
+
+class IndexTorn(Exception):
+    """The table was left mid-update; rebuild it from the index file."""
+
+
+class _Field:
+    """One 8-byte header field, read and written straight in the mapping."""
+
+    def __init__(self, i: int, fmt: str = "<Q"):
+        self.offset = 8 + 8 * i
+        self.struct = struct.Struct(fmt)
+
+    def __get__(self, table, owner=None):
+        if table is None:
+            return self
+        return self.struct.unpack_from(table.mm, self.offset)[0]
+
+    def __set__(self, table, value):
+        self.struct.pack_into(table.mm, self.offset, value)
+
+
+def _key(photo_id: str):
+    raw = photo_id.encode()
+    if len(raw) <= KEY_BYTES:
+        return raw, raw
+    return raw, hashlib.blake2b(raw, digest_size=KEY_BYTES).digest()
+
+
+class SharedIndex:
+    slots = _Field(0)
+    used = _Field(1)
+    seq = _Field(2)
+    live_bytes = _Field(3, "<q")
+    live_needles = _Field(4, "<q")
+    volume_ino = _Field(5)
+    volume_size = _Field(6)
+    idx_size = _Field(7)
+    generation = _Field(8)      # random per table; cache keys include it
+    stale = _Field(9)
+    boot = _Field(10)           # BOOT_ID of the last update
+    clean = _Field(11)          # checkpointed, no update since
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR)
+        try:
+            self.mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: not a shared index")
+        self.mask = self.slots - 1
+        self._writer = None     # thread id inside `writing`
+
+    @classmethod
+    def create(cls, path, items, count: int, volume_ino: int, volume_size: int, idx_size: int):
+        """
+        Write a table of `items` ((photo_id, entry) pairs, about `count` of
+        them) next to `path` and rename it into place.
+        """
+        slots = MIN_SLOTS
+        while slots < count * 2:
+            slots *= 2
+        tmp = path.with_name(path.name + ".tmp")
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, HEADER_BYTES + slots * SLOT.size)
+            mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        mm[:len(MAGIC)] = MAGIC
+        mm.close()
+
+        table = cls(tmp)
+        table.slots = slots
+        table.mask = slots - 1
+        table.volume_ino = volume_ino
+        table.volume_size = volume_size
+        table.idx_size = idx_size
+        table.generation = uuid.uuid4().int >> 65
+        live_bytes = live_needles = 0
+        for photo_id, entry in items:
+            table[photo_id] = entry
+            if not entry["deleted"]:
+                live_bytes += needle_length(len(photo_id.encode()), entry["size"])
+                live_needles += 1
+        table.live_bytes = live_bytes
+        table.live_needles = live_needles
+        table.boot = BOOT_ID
+        table.checkpoint()
+        os.replace(tmp, path)
+        table.path = path
+        return table
+
+    # -------------------------
+    # LOOKUP
+    # -------------------------
+    def _find(self, raw: bytes, key: bytes):
+        """(slot offset, found) for a key; the empty slot it would go in if not found."""
+        mm = self.mm
+        i = zlib.crc32(raw) & self.mask
+        while True:
+            off = HEADER_BYTES + i * SLOT.size
+            if mm[off] == EMPTY:
+                return off, False
+            if KEY_LEN.unpack_from(mm, off + 2)[0] == len(raw) and mm[off + 32:off + 32 + len(key)] == key:
+                return off, True
+            i = (i + 1) & self.mask
+
+    def _read(self, raw: bytes, key: bytes):
+        off, found = self._find(raw, key)
+        if not found:
+            return None
+        state, _, offset, size, cookie, _ = SLOT.unpack_from(self.mm, off)
+        return {"offset": offset, "size": size, "cookie": cookie, "deleted": state == DELETED}
+
+    def get(self, photo_id: str):
+        """Entry dict (a copy) or None; consistent even while another process writes."""
+        raw, key = _key(photo_id)
+        if self._writer == threading.get_ident():
+            return self._read(raw, key)
+        deadline = None
+        while True:
+            seq = self.seq
+            if not seq & 1:
+                entry = self._read(raw, key)
+                if self.seq == seq:
+                    return entry
+            if deadline is None:
+                deadline = time.monotonic() + TORN_AFTER
+            elif time.monotonic() > deadline:
+                raise IndexTorn(str(self.path))
+            time.sleep(0)
+
+    def __contains__(self, photo_id: str):
+        return self.get(photo_id) is not None
+
+    def __len__(self):
+        return self.used
+
+    def items(self, photo_id_at=None):
+        """
+        (photo_id, entry) for every slot in use; the caller holds the
+        volume's exclusive lock. `photo_id_at(offset)` resolves ids stored
+        as digests.
+        """
+        mm = self.mm
+        for i in range(self.slots):
+            off = HEADER_BYTES + i * SLOT.size
+            if mm[off] == EMPTY:
+                continue
+            state, klen, offset, size, cookie, key = SLOT.unpack_from(mm, off)
+            photo_id = key[:klen].decode() if klen <= KEY_BYTES else photo_id_at(offset)
+            yield photo_id, {"offset": offset, "size": size, "cookie": cookie, "deleted": state == DELETED}
+
+    # -------------------------
+    # UPDATE (exclusive lock held)
+    # -------------------------
+    @contextmanager
+    def writing(self):
+        """
+        Seqlock write section. If it raises, `seq` stays odd so the table
+        is treated as torn and rebuilt.
+        """
+        if self.clean or self.boot != BOOT_ID:
+            # durable before the slots change, so a crash mid-update is noticed
+            self.clean = 0
+            self.boot = BOOT_ID
+            self.mm.flush(0, HEADER_BYTES)
+        self._writer = threading.get_ident()
+        self.seq += 1
+        try:
+            yield self
+        finally:
+            self._writer = None
+        self.seq += 1
+
+    def __setitem__(self, photo_id: str, entry: dict):
+        raw, key = _key(photo_id)
+        off, found = self._find(raw, key)
+        SLOT.pack_into(
+            self.mm, off, DELETED if entry["deleted"] else LIVE, len(raw),
+            entry["offset"], entry["size"], entry["cookie"], key,
+        )
+        if not found:
+            self.used += 1
+
+    def full(self, extra: int = 0) -> bool:
+        return self.used + extra > self.slots * MAX_LOAD
+
+    @property
+    def torn(self) -> bool:
+        return bool(self.seq & 1)
+
+    @property
+    def survived(self) -> bool:
+        """Usable by a process starting now without a rebuild (see module docstring)."""
+        return not self.torn and (bool(self.clean) or (BOOT_ID != 0 and self.boot == BOOT_ID))
+
+    def checkpoint(self):
+        """Flush every slot to disk, then flag the table clean."""
+        self.mm.flush()
+        self.clean = 1
+        self.mm.flush(0, HEADER_BYTES)
+
+    def mark_stale(self):
+        self.stale = 1
@@ -0,0 +1,723 @@
+import os
+import queue
+import threading
+import time
+import mmap
+import weakref
+from concurrent.futures import Future
+from pathlib import Path
+
+from .needle import (
+    NEEDLE_MAGIC, FLAG_DELETED, HEADER,
+    pack_needle, needle_length, data_offset, scan_needles,
+    pack_index_record, iter_index_records, NeedleSpool,
+)
+from .locks import FileLock
+from .shared_index import SharedIndex, IndexTorn
+
+# Group commit: the writer thread gathers concurrent writes for up to
+# WINDOW ms (or MAX_NEEDLES / MAX_BYTES) into one append + fsync.
+GROUP_COMMIT_WINDOW = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2")) / 1000
+GROUP_COMMIT_MAX_NEEDLES = int(os.getenv("GROUP_COMMIT_MAX_NEEDLES", "64"))
+GROUP_COMMIT_MAX_BYTES = int(os.getenv("GROUP_COMMIT_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Volumes refuse new needles past this size (Haystack-style ~100 GB volumes)
+VOLUME_CAPACITY = int(os.getenv("VOLUME_CAPACITY_BYTES", str(100 * 1024 ** 3)))
+
+# Compaction copies live needles in sequential chunks of at most this size
+COMPACTION_CHUNK = 1024 * 1024
+
+
+def _write_all(fd: int, chunks):
+    for chunk in chunks:
+        if isinstance(chunk, NeedleSpool):
+            _write_all(fd, chunk.chunks())
+            continue
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+def _apply(index, photo_id, flags, offset, size, cookie):
+    """Apply one index record; returns the change in (live bytes, live needles)."""
+    old = index.get(photo_id)
+    live = old is not None and not old["deleted"]
+    freed = needle_length(len(photo_id.encode()), old["size"]) if live else 0
+    if flags & FLAG_DELETED:
+        if live and old["offset"] == offset:
+            index[photo_id] = dict(old, deleted=True)
+            return -freed, -1
+        return 0, 0
+    index[photo_id] = {
+        "offset": offset,
+        "size": size,
+        "cookie": cookie,
+        "deleted": False,
+    }
+    return needle_length(len(photo_id.encode()), size) - freed, 0 if live else 1
+
+
+class _Moved(Exception):
+    """The volume file was swapped after its index was read; wait and retry."""
+
+
+class VolumeState:
+    """
+    Shared index and read mapping of one incarnation of a volume file.
+
+    Compaction (in any process) writes a fresh index for the new file,
+    swaps it in and flags the old one stale, so a reader that grabbed a
+    state always resolves offsets against the file those offsets belong to.
+    """
+
+    def __init__(self, path: Path, index: SharedIndex):
+        self.index = index
+        self._rfd = os.open(path, os.O_RDONLY)
+        if os.fstat(self._rfd).st_ino != index.volume_ino:
+            os.close(self._rfd)
+            raise _Moved(str(path))
+        self._mmap = None
+        self._map_lock = threading.Lock()
+        # the fd must outlive the swap for readers still holding this state
+        weakref.finalize(self, os.close, self._rfd)
+
+    # kept up to date by every applied record, so garbage is O(1) to get
+    @property
+    def live_bytes(self) -> int:
+        return self.index.live_bytes
+
+    @property
+    def live_needles(self) -> int:
+        return self.index.live_needles
+
+    def mapping(self, end: int):
+        """
+        Read-only mmap of the volume shared by all readers. The volume only
+        grows, so it is remapped when a needle lies past the current
+        mapping; old mappings stay alive while views into them exist.
+        """
+        m = self._mmap
+        if m is None or len(m) < end:
+            with self._map_lock:
+                m = self._mmap
+                if m is None or len(m) < end:
+                    m = mmap.mmap(self._rfd, 0, access=mmap.ACCESS_READ)
+                    self._mmap = m
+        return m
+
+    def lookup(self, photo_id: str):
+        """Index entry of the live needle, or None."""
+        entry = self.index.get(photo_id)
+        if not entry or entry["deleted"]:
+            return None
+        return entry
+
+    def payload(self, photo_id: str, entry: dict):
+        """Zero-copy memoryview of the payload of the needle `entry` points at."""
+        if entry["size"] == 0:
+            return memoryview(b"")
+        start = data_offset(entry["offset"], len(photo_id.encode()))
+        end = start + entry["size"]
+        return memoryview(self.mapping(end))[start:end]
+
+    def needle(self, photo_id: str, entry: dict):
+        """Memoryview of the whole on-disk needle `entry` points at."""
+        start = entry["offset"]
+        end = start + needle_length(len(photo_id.encode()), entry["size"])
+        return memoryview(self.mapping(end))[start:end]
+
+    def photo_id_at(self, offset: int) -> str:
+        """photo_id stored in the header of the needle at `offset`."""
+        start = offset + HEADER.size
+        id_len = HEADER.unpack_from(self.mapping(start), offset)[3]
+        return bytes(self.mapping(start + id_len)[start:start + id_len]).decode()
+
+    def items(self):
+        return self.index.items(self.photo_id_at)
+
+
+class Volume:
+    """
+    One append-only volume file plus its append-only index file, served
+    by any number of worker processes.
+
+    The index (photo_id -> location) is a SharedIndex file mapped by every
+    process. The first process to open the volume adopts the table left by
+    the previous run when it survived (see shared_index.py) and matches
+    the files, so startup does not grow with the photo count; otherwise it
+    rebuilds it from the index file, and needles appended after the last
+    index record (crash between the two appends) are recovered by
+    scanning the volume tail.
+
+    Each process funnels its appends through one writer thread which
+    batches them (group commit) under the volume's exclusive file lock:
+    volume append + fsync, then index append + fsync, then the shared
+    index, then every caller in the batch is acked. Reads take no lock.
+    """
+
+    def __init__(self, volume_id: str, path: Path):
+        self.volume_id = volume_id
+        self.path = path
+        self.idx_path = path.with_suffix(".idx")
+        self.hix_path = path.with_suffix(".hix")
+        self.capacity = VOLUME_CAPACITY
+        # this process: the writer thread vs compaction
+        self.lock = threading.Lock()
+        # every process: exclusive for appends, compaction swaps and index
+        # rebuilds; shared to wait for a swap to finish
+        self.flock = FileLock(path.with_suffix(".lock"))
+        # held shared by every process that maps the shared index
+        self._users = FileLock(path.with_suffix(".users"))
+        # one compaction per volume across processes
+        self._compacting = FileLock(path.with_suffix(".compacting"))
+        self.state = None
+        self._wfd = self._ifd = None
+        # how this process got its index: "checkpoint", "rebuilt" or "shared"
+        self.index_source = "shared"
+
+        self.path.touch(exist_ok=True)
+        with self.lock, self.flock.exclusive():
+            if self._users.try_exclusive():
+                # no other process maps the shared index: it may predate a crash
+                self._finish_compaction()
+                if self._checkpoint_survived():
+                    self.index_source = "checkpoint"
+                    self._sync()
+                else:
+                    self._rebuild()
+                self._users.share()
+            else:
+                self._users.share()
+                self._sync()
+
+        self._queue = queue.Queue()
+        threading.Thread(target=self._writer_loop, daemon=True).start()
+
+    @property
+    def index(self) -> SharedIndex:
+        return self.current().index
+
+    @property
+    def size(self) -> int:
+        return self.current().index.volume_size
+
+    def has_room(self, size: int) -> bool:
+        return self.size + needle_length(0, size) <= self.capacity
+
+    # -------------------------
+    # SHARED STATE
+    # -------------------------
+    def current(self) -> VolumeState:
+        """This process's state, remapped first if another process swapped the index."""
+        state = self.state
+        while state.index.stale:
+            try:
+                state = self.state = self._load()
+            except (OSError, ValueError, _Moved):
+                # caught between the renames of a swap: wait for it to end
+                with self.flock.shared():
+                    pass
+        return state
+
+    def lookup(self, photo_id: str):
+        """(state, entry of the live needle or None)."""
+        try:
+            state = self.current()
+            return state, state.lookup(photo_id)
+        except IndexTorn:
+            # its writer died mid-update: rebuild it, then look again
+            with self.lock, self.flock.exclusive():
+                self._sync()
+            state = self.current()
+            return state, state.lookup(photo_id)
+
+    def _load(self) -> VolumeState:
+        return VolumeState(self.path, SharedIndex(self.hix_path))
+
+    def _checkpoint_survived(self) -> bool:
+        try:
+            return self._load().index.survived
+        except (OSError, ValueError, _Moved):
+            return False
+
+    def _reopen_files(self):
+        """Point the append fds at the current volume and index files."""
+        if self._wfd is not None:
+            os.close(self._wfd)
+            os.close(self._ifd)
+        self._wfd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        self._ifd = os.open(self.idx_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _matches(self, index: SharedIndex) -> bool:
+        try:
+            vstat = os.stat(self.path)
+            return (
+                vstat.st_ino == index.volume_ino
+                and vstat.st_size == index.volume_size
+                and os.stat(self.idx_path).st_size == index.idx_size
+            )
+        except OSError:
+            return False
+
+    def _sync(self):
+        """
+        Catch up with the other processes (lock and exclusive flock held):
+        switch to a shared index another process replaced, rebuild it if
+        its writer died mid-update or it does not match the files, and
+        point the append fds at the current files.
+        """
+        state = self.state
+        if state is None or state.index.stale:
+            try:
+                state = self.state = self._load()
+            except (OSError, ValueError, _Moved):
+                state = None
+        if state is None or state.index.torn or not self._matches(state.index):
+            self._rebuild()
+        elif self._wfd is None or os.fstat(self._wfd).st_ino != state.index.volume_ino:
+            self._reopen_files()
+
+    def _publish(self, items, count: int):
+        """Write a shared index of `items` for the files as they are now and switch to it."""
+        self._reopen_files()
+        vstat = os.stat(self.path)
+        table = SharedIndex.create(
+            self.hix_path, items, count, vstat.st_ino, vstat.st_size, os.stat(self.idx_path).st_size
+        )
+        self.state = VolumeState(self.path, table)
+
+    def _rebuild(self):
+        """Rebuild the shared index from the index file (lock and exclusive flock held)."""
+        try:
+            previous = SharedIndex(self.hix_path)
+        except (OSError, ValueError):
+            previous = None
+        index = self._recover()
+        self._publish(index.items(), len(index))
+        self.index_source = "rebuilt"
+        if previous is not None:
+            previous.mark_stale()
+
+    def checkpoint(self):
+        """Make the shared index durable so the next start can adopt it after a reboot."""
+        with self.lock, self.flock.exclusive():
+            self._sync()
+            self.state.index.checkpoint()
+
+    def _grow(self, extra: int):
+        """Move to a shared index twice the size (lock and exclusive flock held)."""
+        old = self.state
+        self._publish(old.items(), len(old.index) + extra)
+        old.index.mark_stale()
+
+    # -------------------------
+    # RECOVERY
+    # -------------------------
+    def _finish_compaction(self):
+        """Roll an interrupted compaction swap forward or back."""
+        tmp = self.path.with_suffix(".compact")
+        idx_tmp = self.path.with_suffix(".idx.compact")
+        if idx_tmp.exists() and not tmp.exists():
+            # volume was swapped, index was not: finish the swap
+            os.replace(idx_tmp, self.idx_path)
+        tmp.unlink(missing_ok=True)
+        idx_tmp.unlink(missing_ok=True)
+
+    def _recover(self) -> dict:
+        self._finish_compaction()
+        index = {}
+        end = 0
+        if self.idx_path.exists():
+            raw = self.idx_path.read_bytes()
+            valid = 0
+            for photo_id, flags, offset, size, cookie, stop in iter_index_records(raw):
+                _apply(index, photo_id, flags, offset, size, cookie)
+                end = max(end, offset + needle_length(len(photo_id.encode()), size))
+                valid = stop
+            if valid < len(raw):
+                # torn tail record from a crash mid-append
+                os.truncate(self.idx_path, valid)
+
+        vsize = self.path.stat().st_size
+        if end > vsize:
+            # index points past the volume: it cannot be trusted, rescan
+            index = {}
+            self.idx_path.write_bytes(b"")
+            end = 0
+
+        if end < vsize:
+            self._scan_tail(index, end, vsize)
+        return index
+
+    def _scan_tail(self, index: dict, start: int, vsize: int):
+        """Rebuild index entries for needles in [start, vsize) and append them to the index file."""
+        good = start
+        records = []
+        with self.path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for offset, photo_id, cookie, flags, size, length in scan_needles(buf, start):
+                _apply(index, photo_id, 0, offset, size, cookie)
+                records.append(pack_index_record(photo_id, 0, offset, size, cookie))
+                if flags & FLAG_DELETED:
+                    _apply(index, photo_id, FLAG_DELETED, offset, size, cookie)
+                    records.append(pack_index_record(photo_id, FLAG_DELETED, offset, size, cookie))
+                good = offset + length
+
+        if records:
+            with self.idx_path.open("ab") as idx:
+                idx.write(b"".join(records))
+        if good < vsize:
+            # torn needle at the tail of the volume
+            os.truncate(self.path, good)
+
+    # -------------------------
+    # DATA PATH
+    # -------------------------
+    def submit(self, photo_id: str, cookie: int, data: bytes) -> Future:
+        """Queue a needle; the future resolves to its offset once durable."""
+        fut = Future()
+        needle = pack_needle(photo_id, cookie, data)
+        self._queue.put((photo_id, cookie, len(data), needle, fut))
+        return fut
+
+    def submit_raw(self, photo_id: str, cookie: int, size: int, needle) -> Future:
+        """Queue an already packed needle (e.g. copied from another volume)."""
+        fut = Future()
+        self._queue.put((photo_id, cookie, size, needle, fut))
+        return fut
+
+    def submit_spool(self, photo_id: str, spool: NeedleSpool) -> Future:
+        """Queue a finished NeedleSpool; it is copied into the volume by the writer."""
+        fut = Future()
+        self._queue.put((photo_id, spool.cookie, spool.size, spool, fut))
+        return fut
+
+    def submit_many(self, needles) -> list:
+        """
+        Queue several (photo_id, cookie, data) back to back so the writer
+        picks them up together: one append + fsync for the lot (split only
+        at the group commit limits).
+        """
+        items = [
+            (photo_id, cookie, len(data), pack_needle(photo_id, cookie, data), Future())
+            for photo_id, cookie, data in needles
+        ]
+        for item in items:
+            self._queue.put(item)
+        return [item[4] for item in items]
+
+    def append(self, photo_id: str, cookie: int, data: bytes):
+        return self.submit(photo_id, cookie, data).result()
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            nbytes = len(item[3] or b"")
+            deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+            while len(batch) < GROUP_COMMIT_MAX_NEEDLES and nbytes < GROUP_COMMIT_MAX_BYTES:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                batch.append(item)
+                nbytes += len(item[3] or b"")
+            try:
+                self._commit(batch)
+            except Exception as exc:
+                # e.g. the flock, a resync or an index rebuild failed: fail
+                # this batch and keep the writer alive, or every later
+                # write to the volume would wait for its ack forever
+                for *_, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+
+    def _commit(self, batch):
+        """One append + fsync for a whole batch of needles and tombstones."""
+        results = []
+        with self.lock, self.flock.exclusive():
+            # another process may have appended, grown or compacted meanwhile
+            self._sync()
+            if self.state.index.full(len(batch)):
+                self._grow(len(batch))
+            index = self.state.index
+            offset = index.volume_size
+            needles = []
+            records = []
+            applied = []
+            # photo_id -> (offset, size, cookie, live) as of this point in the batch
+            pending = {}
+            for photo_id, cookie, size, needle, fut in batch:
+                if needle is None:
+                    # tombstone: only an index record
+                    if photo_id in pending:
+                        loc = pending[photo_id]
+                    else:
+                        entry = index.get(photo_id)
+                        loc = entry and (entry["offset"], entry["size"], entry["cookie"], not entry["deleted"])
+                    if not loc or not loc[3]:
+                        results.append((fut, False))
+                        continue
+                    args = (photo_id, FLAG_DELETED, loc[0], loc[1], loc[2])
+                    pending[photo_id] = (loc[0], loc[1], loc[2], False)
+                    records.append(pack_index_record(*args))
+                    applied.append(args)
+                    results.append((fut, True))
+                    continue
+                args = (photo_id, 0, offset, size, cookie)
+                pending[photo_id] = (offset, size, cookie, True)
+                needles.append(needle)
+                records.append(pack_index_record(*args))
+                applied.append(args)
+                results.append((fut, offset))
+                offset += len(needle)
+
+            try:
+                if needles:
+                    _write_all(self._wfd, needles)
+                    os.fsync(self._wfd)
+                # the index never references bytes that are not durable yet
+                if records:
+                    _write_all(self._ifd, records)
+                    os.fsync(self._ifd)
+            except Exception as exc:
+                # roll both files back so the batch leaves no partial state
+                os.ftruncate(self._wfd, index.volume_size)
+                os.ftruncate(self._ifd, index.idx_size)
+                for fut, _ in results:
+                    fut.set_exception(exc)
+                return
+
+            with index.writing():
+                live_bytes = live_needles = 0
+                for args in applied:
+                    nbytes, count = _apply(index, *args)
+                    live_bytes += nbytes
+                    live_needles += count
+                index.live_bytes += live_bytes
+                index.live_needles += live_needles
+                index.volume_size = offset
+                index.idx_size += sum(len(r) for r in records)
+
+        for fut, value in results:
+            fut.set_result(value)
+
+    def view(self, photo_id: str):
+        state, entry = self.lookup(photo_id)
+        return None if entry is None else state.payload(photo_id, entry)
+
+    def needle_view(self, photo_id: str):
+        """(entry, memoryview of the whole needle) or None."""
+        state, entry = self.lookup(photo_id)
+        return None if entry is None else (entry, state.needle(photo_id, entry))
+
+    def read(self, photo_id: str):
+        view = self.view(photo_id)
+        return None if view is None else bytes(view)
+
+    def submit_delete(self, photo_id: str) -> Future:
+        """Queue a tombstone; resolves to True if a live needle was deleted."""
+        fut = Future()
+        self._queue.put((photo_id, 0, 0, None, fut))
+        return fut
+
+    def delete(self, photo_id: str) -> bool:
+        if self.lookup(photo_id)[1] is None:
+            return False
+        return self.submit_delete(photo_id).result()
+
+    # -------------------------
+    # COMPACTION
+    # -------------------------
+    def garbage_bytes(self) -> int:
+        """Bytes held by deleted or overwritten needles."""
+        state = self.current()
+        return max(state.index.volume_size - state.live_bytes, 0)
+
+    def stats(self) -> dict:
+        state = self.current()
+        size = state.index.volume_size
+        garbage = max(size - state.live_bytes, 0)
+        return {
+            "volume_id": self.volume_id,
+            "capacity": self.capacity,
+            "size": size,
+            "live_bytes": state.live_bytes,
+            "live_needles": state.live_needles,
+            "garbage_bytes": garbage,
+            "garbage_ratio": round(garbage / size, 4) if size else 0.0,
+        }
+
+    def compact(self, job, rate: int = 0) -> bool:
+        """
+        Online compaction: copy live needles into a new file in sequential,
+        rate-limited chunks while reads and writes continue against the
+        current file, catch up on needles appended meanwhile, then swap
+        file, index file and shared index while writers are paused.
+
+        `job` is updated in place (total_bytes, copied_bytes,
+        reclaimed_bytes) so callers can report progress. Returns False
+        without doing anything if another process is compacting the volume.
+        """
+        if not self._compacting.try_exclusive():
+            return False
+        try:
+            self._compact(job, rate)
+        finally:
+            self._compacting.release()
+        return True
+
+    def _compact(self, job, rate: int):
+        tmp = self.path.with_suffix(".compact")
+        idx_tmp = self.path.with_suffix(".idx.compact")
+
+        with self.lock, self.flock.exclusive():
+            self._sync()
+            state = self.state
+            end = state.index.volume_size
+            snapshot = list(state.items())
+        live = sorted(
+            (e["offset"], pid, needle_length(len(pid.encode()), e["size"]))
+            for pid, e in snapshot
+            if not e["deleted"]
+        )
+        job.total_bytes = sum(length for _, _, length in live)
+
+        placed = {}   # photo_id -> (source offset, new offset)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            pacer = _Pacer(rate)
+            pos = self._copy_needles(state, live, fd, 0, placed, job, pacer)
+
+            # catch up on needles appended while copying; writers keep going
+            with self.lock, self.flock.exclusive():
+                self._sync()
+                tail_end = self.state.index.volume_size
+            tail = self._scan_range(state, end, tail_end)
+            job.total_bytes += sum(length for _, _, length in tail)
+            pos = self._copy_needles(state, tail, fd, pos, placed, job, pacer)
+
+            with self.lock, self.flock.exclusive():
+                # writers of every process are paused from here until the swap is done
+                self._sync()
+                current = self.state
+                tail = self._scan_range(current, tail_end, current.index.volume_size)
+                job.total_bytes += sum(length for _, _, length in tail)
+                pos = self._copy_needles(current, tail, fd, pos, placed, job, _Pacer(0))
+
+                new_index = {}
+                records = []
+                for pid, (src, new_offset) in sorted(placed.items(), key=lambda item: item[1][1]):
+                    cur = current.index.get(pid)
+                    if not cur or cur["deleted"] or cur["offset"] != src:
+                        # deleted or rewritten while we were copying
+                        continue
+                    new_index[pid] = dict(cur, offset=new_offset)
+                    records.append(pack_index_record(pid, 0, new_offset, cur["size"], cur["cookie"]))
+
+                os.fsync(fd)
+                with idx_tmp.open("wb") as iout:
+                    iout.write(b"".join(records))
+                    iout.flush()
+                    os.fsync(iout.fileno())
+
+                # volume first, index second: _finish_compaction relies on it
+                os.replace(tmp, self.path)
+                _fsync_dir(self.path.parent)
+                os.replace(idx_tmp, self.idx_path)
+                _fsync_dir(self.path.parent)
+
+                job.reclaimed_bytes = current.index.volume_size - pos
+                self._publish(new_index.items(), len(new_index))
+                current.index.mark_stale()
+        finally:
+            os.close(fd)
+            tmp.unlink(missing_ok=True)
+            idx_tmp.unlink(missing_ok=True)
+
+    def _scan_range(self, state: VolumeState, start: int, end: int):
+        """(offset, photo_id, length) of needles appended in [start, end)."""
+        if end <= start:
+            return []
+        buf = memoryview(state.mapping(end))[:end]
+        return [(offset, pid, length) for offset, pid, _, _, _, length in scan_needles(buf, start)]
+
+    def _copy_needles(self, state: VolumeState, needles, fd: int, pos: int, placed: dict, job, pacer):
+        """Copy needles (sorted by offset) coalescing adjacent ones into sequential chunks."""
+        i = 0
+        while i < len(needles):
+            run_start, _, length = needles[i]
+            run_end = run_start + length
+            j = i + 1
+            while j < len(needles) and needles[j][0] == run_end and run_end - run_start < COMPACTION_CHUNK:
+                run_end += needles[j][2]
+                j += 1
+
+            buf = memoryview(state.mapping(run_end))
+            for chunk_start in range(run_start, run_end, COMPACTION_CHUNK):
+                chunk = buf[chunk_start:min(chunk_start + COMPACTION_CHUNK, run_end)]
+                _write_all(fd, (chunk,))
+                job.copied_bytes += len(chunk)
+                pacer.consume(len(chunk))
+
+            for offset, pid, _ in needles[i:j]:
+                placed[pid] = (offset, pos + offset - run_start)
+            pos += run_end - run_start
+            i = j
+        return pos
+
+
+class _Pacer:
+    """Sleeps just enough to keep the copy under `rate` bytes/s (0 = unlimited)."""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.done = 0
+
+    def consume(self, nbytes: int):
+        if not self.rate:
+            return
+        self.done += nbytes
+        ahead = self.done / self.rate - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def _fsync_dir(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def migrate_legacy_volume(path: Path, entries: dict):
+    """
+    Convert a volume written in the old `8-byte length | data` layout into
+    needles, using the entries of the old index.json that point into it.
+    """
+    if not path.exists() or path.stat().st_size == 0:
+        return
+    with path.open("rb") as f:
+        head = f.read(HEADER.size)
+    if int.from_bytes(head[:4], "big") == NEEDLE_MAGIC:
+        return
+
+    tmp = path.with_suffix(".migrate")
+    with path.open("rb") as src, tmp.open("wb") as out:
+        for photo_id, meta in sorted(entries.items(), key=lambda item: item[1]["offset"]):
+            if meta.get("deleted"):
+                continue
+            src.seek(meta["offset"])
+            size = int.from_bytes(src.read(8), "big")
+            out.write(pack_needle(photo_id, 0, src.read(size)))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, path)
+    path.with_suffix(".idx").unlink(missing_ok=True)
@@ -0,0 +1,64 @@
+import os
+import asyncio
+
+ACCESS_FLUSH_INTERVAL = float(os.getenv('ACCESS_FLUSH_INTERVAL_MS', '100')) / 1000
+ACCESS_FLUSH_MAX_EVENTS = int(os.getenv('ACCESS_FLUSH_MAX_EVENTS', '1000'))
+# distinct photos kept while the replication manager is unreachable
+ACCESS_MAX_PENDING = int(os.getenv('ACCESS_MAX_PENDING', '100000'))
+
+
+class AccessBuffer:
+    """
+    Aggregates photo access events in memory and ships them to the
+    replication manager as {photo_id: count} every ACCESS_FLUSH_INTERVAL
+    or as soon as ACCESS_FLUSH_MAX_EVENTS have piled up, so request
+    handlers never wait on the replication manager.
+    """
+
+    def __init__(self, send):
+        self.send = send            # async callable(counts: dict)
+        self.counts = {}
+        self.events = 0
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def record(self, photo_id: str):
+        self.counts[photo_id] = self.counts.get(photo_id, 0) + 1
+        self.events += 1
+        if self.events >= ACCESS_FLUSH_MAX_EVENTS:
+            self._wake.set()
+
+    async def flush(self):
+        if not self.counts:
+            return
+        counts, self.counts, self.events = self.counts, {}, 0
+        try:
+            await self.send(counts)
+        except Exception:
+            # keep the counts for the next flush unless the backlog is too big
+            for photo_id, n in counts.items():
+                if photo_id in self.counts or len(self.counts) < ACCESS_MAX_PENDING:
+                    self.counts[photo_id] = self.counts.get(photo_id, 0) + n
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=ACCESS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
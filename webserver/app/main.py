@@ -1,11 +1,29 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
-from .router import router
+from .router import router, r, access, meta_cache, store_map
+from .upstream import close_upstreams
+from . import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    access.start()
+    meta_cache.start()
+    store_map.start()
+    yield
+    await store_map.stop()
+    await meta_cache.stop()
+    await access.stop()
+    # upstream and Redis pools live as long as the app
+    await close_upstreams()
+    await r.aclose()
 
-app = FastAPI(title="Web Server")
+app = FastAPI(title="Web Server", lifespan=lifespan)
 app.include_router(router)
+# /metrics + X-Trace-Id propagation
+metrics.install(app)
 
 # Serve static folder
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+META_CACHE_SIZE = int(os.getenv('META_CACHE_SIZE', '100000'))
+META_CACHE_TTL = float(os.getenv('META_CACHE_TTL_SECONDS', '60'))
+META_SYNC_INTERVAL = float(os.getenv('META_SYNC_INTERVAL_SECONDS', '1'))
+
+
+class MetadataCache:
+    """
+    Bounded LRU of directory entries (photo_id -> entry) with a TTL.
+
+    Entries are also invalidated by the directory's change feed, which is
+    polled every META_SYNC_INTERVAL: a change carrying a newer version
+    (or a deletion) drops the cached entry, and a feed reset (directory
+    restarted, or we fell behind its changelog) drops everything.
+
+    A lookup takes a `token()` before fetching from the directory and
+    passes it to `put`; the put is skipped if the photo was invalidated
+    meanwhile, so a change applied during the fetch is not overwritten
+    with the stale entry.
+    """
+
+    def __init__(self, fetch_changes):
+        self.fetch_changes = fetch_changes   # async callable(epoch, since) -> feed dict
+        self.entries = OrderedDict()         # photo_id -> (expires_at, entry)
+        self.epoch = ""
+        self.seq = 0
+        # invalidation clock: photo_id -> clock of its last invalidation,
+        # bounded; puts older than `floor` cannot be checked and are skipped
+        self.clock = 0
+        self.floor = 0
+        self.touched = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._task = None
+
+    def get(self, photo_id: str):
+        item = self.entries.get(photo_id)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self.entries[photo_id]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(photo_id)
+        self.hits += 1
+        return item[1]
+
+    def token(self):
+        return self.clock
+
+    def _touch(self, photo_id: str):
+        self.clock += 1
+        self.touched[photo_id] = self.clock
+        self.touched.move_to_end(photo_id)
+        while len(self.touched) > META_CACHE_SIZE:
+            _, clock = self.touched.popitem(last=False)
+            self.floor = max(self.floor, clock)
+
+    def put(self, photo_id: str, entry: dict, token: int = None):
+        if token is not None and (token < self.floor or self.touched.get(photo_id, 0) > token):
+            # invalidated while it was being fetched
+            return
+        self.entries[photo_id] = (time.monotonic() + META_CACHE_TTL, entry)
+        self.entries.move_to_end(photo_id)
+        while len(self.entries) > META_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, photo_id: str):
+        self.entries.pop(photo_id, None)
+        self._touch(photo_id)
+
+    def clear(self):
+        self.entries.clear()
+        self.touched.clear()
+        self.clock += 1
+        self.floor = self.clock
+
+    def apply_changes(self, feed: dict):
+        if feed.get("reset"):
+            self.clear()
+        for change in feed.get("changes", []):
+            # also for photos not cached: a lookup may be fetching them
+            self._touch(change["photo_id"])
+            item = self.entries.get(change["photo_id"])
+            if item is None:
+                continue
+            version = change["version"]
+            if version is None or version > item[1].get("version", 0):
+                del self.entries[change["photo_id"]]
+        self.epoch = feed["epoch"]
+        self.seq = feed["seq"]
+
+    async def sync(self):
+        self.apply_changes(await self.fetch_changes(self.epoch, self.seq))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                # cannot tell what changed meanwhile: start over
+                self.clear()
+                self.epoch = ""
+            await asyncio.sleep(META_SYNC_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,200 @@
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict
+
+from .metrics import REDIS_LATENCY, CACHE_REQUESTS
+
+# in-process tier: byte budget, largest photo admitted, staleness bound
+HOT_CACHE_BYTES = int(os.getenv('HOT_CACHE_BYTES', str(64 * 1024 * 1024)))
+HOT_CACHE_MAX_ITEM = int(os.getenv('HOT_CACHE_MAX_ITEM_BYTES', str(1024 * 1024)))
+HOT_CACHE_TTL = float(os.getenv('HOT_CACHE_TTL_SECONDS', '30'))
+# Redis tier TTL = base * heat factor * size factor, clamped to [MIN, MAX]
+PHOTO_TTL_BASE = float(os.getenv('PHOTO_TTL_BASE_SECONDS', '300'))
+PHOTO_TTL_MIN = float(os.getenv('PHOTO_TTL_MIN_SECONDS', '60'))
+PHOTO_TTL_MAX = float(os.getenv('PHOTO_TTL_MAX_SECONDS', '3600'))
+PHOTO_TTL_REF_BYTES = int(os.getenv('PHOTO_TTL_REF_BYTES', str(256 * 1024)))
+# local request heat, halved every HALF_LIFE seconds
+HEAT_HALF_LIFE = float(os.getenv('PHOTO_HEAT_HALF_LIFE_SECONDS', '60'))
+HEAT_TRACKED = 100000
+
+KEY_PREFIX = "photo:raw:"
+
+
+class _LeaderCancelled(Exception):
+    """The request loading a photo was cancelled; a waiter loads it instead."""
+
+
+class PhotoCache:
+    """
+    Two-tier photo cache with single-flight loading.
+
+    Tier 1 is an in-process LRU bounded by HOT_CACHE_BYTES that only
+    admits photos requested at least twice recently (so one-off reads do
+    not flush it). Tier 2 is Redis holding raw bytes. Concurrent misses
+    for one photo share a single load. Redis TTLs grow with request heat
+    and shrink with size, so memory goes to photos that save the most
+    store reads per byte.
+    """
+
+    def __init__(self, redis):
+        self.r = redis                  # decode_responses=False client
+        self.hot = OrderedDict()        # photo_id -> (expires_at, bytes)
+        self.hot_bytes = 0
+        self.heat = OrderedDict()       # photo_id -> (heat, updated_at)
+        self.inflight = {}              # photo_id -> Future
+        self.coalesced = 0
+
+    # -------------------------
+    # HEAT / TTL
+    # -------------------------
+    def _touch(self, photo_id: str) -> float:
+        now = time.monotonic()
+        heat, at = self.heat.pop(photo_id, (0.0, now))
+        heat = heat * 0.5 ** ((now - at) / HEAT_HALF_LIFE) + 1
+        self.heat[photo_id] = (heat, now)
+        if len(self.heat) > HEAT_TRACKED:
+            self.heat.popitem(last=False)
+        return heat
+
+    def ttl(self, heat: float, size: int) -> int:
+        factor = (1 + math.log2(max(heat, 1))) * math.sqrt(PHOTO_TTL_REF_BYTES / max(size, PHOTO_TTL_REF_BYTES // 16))
+        return int(min(max(PHOTO_TTL_BASE * factor, PHOTO_TTL_MIN), PHOTO_TTL_MAX))
+
+    # -------------------------
+    # HOT TIER
+    # -------------------------
+    def _hot_get(self, photo_id: str):
+        item = self.hot.get(photo_id)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            self._hot_drop(photo_id)
+            return None
+        self.hot.move_to_end(photo_id)
+        return item[1]
+
+    def _hot_put(self, photo_id: str, data: bytes, heat: float):
+        if len(data) > HOT_CACHE_MAX_ITEM or heat < 2:
+            return
+        self._hot_drop(photo_id)
+        self.hot[photo_id] = (time.monotonic() + HOT_CACHE_TTL, data)
+        self.hot_bytes += len(data)
+        while self.hot_bytes > HOT_CACHE_BYTES:
+            _, (_, old) = self.hot.popitem(last=False)
+            self.hot_bytes -= len(old)
+
+    def _hot_drop(self, photo_id: str):
+        item = self.hot.pop(photo_id, None)
+        if item is not None:
+            self.hot_bytes -= len(item[1])
+
+    # -------------------------
+    # API
+    # -------------------------
+    async def get(self, photo_id: str, load):
+        """
+        (bytes, source) with source "hot", "cache" or "store"; `load` is an
+        async callable returning the photo bytes (or None) on a miss.
+        """
+        heat = self._touch(photo_id)
+        data = self._hot_get(photo_id)
+        if data is not None:
+            CACHE_REQUESTS.labels("photo", "hot").inc()
+            return data, "hot"
+
+        fut = self.inflight.get(photo_id)
+        while fut is not None:
+            # someone is already fetching it: wait for that result
+            self.coalesced += 1
+            CACHE_REQUESTS.labels("photo", "coalesced").inc()
+            try:
+                return await asyncio.shield(fut)
+            except _LeaderCancelled:
+                # its request went away mid-load: the first waiter takes over
+                fut = self.inflight.get(photo_id)
+
+        fut = self.inflight[photo_id] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._load(photo_id, load, heat)
+            fut.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # never cancel the shared future: waiters would fail with
+            # CancelledError although their own requests are fine
+            fut.set_exception(_LeaderCancelled())
+            fut.exception()
+            raise
+        except Exception as exc:
+            fut.set_exception(exc)
+            fut.exception()     # waiters still get it; no "never retrieved" warning
+            raise
+        finally:
+            del self.inflight[photo_id]
+
+    async def _load(self, photo_id: str, load, heat: float):
+        with REDIS_LATENCY.labels("get").time():
+            data = await self.r.get(KEY_PREFIX + photo_id)
+        if data is not None:
+            CACHE_REQUESTS.labels("photo", "hit").inc()
+            self._hot_put(photo_id, data, heat)
+            return data, "cache"
+        CACHE_REQUESTS.labels("photo", "miss").inc()
+        data = await load()
+        if data is None:
+            return None, "store"
+        await self.put(photo_id, data, heat)
+        return data, "store"
+
+    async def put(self, photo_id: str, data: bytes, heat: float = None):
+        if heat is None:
+            heat = self._touch(photo_id)
+        self._hot_put(photo_id, data, heat)
+        with REDIS_LATENCY.labels("set").time():
+            await self.r.set(KEY_PREFIX + photo_id, data, ex=self.ttl(heat, len(data)))
+
+    async def get_many(self, photo_ids: list):
+        """{photo_id: bytes} for the photos found in either tier (one MGET)."""
+        found = {}
+        rest = []
+        heats = {}
+        for photo_id in photo_ids:
+            heats[photo_id] = self._touch(photo_id)
+            data = self._hot_get(photo_id)
+            if data is None:
+                rest.append(photo_id)
+            else:
+                found[photo_id] = data
+        if rest:
+            with REDIS_LATENCY.labels("mget").time():
+                values = await self.r.mget([KEY_PREFIX + pid for pid in rest])
+            for photo_id, data in zip(rest, values):
+                if data is not None:
+                    found[photo_id] = data
+                    self._hot_put(photo_id, data, heats[photo_id])
+        CACHE_REQUESTS.labels("photo", "hit").inc(len(found))
+        CACHE_REQUESTS.labels("photo", "miss").inc(len(photo_ids) - len(found))
+        return found
+
+    async def put_many(self, photos: dict):
+        async with self.r.pipeline(transaction=False) as pipe:
+            for photo_id, data in photos.items():
+                heat = self.heat.get(photo_id, (1.0, 0))[0]
+                self._hot_put(photo_id, data, heat)
+                pipe.set(KEY_PREFIX + photo_id, data, ex=self.ttl(heat, len(data)))
+            with REDIS_LATENCY.labels("pipeline").time():
+                await pipe.execute()
+
+    async def invalidate(self, photo_id: str):
+        self._hot_drop(photo_id)
+        await self.r.delete(KEY_PREFIX + photo_id)
+
+    def stats(self):
+        return {
+            "hot_entries": len(self.hot),
+            "hot_bytes": self.hot_bytes,
+            "hot_capacity_bytes": HOT_CACHE_BYTES,
+            "inflight": len(self.inflight),
+            "coalesced": self.coalesced,
+        }
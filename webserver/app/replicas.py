@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+from collections import deque
+from .metrics import READ_HEDGES, READ_FAILOVERS
+
+# weight of the newest sample in the per-replica latency average
+READ_EWMA_ALPHA = float(os.getenv('READ_EWMA_ALPHA', '0.2'))
+# hedge after the p95 of recent read latencies, clamped to [MIN, MAX]
+READ_HEDGE_MIN = float(os.getenv('READ_HEDGE_MIN_MS', '5')) / 1000
+READ_HEDGE_MAX = float(os.getenv('READ_HEDGE_MAX_MS', '500')) / 1000
+# replicas that just failed are tried last for this long
+READ_FAILURE_PENALTY = float(os.getenv('READ_FAILURE_PENALTY_SECONDS', '10'))
+LATENCY_WINDOW = 1000
+# the p95 is recomputed from the window every this many samples
+HEDGE_RECOMPUTE_EVERY = 50
+
+
+class ReplicaMissing(Exception):
+    """The replica answered but does not hold the photo: fail over, no penalty."""
+
+
+class ReplicaStats:
+    __slots__ = ("ewma", "outstanding", "failed_until")
+
+    def __init__(self):
+        self.ewma = 0.0          # seconds, 0 until the first sample
+        self.outstanding = 0
+        self.failed_until = 0.0
+
+
+class ReplicaRouter:
+    """
+    Picks which replica of a photo to read from and hedges slow reads.
+
+    Replicas are ranked by latency EWMA times (outstanding requests + 1),
+    with recently failed ones last. A read goes to the best replica; if
+    it has not answered after the current p95 read latency, the next one
+    is asked too and the first success wins. Errors fail over to the next
+    replica immediately.
+    """
+
+    def __init__(self):
+        self.stats = {}                     # (store_id, volume) -> ReplicaStats
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._hedge_delay = READ_HEDGE_MAX
+        self._samples = 0
+        self.hedges = 0
+        self.failovers = 0
+
+    def _stats(self, rloc):
+        key = (rloc['store_id'], rloc['volume'])
+        st = self.stats.get(key)
+        if st is None:
+            st = self.stats[key] = ReplicaStats()
+        return st
+
+    def order(self, replicas: list):
+        now = time.monotonic()
+
+        def score(rloc):
+            st = self._stats(rloc)
+            return (st.failed_until > now, st.ewma * (st.outstanding + 1))
+        return sorted(replicas, key=score)
+
+    def hedge_delay(self):
+        return self._hedge_delay
+
+    def _record(self, elapsed):
+        # sorting the window on every read would put O(n log n) on the
+        # hot path; the p95 only needs to follow the trend
+        self.latencies.append(elapsed)
+        self._samples += 1
+        if len(self.latencies) >= 20 and (len(self.latencies) == 20 or self._samples >= HEDGE_RECOMPUTE_EVERY):
+            self._samples = 0
+            p95 = sorted(self.latencies)[int(len(self.latencies) * 0.95)]
+            self._hedge_delay = min(max(p95, READ_HEDGE_MIN), READ_HEDGE_MAX)
+
+    @staticmethod
+    def _observe(st, elapsed):
+        st.ewma = elapsed if st.ewma == 0 else st.ewma + READ_EWMA_ALPHA * (elapsed - st.ewma)
+
+    async def _attempt(self, rloc, fetch):
+        st = self._stats(rloc)
+        st.outstanding += 1
+        start = time.monotonic()
+        try:
+            result = await fetch(rloc)
+        except ReplicaMissing:
+            raise
+        except asyncio.CancelledError:
+            # lost a hedge race: it took at least this long
+            self._observe(st, time.monotonic() - start)
+            raise
+        except Exception:
+            st.failed_until = time.monotonic() + READ_FAILURE_PENALTY
+            raise
+        finally:
+            st.outstanding -= 1
+        elapsed = time.monotonic() - start
+        self._observe(st, elapsed)
+        st.failed_until = 0.0
+        self._record(elapsed)
+        return result
+
+    async def read(self, replicas: list, fetch):
+        """
+        await fetch(rloc) on the best replica, hedging/failing over to
+        the others. If every replica failed, raises ReplicaMissing only
+        when all of them said so, else the last upstream error.
+        """
+        candidates = self.order(replicas)
+        running = set()
+        error = None
+        upstream = None     # last failure other than ReplicaMissing
+        try:
+            while candidates or running:
+                if candidates and (not running or error is not None):
+                    # first attempt, or the previous one failed: go now
+                    running.add(asyncio.create_task(self._attempt(candidates.pop(0), fetch)))
+                    error = None
+                timeout = self.hedge_delay() if candidates else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # slow replica: hedge to the next one
+                    self.hedges += 1
+                    READ_HEDGES.inc()
+                    running.add(asyncio.create_task(self._attempt(candidates.pop(0), fetch)))
+                    continue
+                for task in done:
+                    running.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if not isinstance(error, ReplicaMissing):
+                        upstream = error
+                if candidates:
+                    self.failovers += 1
+                    READ_FAILOVERS.inc()
+        finally:
+            for task in running:
+                task.cancel()
+        raise upstream or ReplicaMissing()
+
+    def snapshot(self):
+        return {
+            "hedge_delay_ms": self.hedge_delay() * 1000,
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "replicas": [
+                {"store_id": sid, "volume": vol, "ewma_ms": st.ewma * 1000, "outstanding": st.outstanding}
+                for (sid, vol), st in self.stats.items()
+            ],
+        }
@@ -1,8 +1,17 @@
-from fastapi import APIRouter, Body, UploadFile, File, HTTPException
+from fastapi import APIRouter, Body, UploadFile, File, HTTPException, Request
 import os
-import httpx
+import asyncio
 import base64
-import redis
+import struct
+import redis.asyncio as aioredis
+from .upstream import upstream
+from .access import AccessBuffer
+from .metacache import MetadataCache
+from .replicas import ReplicaRouter, ReplicaMissing
+from .metrics import CACHE_REQUESTS
+from .photocache import PhotoCache
+from .stores import StoreMap
+from fastapi.responses import StreamingResponse
 
 router = APIRouter()
 
@@ -11,85 +20,433 @@ STORE_SVC = os.getenv('STORE_SVC','http://store-service:8002')
 RM_SVC = os.getenv('RM_SVC','http://replication-manager:8003')
 REDIS_HOST = os.getenv('REDIS_HOST','cache')
 REDIS_PORT = int(os.getenv('REDIS_PORT','6379'))
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS','50'))
+# photos per /upload/batch or /photos/batch request
+BATCH_MAX_PHOTOS = int(os.getenv('BATCH_MAX_PHOTOS','500'))
+# /upload/stream: body chunks buffered per replica before the client is
+# slowed down to the pace of the slowest store
+UPLOAD_STREAM_QUEUE_CHUNKS = int(os.getenv('UPLOAD_STREAM_QUEUE_CHUNKS','8'))
 
-r = redis.Redis(host=REDIS_HOST,port=REDIS_PORT,decode_responses=True)
+# /photos/batch (and store /store/read_batch) frames: FRAME header
+# (id length, status, data length) followed by the id and the data
+FRAME = struct.Struct(">HBQ")
+FRAME_OK = 0
+FRAME_MISSING = 1
+# no replica answered (store errors); the photo may well exist
+FRAME_ERROR = 2
+
+# async client: a slow Redis only delays the requests waiting on it,
+# not every request on the event loop; photos are stored as raw bytes
+r = aioredis.Redis(connection_pool=aioredis.ConnectionPool(
+    host=REDIS_HOST, port=REDIS_PORT, decode_responses=False, max_connections=REDIS_MAX_CONNECTIONS
+))
+
+
+async def _send_access_counts(counts: dict):
+    resp = await upstream(RM_SVC).post("/access/bulk_update", json={"counts": counts})
+    resp.raise_for_status()
+
+# access events are aggregated here and flushed in the background
+access = AccessBuffer(_send_access_counts)
+
+
+async def _fetch_directory_changes(epoch: str, since: int):
+    resp = await upstream(DIR_SVC).get("/directory/changes", params={"epoch": epoch, "since": since})
+    resp.raise_for_status()
+    return resp.json()
+
+# directory entries, invalidated through the directory's change feed
+meta_cache = MetadataCache(_fetch_directory_changes)
+
+
+async def _fetch_stores():
+    resp = await upstream(DIR_SVC).get("/directory/volumes")
+    resp.raise_for_status()
+    return resp.json()["stores"]
+
+# store node addresses, as registered with the directory
+store_map = StoreMap(_fetch_stores, STORE_SVC)
+
+# replica choice, hedging and failover for store reads
+replica_router = ReplicaRouter()
+
+# in-process hot tier + Redis, with single-flight store reads
+photo_cache = PhotoCache(r)
+
+
+async def _lookup(photo_id: str):
+    """Directory entry for a photo, from the local cache when possible."""
+    entry = meta_cache.get(photo_id)
+    CACHE_REQUESTS.labels("directory", "miss" if entry is None else "hit").inc()
+    if entry is None:
+        token = meta_cache.token()
+        resp = await upstream(DIR_SVC).get(f"/directory/fetch/{photo_id}")
+        if resp.status_code != 200:
+            return None
+        entry = resp.json()
+        meta_cache.put(photo_id, entry, token)
+    return entry
+
+async def _lookup_many(photo_ids: list):
+    """{photo_id: entry} for the photos the directory knows, one round trip for cache misses."""
+    found = {}
+    missing = []
+    for photo_id in photo_ids:
+        entry = meta_cache.get(photo_id)
+        if entry is None:
+            missing.append(photo_id)
+        else:
+            found[photo_id] = entry
+    if missing:
+        token = meta_cache.token()
+        resp = await upstream(DIR_SVC).post("/directory/fetch_batch", json={"photo_ids": missing})
+        resp.raise_for_status()
+        for photo_id, entry in resp.json()["entries"].items():
+            meta_cache.put(photo_id, entry, token)
+            found[photo_id] = entry
+    return found
+
+
+def _store_url(store_id: str):
+    return store_map.url(store_id)
+
+
+async def _read_replica(photo_id: str, rloc: dict):
+    resp = await upstream(_store_url(rloc['store_id'])).get(
+        f"/store/blob/{photo_id}", params={"volume_id": rloc['volume']}
+    )
+    if resp.status_code == 404:
+        raise ReplicaMissing()
+    resp.raise_for_status()
+    return resp.content
+
+
+async def _replica_size(photo_id: str, rloc: dict):
+    """Photo size from one replica, via a one-byte Range read."""
+    resp = await upstream(_store_url(rloc['store_id'])).get(
+        f"/store/blob/{photo_id}", params={"volume_id": rloc['volume']}, headers={"Range": "bytes=0-0"}
+    )
+    if resp.status_code == 404:
+        raise ReplicaMissing()
+    if resp.status_code in (206, 416):
+        # "bytes 0-0/<size>", or "bytes */0" for an empty photo
+        return int(resp.headers["content-range"].rsplit("/", 1)[1])
+    resp.raise_for_status()
+    return len(resp.content)
+
+
+async def _read_photo(photo_id: str, replicas: list):
+    """Photo bytes from the best replica, hedged and with failover; None if no replica has it."""
+    try:
+        return await replica_router.read(replicas, lambda rloc: _read_replica(photo_id, rloc))
+    except ReplicaMissing:
+        return None
+
+
+async def _read_frames(resp):
+    """Parse a FRAME stream from an httpx response into {photo_id: bytes or None}."""
+    out = {}
+    buf = bytearray()
+    async for chunk in resp.aiter_bytes():
+        buf += chunk
+        while len(buf) >= FRAME.size:
+            id_len, status, size = FRAME.unpack_from(buf)
+            end = FRAME.size + id_len + size
+            if len(buf) < end:
+                break
+            photo_id = bytes(buf[FRAME.size:FRAME.size + id_len]).decode()
+            out[photo_id] = bytes(buf[FRAME.size + id_len:end]) if status == FRAME_OK else None
+            del buf[:end]
+    return out
+
+
+async def _read_batch(store_id: str, photos: list):
+    async with upstream(_store_url(store_id)).stream(
+        "POST", "/store/read_batch", json={"photos": photos}
+    ) as resp:
+        resp.raise_for_status()
+        return await _read_frames(resp)
+
+
+async def _read_rest(photo_id: str, replicas: list, tried: dict, tried_failed: bool):
+    """
+    A photo the batch read did not return from `tried`: read it from the
+    other replicas (hedged, with failover). Bytes, None if it is missing
+    everywhere, or the exception if some replica failed.
+    """
+    others = [r for r in replicas if (r['store_id'], r['volume']) != (tried['store_id'], tried['volume'])]
+    try:
+        if others:
+            return await replica_router.read(others, lambda rloc: _read_replica(photo_id, rloc))
+    except ReplicaMissing:
+        pass
+    except Exception as exc:
+        return exc
+    return ConnectionError(f"store {tried['store_id']} failed") if tried_failed else None
+
+
+def _iter_frames(photo_ids: list, found: dict, failed=()):
+    for photo_id in photo_ids:
+        pid = photo_id.encode()
+        data = found.get(photo_id)
+        if data is None:
+            status = FRAME_ERROR if photo_id in failed else FRAME_MISSING
+            yield FRAME.pack(len(pid), status, 0) + pid
+        else:
+            yield FRAME.pack(len(pid), FRAME_OK, len(data)) + pid + data
 
 @router.post('/upload')
 async def upload(payload: dict = Body(...)):
-    # 1. RM update
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{RM_SVC}/access/update", json={"photo_id":"upload-temp","access_type":"upload"})
-    # 2. Directory allocate
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{DIR_SVC}/directory/upload", json={"photo_size": payload['photo_size']})
-        j = resp.json()
+    # 1. Directory allocate
+    resp = await upstream(DIR_SVC).post("/directory/upload", json={"photo_size": payload['photo_size']})
+    j = resp.json()
     photo_id = j['photo_id']
     replicas = j['replica_locations']
-    # 3. write to stores
-    write_results = []
-    async with httpx.AsyncClient() as client:
-        for rloc in replicas:
-            body = {"photo_id": photo_id, "volume_id": rloc['volume'], "photo_data": payload['data'], "cookie":"c"}
-            w = await client.post(f"{STORE_SVC}/store/write", json=body)
-            write_results.append(w.json())
-    # 4. confirm directory
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{DIR_SVC}/directory/upload/confirm", json={"photo_id":photo_id,"replicas":replicas})
+    # 2. write to stores, all replicas in parallel
+    writes = [
+        upstream(_store_url(rloc['store_id'])).post("/store/write", json={
+            "photo_id": photo_id, "volume_id": rloc['volume'], "photo_data": payload['data'], "cookie":"c"
+        })
+        for rloc in replicas
+    ]
+    write_results = [w.json() for w in await asyncio.gather(*writes)]
+    # 3. confirm directory
+    await upstream(DIR_SVC).post("/directory/upload/confirm", json={"photo_id":photo_id,"replicas":replicas})
+    # 4. RM update (buffered): the upload counts as the photo's first access
+    access.record(photo_id)
     return {"photo_id":photo_id,"replicas":replicas,"status":"uploaded"}
 
+async def _queue_body(q: asyncio.Queue):
+    while True:
+        chunk = await q.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def _put_blob(store_id: str, photo_id: str, volume_id: str, size: int, q: asyncio.Queue):
+    resp = await upstream(_store_url(store_id)).put(
+        f"/store/blob/{photo_id}",
+        params={"volume_id": volume_id, "cookie": "c"},
+        headers={"Content-Length": str(size), "Content-Type": "application/octet-stream"},
+        content=_queue_body(q),
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _drain(q: asyncio.Queue):
+    # unblocks the producer once a replica upload has ended early
+    while not q.empty():
+        q.get_nowait()
+
+@router.post('/upload/stream')
+async def upload_stream(request: Request):
+    """
+    Raw request body = photo bytes (Content-Length required). The body is
+    forwarded chunk by chunk to PUT /store/blob on every replica at once
+    through small bounded queues, so memory per upload stays constant and
+    nothing is base64 encoded.
+    """
+    length = request.headers.get('content-length')
+    if not length:
+        raise HTTPException(status_code=411, detail='Content-Length required')
+    size = int(length)
+    resp = await upstream(DIR_SVC).post("/directory/upload", json={"photo_size": size})
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail=resp.json().get('detail'))
+    j = resp.json()
+    photo_id = j['photo_id']
+    replicas = j['replica_locations']
+
+    queues = [asyncio.Queue(maxsize=UPLOAD_STREAM_QUEUE_CHUNKS) for _ in replicas]
+    tasks = []
+    for rloc, q in zip(replicas, queues):
+        task = asyncio.create_task(_put_blob(rloc['store_id'], photo_id, rloc['volume'], size, q))
+        task.add_done_callback(lambda _, q=q: _drain(q))
+        tasks.append(task)
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            for q, task in zip(queues, tasks):
+                if not task.done():
+                    await q.put(chunk)
+        for q, task in zip(queues, tasks):
+            if not task.done():
+                await q.put(None)
+    except BaseException:
+        # client went away mid-body: abort the replica uploads
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    written = [
+        rloc for rloc, res in zip(replicas, results)
+        if isinstance(res, dict) and res.get('status') == 'success'
+    ]
+    if not written:
+        raise HTTPException(status_code=502, detail='no replica was written')
+    await upstream(DIR_SVC).post("/directory/upload/confirm", json={"photo_id":photo_id,"replicas":written})
+    access.record(photo_id)
+    return {"photo_id":photo_id,"replicas":written,"status":"uploaded"}
+
+@router.post('/upload/batch')
+async def upload_batch(payload: dict = Body(...)):
+    """
+    {"photos": [{"data": b64, "photo_size": n}]} -> one directory
+    allocation, one write_batch per store, one directory confirm.
+    """
+    photos = payload.get('photos', [])
+    if len(photos) > BATCH_MAX_PHOTOS:
+        raise HTTPException(status_code=413, detail=f'at most {BATCH_MAX_PHOTOS} photos per batch')
+    if not photos:
+        return {"photos": [], "status": "uploaded"}
+    resp = await upstream(DIR_SVC).post(
+        "/directory/upload/batch", json={"photo_sizes": [p['photo_size'] for p in photos]}
+    )
+    if resp.status_code != 200:
+        raise HTTPException(status_code=resp.status_code, detail=resp.json().get('detail'))
+    allocations = resp.json()['allocations']
+
+    by_store = {}
+    for photo, alloc in zip(photos, allocations):
+        for rloc in alloc['replica_locations']:
+            by_store.setdefault(rloc['store_id'], []).append({
+                "photo_id": alloc['photo_id'], "volume_id": rloc['volume'],
+                "photo_data": photo['data'], "cookie": "c"
+            })
+    writes = await asyncio.gather(*(
+        upstream(_store_url(store_id)).post("/store/write_batch", json={"needles": needles})
+        for store_id, needles in by_store.items()
+    ))
+    failed = set()
+    for w in writes:
+        for res in w.json()['results']:
+            if res['status'] != 'success':
+                failed.add(res['photo_id'])
+
+    confirmed = [
+        {"photo_id": a['photo_id'], "replicas": a['replica_locations']}
+        for a in allocations if a['photo_id'] not in failed
+    ]
+    await upstream(DIR_SVC).post("/directory/upload/confirm_batch", json={"photos": confirmed})
+    for c in confirmed:
+        access.record(c['photo_id'])
+    return {"photos": [
+        {
+            "photo_id": a['photo_id'], "replicas": a['replica_locations'],
+            "status": "failed" if a['photo_id'] in failed else "uploaded",
+        }
+        for a in allocations
+    ]}
+
+@router.post('/photos/batch')
+async def fetch_batch(payload: dict = Body(...)):
+    """
+    {"photo_ids": [...]} -> application/octet-stream of FRAME records in
+    request order (FRAME_MISSING for unknown/deleted photos, FRAME_ERROR
+    when no replica answered). Directory lookups, Redis and store reads
+    are one round trip each per batch (per store for the latter); what a
+    store did not return is read one by one from the other replicas.
+    """
+    photo_ids = list(dict.fromkeys(payload.get('photo_ids', [])))
+    if len(photo_ids) > BATCH_MAX_PHOTOS:
+        raise HTTPException(status_code=413, detail=f'at most {BATCH_MAX_PHOTOS} photos per batch')
+    for photo_id in photo_ids:
+        access.record(photo_id)
+
+    entries = await _lookup_many(photo_ids)
+    known = [pid for pid in photo_ids if pid in entries and not entries[pid].get('deleted')]
+    found = await photo_cache.get_many(known) if known else {}
+
+    # the rest: one read_batch per store, photos tagged with their volume
+    by_store = {}
+    for photo_id in known:
+        if photo_id in found or not entries[photo_id]['replicas']:
+            continue
+        rloc = replica_router.order(entries[photo_id]['replicas'])[0]
+        by_store.setdefault(rloc['store_id'], []).append({"photo_id": photo_id, "volume_id": rloc['volume']})
+    failed = set()
+    if by_store:
+        results = await asyncio.gather(*(
+            _read_batch(store_id, photos) for store_id, photos in by_store.items()
+        ), return_exceptions=True)
+        fresh = {}
+        rest = []
+        for (store_id, photos), res in zip(by_store.items(), results):
+            store_failed = isinstance(res, Exception)
+            for p in photos:
+                data = None if store_failed else res.get(p['photo_id'])
+                if data is not None:
+                    fresh[p['photo_id']] = data
+                else:
+                    tried = {"store_id": store_id, "volume": p['volume_id']}
+                    rest.append((p['photo_id'], tried, store_failed))
+        if rest:
+            retried = await asyncio.gather(*(
+                _read_rest(pid, entries[pid]['replicas'], tried, store_failed)
+                for pid, tried, store_failed in rest
+            ))
+            for (pid, _, _), data in zip(rest, retried):
+                if isinstance(data, Exception):
+                    failed.add(pid)
+                elif data is not None:
+                    fresh[pid] = data
+        if fresh:
+            await photo_cache.put_many(fresh)
+            found.update(fresh)
+
+    return StreamingResponse(_iter_frames(photo_ids, found, failed), media_type="application/octet-stream")
+
 @router.get('/photo/{photo_id}')
 async def fetch(photo_id: str):
-    # 1. RM update
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{RM_SVC}/access/update", json={"photo_id":photo_id,"access_type":"fetch"})
-    # 2. Directory fetch
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{DIR_SVC}/directory/fetch/{photo_id}")
-        if resp.status_code != 200:
-            raise HTTPException(status_code=404, detail='not found')
-        entry = resp.json()
-    # 3. try cache
-    cached = r.get(f"photo:{photo_id}")
-    if cached:
-        return {"photo_id":photo_id,"data":cached,"source":"cache"}
-    # 4. read from first replica
-    replicas = entry['replicas']
-    # For simplicity, ask store service for the id
-    async with httpx.AsyncClient() as client:
-        store_resp = await client.get(f"{STORE_SVC}/store/read/{photo_id}")
-        if store_resp.status_code != 200:
-            raise HTTPException(status_code=404, detail='not found in store')
-        data = store_resp.json()['data']
-    
-    # cache result
-    r.set(f"photo:{photo_id}", data, ex=300)
-
-    #inform replicate manager
-    async with httpx.AsyncClient() as client:
-        await client.post(
-            "http://replication-manager:8003/access/update",
-            json={"photo_id": photo_id}
-        )
+    # 1. RM update (buffered, flushed in bulk off the request path)
+    access.record(photo_id)
+    # 2. Directory fetch (cached)
+    entry = await _lookup(photo_id)
+    if entry is None or entry.get('deleted'):
+        raise HTTPException(status_code=404, detail='not found')
+    # 3. hot tier, then Redis, then the best replica (hedged, with
+    # failover); concurrent misses for the photo share one store read
+    try:
+        data, source = await photo_cache.get(photo_id, lambda: _read_photo(photo_id, entry['replicas']))
+    except Exception:
+        raise HTTPException(status_code=502, detail='no replica answered')
+    if data is None:
+        raise HTTPException(status_code=404, detail='not found in store')
+
+    return {"photo_id":photo_id,"data":base64.b64encode(data).decode(),"source":source}
 
-    return {"photo_id":photo_id,"data":data,"source":"store"}
+@router.get('/internal/replicas/stats')
+async def replica_stats():
+    return replica_router.snapshot()
+
+@router.get('/internal/cache/stats')
+async def cache_stats():
+    return photo_cache.stats()
 
 @router.delete('/photo/{photo_id}')
 async def delete(photo_id: str):
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{RM_SVC}/access/update", json={"photo_id":photo_id,"access_type":"delete"})
-        # directory returns replicas
-        resp = await client.delete(f"{DIR_SVC}/directory/delete/{photo_id}")
-        if resp.status_code != 200:
-            raise HTTPException(status_code=404, detail='not found')
-        entry = resp.json()
-        replicas = entry['replicas']
-        # ask store to delete
-        for rloc in replicas:
-            await client.post(f"{STORE_SVC}/store/delete/{photo_id}")
-        # confirm directory delete
-        await client.post(f"{DIR_SVC}/directory/delete/confirm", json={"photo_id":photo_id})
+    access.record(photo_id)
+    # directory returns replicas
+    resp = await upstream(DIR_SVC).delete(f"/directory/delete/{photo_id}")
+    if resp.status_code != 200:
+        raise HTTPException(status_code=404, detail='not found')
+    entry = resp.json()
+    replicas = entry['replicas']
+    # ask store to delete, all replicas in parallel
+    await asyncio.gather(*(
+        upstream(_store_url(rloc['store_id'])).post(f"/store/delete/{photo_id}", json={"volume_id": rloc['volume']})
+        for rloc in replicas
+    ))
+    # confirm directory delete
+    await upstream(DIR_SVC).post("/directory/delete/confirm", json={"photo_id":photo_id})
+    meta_cache.invalidate(photo_id)
     # drop cache
-    r.delete(f"photo:{photo_id}")
+    await photo_cache.invalidate(photo_id)
     return {"photo_id":photo_id,"status":"deleted"}
 
 
@@ -104,51 +461,85 @@ async def handle_replication(payload: dict = Body(...)):
     photo_id = payload["photo_id"]
     action = payload["action"]
 
-    async with httpx.AsyncClient() as client:
-        # 1️⃣ Get current and free locations from directory
-        resp = await client.get(f"{DIR_SVC}/directory/fetch/{photo_id}")
-        if resp.status_code != 200:
-            return {"status": "error", "reason": "photo not found"}
-        entry = resp.json()
-        replicas = entry["replicas"]
-
-        if action == "replicate_up":
-            # Directory should provide a new free location
-            resp_free = await client.post(f"{DIR_SVC}/directory/get_free_locations", json={"count": 1})
-            new_locations = resp_free.json().get("locations", [])
-
-            if not new_locations:
-                return {"status": "error", "reason": "no free locations"}
-
-            # Fetch from any current replica
-            source = replicas[0]
-            store_resp = await client.get(f"{STORE_SVC}/store/read/{photo_id}")
-            if store_resp.status_code != 200:
-                return {"status": "error", "reason": "failed reading from store"}
-            data = store_resp.json()["data"]
-
-            # Write to new locations
-            write_results = []
-            for loc in new_locations:
-                body = {"photo_id": photo_id, "volume_id": loc['volume'], "photo_data": data, "cookie": "c"}
-                w = await client.post(f"{STORE_SVC}/store/write", json=body)
-                write_results.append(w.json())
-
-            # Notify directory of new replicas
-            await client.post(f"{DIR_SVC}/directory/add_replicas", json={"photo_id": photo_id, "replicas": new_locations})
-
-            return {"status": "replicate_up_done", "new_replicas": new_locations}
-
-        elif action == "replicate_down":
-            # Remove half replicas
-            resp_remove = await client.post(f"{DIR_SVC}/directory/remove_replicas", json={"photo_id": photo_id})
-            remove_info = resp_remove.json()
-            to_remove = remove_info.get("replicas", [])
-
-            # Delete from store
-            for rloc in to_remove:
-                await client.post(f"{STORE_SVC}/store/delete/{photo_id}", json={"volume_id": rloc['volume']})
-
-            return {"status": "replicate_down_done", "removed_replicas": to_remove}
+    directory = upstream(DIR_SVC)
+
+    # 1️⃣ Get current and free locations from directory
+    resp = await directory.get(f"/directory/fetch/{photo_id}")
+    if resp.status_code != 200:
+        return {"status": "error", "reason": "photo not found"}
+    entry = resp.json()
+    replicas = entry["replicas"]
+
+    if action == "replicate_up":
+        # the new volume must have room for the photo, so ask with its size
+        try:
+            size = await replica_router.read(replicas, lambda rloc: _replica_size(photo_id, rloc))
+        except Exception:
+            return {"status": "error", "reason": "photo size unknown"}
+
+        # Directory should provide a new free location
+        resp_free = await directory.post(
+            "/directory/get_free_locations", json={"count": 1, "photo_id": photo_id, "photo_size": size}
+        )
+        new_locations = resp_free.json().get("locations", [])
+
+        if not new_locations:
+            return {"status": "error", "reason": "no free locations"}
+
+        # The source store copies the needle itself (store to store);
+        # we only coordinate. Try the next replica if a source fails.
+        copies = [
+            {
+                "photo_id": photo_id, "source_volume": None,
+                "target_store_id": loc['store_id'], "target_address": _store_url(loc['store_id']),
+                "target_volume": loc['volume'],
+            }
+            for loc in new_locations
+        ]
+        copied = []
+        for source in replica_router.order(replicas):
+            for c in copies:
+                c['source_volume'] = source['volume']
+            try:
+                resp = await upstream(_store_url(source['store_id'])).post(
+                    "/store/replicate", json={"copies": copies, "wait": True}
+                )
+                results = resp.json()['job']['results']
+            except Exception:
+                continue
+            copied = [
+                loc for loc in new_locations
+                if any(
+                    res['status'] == 'success' and res['target_volume'] == loc['volume']
+                    and res['target_store_id'] == loc['store_id']
+                    for res in results
+                )
+            ]
+            if copied:
+                break
+        if not copied:
+            return {"status": "error", "reason": "failed copying from store"}
+        new_locations = copied
+
+        # Notify directory of new replicas
+        await directory.post("/directory/add_replicas", json={"photo_id": photo_id, "replicas": new_locations})
+        meta_cache.invalidate(photo_id)
+
+        return {"status": "replicate_up_done", "new_replicas": new_locations}
+
+    elif action == "replicate_down":
+        # Remove half replicas
+        resp_remove = await directory.post("/directory/remove_replicas", json={"photo_id": photo_id})
+        remove_info = resp_remove.json()
+        to_remove = remove_info.get("replicas", [])
+        meta_cache.invalidate(photo_id)
+
+        # Delete from store in parallel
+        await asyncio.gather(*(
+            upstream(_store_url(rloc['store_id'])).post(f"/store/delete/{photo_id}", json={"volume_id": rloc['volume']})
+            for rloc in to_remove
+        ))
+
+        return {"status": "replicate_down_done", "removed_replicas": to_remove}
 
     return {"status": "unknown_action"}
@@ -0,0 +1,48 @@
+import os
+import asyncio
+
+STORE_MAP_REFRESH = float(os.getenv('STORE_MAP_REFRESH_SECONDS', '5'))
+
+
+class StoreMap:
+    """
+    store_id -> base URL of every store node, from the directory's volume
+    registry (`GET /directory/volumes`), refreshed every STORE_MAP_REFRESH.
+    Unknown ids resolve to `default` (the single-node STORE_SVC) until the
+    next refresh learns them.
+    """
+
+    def __init__(self, fetch_stores, default: str):
+        self.fetch_stores = fetch_stores    # async callable() -> [{"store_id", "address", ...}]
+        self.default = default
+        self.addresses = {}
+        self._task = None
+
+    def url(self, store_id: str) -> str:
+        return self.addresses.get(store_id) or self.default
+
+    async def refresh(self):
+        stores = await self.fetch_stores()
+        self.addresses = {s["store_id"]: s["address"] for s in stores if s.get("address")}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # keep the last known addresses
+                pass
+            await asyncio.sleep(STORE_MAP_REFRESH)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
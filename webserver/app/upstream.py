@@ -0,0 +1,44 @@
+import os
+import httpx
+from .metrics import httpx_hooks
+
+# Connection pool settings, shared by every upstream pool
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '10'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '2'))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '100'))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv('UPSTREAM_MAX_KEEPALIVE', '20'))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv('UPSTREAM_KEEPALIVE_EXPIRY', '30'))
+# uvicorn only speaks HTTP/1.1, so HTTP/2 only helps behind an h2-capable proxy
+UPSTREAM_HTTP2 = os.getenv('UPSTREAM_HTTP2', '0') == '1'
+
+_clients = {}   # base url -> httpx.AsyncClient
+
+
+def upstream(base_url: str) -> httpx.AsyncClient:
+    """
+    Application-lifetime keep-alive client for one upstream service.
+    Each upstream gets its own pool, so a slow service cannot use up the
+    connections of the others.
+    """
+    client = _clients.get(base_url)
+    if client is None:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            http2=UPSTREAM_HTTP2,
+            event_hooks=httpx_hooks(),
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _clients[base_url] = client
+    return client
+
+
+async def close_upstreams():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()